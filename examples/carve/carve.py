@@ -0,0 +1,103 @@
+"""
+Carve INDX blocks and FILE records from a volume, and dump what they contain.
+"""
+import sys
+import logging
+import argparse
+
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.BinaryParser import format_filetimes
+from ntfs.filesystem import NTFSFilesystem
+from ntfs.mft.MFT import MREF
+from ntfs import carve
+
+
+g_logger = logging.getLogger("ntfs.examples.carve")
+
+
+def format_index_entry(carved, active, entry):
+    fn = entry.filename_information()
+    mtime, atime, ctime, crtime = format_filetimes([
+        fn.modified_time_raw(), fn.accessed_time_raw(),
+        fn.changed_time_raw(), fn.created_time_raw()])
+    return u"INDX,{offset},{status},{inode},{parent},{filename},{size},{mtime},{atime},{ctime},{crtime}".format(
+        offset=hex(carved.offset),
+        status="active" if active else "slack",
+        inode=MREF(entry.header().mft_reference()),
+        parent=MREF(fn.mft_parent_reference()),
+        filename=fn.filename(),
+        size=fn.logical_size(),
+        mtime=mtime or "",
+        atime=atime or "",
+        ctime=ctime or "",
+        crtime=crtime or "")
+
+
+def format_mft_record(carved):
+    record = carved.structure()
+    fn = record.filename_information()
+    if fn:
+        filename = fn.filename()
+        parent = MREF(fn.mft_parent_reference())
+    else:
+        filename = ""
+        parent = ""
+    return u"FILE,{offset},{status},{inode},{parent},{filename}".format(
+        offset=hex(carved.offset),
+        status="active" if record.is_active() else "inactive",
+        inode=record.mft_record_number(),
+        parent=parent,
+        filename=filename)
+
+
+def output(line):
+    sys.stdout.write(line.encode("utf-8"))
+    sys.stdout.write("\n")
+
+
+def main(image_filename, volume_offset, unallocated=False, jobs=1):
+    with Mmap(image_filename) as buf:
+        v = FlatVolume(buf, volume_offset)
+
+        ranges = None
+        if unallocated:
+            fs = NTFSFilesystem(v)
+            ranges = list(carve.unallocated_ranges(fs))
+
+        if jobs == 1:
+            carved_structures = carve.carve(v, ranges=ranges)
+        else:
+            carved_structures = carve.carve_parallel(image_filename, volume_offset,
+                                                     ranges=ranges, jobs=jobs)
+
+        for carved in carved_structures:
+            try:
+                if carved.signature == carve.INDX_SIGNATURE:
+                    for _, active, entry in carve.carve_index_entries([carved]):
+                        output(format_index_entry(carved, active, entry))
+                else:
+                    output(format_mft_record(carved))
+            except Exception as e:
+                g_logger.warning("Failed to output structure at %s: %s",
+                                 hex(carved.offset), e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('img_file', help='Path to image file')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int)
+    parser.add_argument('-u', '--unallocated', default=False, action='store_true',
+                        help='Only carve the unallocated clusters')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.img_file, args.volume_offset,
+         unallocated=args.unallocated, jobs=args.jobs)
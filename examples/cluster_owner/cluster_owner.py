@@ -0,0 +1,116 @@
+"""
+Find the files that own the clusters at byte offsets into an image,
+  such as the hits of a carver or the sectors of a bad sector list.
+
+The map of clusters to files is built on the first run, and saved
+  next to the image for the following ones.
+"""
+import sys
+import logging
+import argparse
+
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.mft.MFT import Attribute
+from ntfs.filesystem import NTFSFilesystem
+from ntfs.ClusterMap import open_cluster_map
+from ntfs.ClusterMap import default_cluster_map_path
+
+
+g_logger = logging.getLogger("ntfs.examples.cluster_owner")
+
+
+HEADER = '"offset", "lcn", "record_num", "attribute", "vcn", "path"'
+ROW = u'"{offset:d}", "{lcn:d}", "{record_num}", "{attribute}", "{vcn}", "{path}"'
+
+
+def output(line):
+    sys.stdout.write(line.encode("utf-8"))
+    sys.stdout.write("\n")
+
+
+def read_offsets(filename):
+    """
+    Parse the offsets of a file, one per line, in decimal or hex.
+
+    @rtype: list of int
+    """
+    offsets = []
+    with open(filename, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            offsets.append(int(line, 0))
+    return offsets
+
+
+def format_attribute(owner):
+    attribute = Attribute.TYPES.get(owner.attribute_type, hex(owner.attribute_type))
+    if owner.attribute_name:
+        return u"%s:%s" % (attribute, owner.attribute_name)
+    return attribute
+
+
+def main(image_filename, volume_offset, offsets, save=True):
+    with Mmap(image_filename) as buf:
+        fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+        path = None
+        if save:
+            path = default_cluster_map_path(image_filename, volume_offset)
+        cluster_map = open_cluster_map(fs, path)
+        cluster_size = cluster_map.get_cluster_size()
+
+        enumerator = fs.get_mft_enumerator()
+        paths = {}
+
+        def get_path(record_number):
+            if record_number not in paths:
+                try:
+                    paths[record_number] = enumerator.get_path(enumerator.get_record(record_number))
+                except Exception as e:
+                    g_logger.warning("Failed to resolve path of record %d: %s", record_number, e)
+                    paths[record_number] = ""
+            return paths[record_number]
+
+        print(HEADER)
+        volume_offsets = (offset - volume_offset for offset in sorted(offsets))
+        for offset, owners in cluster_map.owners_of_offsets(volume_offsets):
+            lcn = offset // cluster_size
+            if not owners:
+                output(ROW.format(offset=offset + volume_offset, lcn=lcn,
+                                  record_num="", attribute="", vcn="", path=""))
+            for owner in owners:
+                output(ROW.format(offset=offset + volume_offset, lcn=lcn,
+                                  record_num=owner.record_number,
+                                  attribute=format_attribute(owner),
+                                  vcn=owner.get_vcn(lcn),
+                                  path=get_path(owner.record_number)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('img_file', help='Path to image file')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int, nargs="?", default=0)
+    parser.add_argument('-x', '--offset', default=[], action='append',
+                        type=lambda s: int(s, 0),
+                        help='Byte offset into the image, in decimal or hex. May be repeated')
+    parser.add_argument('-f', '--offsets-file', default=None,
+                        help='File of byte offsets into the image, one per line')
+    parser.add_argument('-n', '--no-save', default=False, action='store_true',
+                        help="Don't save the cluster map next to the image")
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    offsets = list(args.offset)
+    if args.offsets_file:
+        offsets.extend(read_offsets(args.offsets_file))
+    if not offsets:
+        parser.error("no offsets given, use --offset or --offsets-file")
+
+    main(args.img_file, args.volume_offset, offsets, save=not args.no_save)
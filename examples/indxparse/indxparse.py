@@ -1,185 +1,254 @@
 """
 Clone of INDXParse.py that processes an entire file system.
+
+Directories are enumerated from the MFT, and their paths are resolved
+  once, using the MFT enumerator's memoised path lookups. The INDX
+  parsing of each directory is fanned out to a pool of worker processes,
+  each of which opens the image itself. Results are written in MFT order,
+  so the output is the same regardless of the number of workers.
 """
-import argparse
-from datetime import datetime
+import sys
 import logging
+import argparse
+import itertools
+import multiprocessing
 
 from ntfs.volume import FlatVolume
 from ntfs.BinaryParser import Mmap
+from ntfs.BinaryParser import format_filetimes
+from ntfs.BinaryParser import filetimes_to_timestamps
 from ntfs.filesystem import NTFSFilesystem
+from ntfs.mft.MFT import FILE_SEP
+from ntfs.mft.MFT import MREF
 from ntfs.mft.MFT import AttributeNotFoundError
-from ntfs.mft.MFT import ATTR_TYPE
-from ntfs.mft.MFT import INDEX_ALLOCATION
-from ntfs.mft.MFT import INDEX_ROOT
 
 
 g_logger = logging.getLogger("ntfs.examples.indxparse")
 
+# the number of directories handed to a worker at a time
+CHUNK_DIRECTORIES = 16
+
 
 class InvalidArgumentError(Exception):
     pass
 
 
-def get_directory_index_active_entries(fs, directory):
+def get_directory_index_entries(fs, record):
     """
-    get the active MFT_INDEX_ENTRYs from a directory's
-    INDEX_ROOT and INDEX_ALLOCATION attributes
+    get the active and inactive (slack) MFT_INDEX_ENTRYs from a
+      directory's INDEX_ROOT and INDEX_ALLOCATION attributes.
+    each INDX block is decoded only once.
+
+    @rtype: (list of MFT_INDEX_ENTRY, list of MFT_INDEX_ENTRY)
+    @return: the active entries, and the slack entries.
     """
-    if not directory.is_directory():
+    if not record.is_directory():
         raise InvalidArgumentError()
 
-    # sorry, reaching
-    record = directory._record
-
-    ret = []
+    active = []
+    slack = []
 
     try:
-        indx_alloc_attr = record.attribute(ATTR_TYPE.INDEX_ALLOCATION)
-        indx_alloc = INDEX_ALLOCATION(fs.get_attribute_data(indx_alloc_attr), 0)
-        for block in indx_alloc.blocks():
-            for entry in block.index().entries():
-                ret.append(entry)
+        indx_root = fs.get_index_root(record)
     except AttributeNotFoundError:
-        pass
+        return active, slack
+
+    index = indx_root.index()
+    active.extend(index.entries())
+    slack.extend(index.slack_entries())
 
     try:
-        indx_root_attr = record.attribute(ATTR_TYPE.INDEX_ROOT)
-        indx_root = INDEX_ROOT(fs.get_attribute_data(indx_root_attr), 0)
-        for entry in indx_root.index().entries():
-            ret.append(entry)
+        indx_alloc = fs.get_index_allocation(record, indx_root=indx_root)
     except AttributeNotFoundError:
-        pass
+        return active, slack
 
-    return ret
+    for block in indx_alloc.blocks():
+        index = block.index()
+        active.extend(index.entries())
+        slack.extend(index.slack_entries())
+
+    # everything in a block that's no longer in use is slack
+    for block in indx_alloc.unallocated_blocks():
+        index = block.index()
+        slack.extend(index.entries())
+        slack.extend(index.slack_entries())
+
+    return active, slack
 
 
-def get_directory_index_inactive_entries(fs, directory):
+def make_row(active, path, entry):
     """
-    get the inactive (slack) MFT_INDEX_ENTRYs from a directory's
-    INDEX_ROOT and INDEX_ALLOCATION attributes
+    Extract the fields of interest from an index entry, so they can be
+      formatted in a batch, and sent between processes.
     """
-    if not directory.is_directory():
-        raise InvalidArgumentError()
+    fn = entry.filename_information()
+    return {
+        "active": active,
+        "path": path,
+        "inode": MREF(entry.header().mft_reference()),
+        "filename": fn.filename(),
+        "physical_size": fn.physical_size(),
+        "logical_size": fn.logical_size(),
+        "mtime": fn.modified_time_raw(),
+        "atime": fn.accessed_time_raw(),
+        "ctime": fn.changed_time_raw(),
+        "crtime": fn.created_time_raw(),
+    }
+
+
+def get_directory_index_rows(fs, inode, path):
+    rows = []
+    active, slack = get_directory_index_entries(fs, fs.get_record(inode))
+    for is_active, entries in ((True, active), (False, slack)):
+        for entry in entries:
+            try:
+                rows.append(make_row(is_active, path, entry))
+            except Exception as e:
+                g_logger.warning("Failed to parse entry in %s: %s", path, e)
+    return rows
 
-    # sorry, reaching
-    record = directory._record
 
-    ret = []
+def _convert_timestamps(rows, converter):
+    """
+    Convert the raw timestamps of all the rows at once, in place.
+    """
+    keys = ("mtime", "atime", "ctime", "crtime")
+    values = converter([row[key] for row in rows for key in keys])
+    for i, row in enumerate(rows):
+        for j, key in enumerate(keys):
+            row[key] = values[i * len(keys) + j]
 
-    try:
-        indx_alloc_attr = record.attribute(ATTR_TYPE.INDEX_ALLOCATION)
-        indx_alloc = INDEX_ALLOCATION(fs.get_attribute_data(indx_alloc_attr), 0)
-        for block in indx_alloc.blocks():
-            for entry in block.index().slack_entries():
-                ret.append(entry)
-    except AttributeNotFoundError:
-        pass
 
-    try:
-        indx_root_attr = record.attribute(ATTR_TYPE.INDEX_ROOT)
-        indx_root = INDEX_ROOT(fs.get_attribute_data(indx_root_attr), 0)
-        for entry in indx_root.index().slack_entries():
-            ret.append(entry)
-    except AttributeNotFoundError:
-        pass
+def csv_directory_index_formatter(rows):
+    """
+    `rows` is a list of dicts, as created by `make_row`.
 
+    @rtype: list of unicode
+    """
+    _convert_timestamps(rows, format_filetimes)
+    f = (u"{status},{path},{filename},{physical_size},{logical_size},{mtime},"
+         u"{atime},{ctime},{crtime}")
+    ret = []
+    for row in rows:
+        ret.append(f.format(
+            status="active" if row["active"] else "slack",
+            path=row["path"],
+            filename=row["filename"],
+            physical_size=row["physical_size"],
+            logical_size=row["logical_size"],
+            mtime=row["mtime"] or "",
+            atime=row["atime"] or "",
+            ctime=row["ctime"] or "",
+            crtime=row["crtime"] or ""))
     return ret
 
 
-def make_dump_directory_indices_visitor(formatter):
+def bodyfile_directory_index_formatter(rows):
     """
-    `formatter` is a function that accepts a dict, and returns a string.
-    the string is dumped via print().
-    the schema for the dict is:
-      active: bool
-      path: str
-      entry: MFT_INDEX_ENTRY
-
-    this function returns a function that applies the format to the
-      given FileSystem and Directory and dumps it out.
+    Format rows in the mactime bodyfile format, see:
+      http://wiki.sleuthkit.org/index.php?title=Body_file
+
+    @rtype: list of unicode
     """
-    def dump_directory_indices_visitor(fs, directory):
-        for e in get_directory_index_active_entries(fs, directory):
-            try:
-                print(formatter({
-                    "active": True,
-                    "path": directory.get_full_path(),
-                    "entry": e}))
-            except Exception as e:
-                g_logger.warning("Failed to output entry: %s", e)
-        for e in get_directory_index_inactive_entries(fs, directory):
-            try:
-                print(formatter({
-                    "active": False,
-                    "path": directory.get_full_path(),
-                    "entry": e}))
-            except Exception as e:
-                g_logger.warning("Failed to output entry: %s", e)
-    return dump_directory_indices_visitor
+    _convert_timestamps(rows, filetimes_to_timestamps)
+    f = (u"0|{path}{filename} ($FILE_NAME{slack})|{inode}|0|0|0|{size}|"
+         u"{atime}|{mtime}|{ctime}|{crtime}")
+    ret = []
+    for row in rows:
+        path = row["path"]
+        if not path.endswith(FILE_SEP):
+            path += FILE_SEP
+        ret.append(f.format(
+            path=path,
+            filename=row["filename"],
+            slack="" if row["active"] else ", slack",
+            inode=row["inode"],
+            size=row["logical_size"],
+            atime=int(row["atime"] or 0),
+            mtime=int(row["mtime"] or 0),
+            ctime=int(row["ctime"] or 0),
+            crtime=int(row["crtime"] or 0)))
+    return ret
 
 
-def walk_directories(fs, directory, visitor):
+FORMATTERS = {
+    "csv": csv_directory_index_formatter,
+    "bodyfile": bodyfile_directory_index_formatter,
+}
+
+
+def enumerate_directories(fs, path):
     """
-    `visitor` is a function that accepts two parameters: a FileSystem
-      and a Directory
+    Yield (record number, path) for each active directory in the MFT
+      at or below the given path.
 
-    this function applies the function `visitor` to each directory
-      in the file system recursively.
+    The paths are resolved from the table of directories collected
+      in one flyweight pass, so no record is parsed twice.
+      See `MFTDirectoryTable` for how they differ from `get_record_path`.
     """
-    visitor(fs, directory)
-    for d in directory.get_directories():
-        walk_directories(fs, d, visitor)
+    prefix = path.rstrip(FILE_SEP)
+    table = fs.get_mft_enumerator().get_directory_table()
+    for reference in table.references():
+        directory_path = table.get_path(reference) or FILE_SEP
+        if prefix and directory_path != prefix and \
+           not directory_path.startswith(prefix + FILE_SEP):
+            continue
+        yield MREF(reference), directory_path
 
 
-def safe_date(f):
-    try:
-        return f()
-    except ValueError:
-        return datetime(1970, 1, 1, 0, 0, 0)
+# state private to each worker process, set up by `_init_worker`
+g_worker = {}
 
 
-def csv_directory_index_formatter(e):
-    entry = e["entry"].filename_information()
-    fn = entry.filename()
-    f = (u"{status},{path},{filename},{physical_size},{logical_size},{mtime},"
-         u"{atime},{ctime},{crtime}")
-    if e["active"]:
-        status = "active"
-    else:
-        status = "slack"
-
-    return f.format(
-        status=status,
-        path=e["path"],
-        filename=entry.filename(),
-        physical_size=entry.physical_size(),
-        logical_size=entry.logical_size(),
-        mtime=safe_date(entry.modified_time),
-        atime=safe_date(entry.accessed_time),
-        ctime=safe_date(entry.changed_time),
-        crtime=safe_date(entry.created_time))
-
-
-def bodyfile_directory_index_formatter(e):
-    # TODO
-    pass
+def _init_worker(image_filename, volume_offset, format):
+    mmap = Mmap(image_filename)
+    g_worker["mmap"] = mmap
+    g_worker["fs"] = NTFSFilesystem(FlatVolume(mmap.__enter__(), volume_offset))
+    g_worker["formatter"] = FORMATTERS[format]
+
 
+def _process_directory(task):
+    inode, path = task
+    try:
+        rows = get_directory_index_rows(g_worker["fs"], inode, path)
+        return [l.encode("utf-8") for l in g_worker["formatter"](rows)]
+    except Exception as e:
+        g_logger.warning("Failed to parse directory %s: %s", path, e)
+        return []
 
-def main(image_filename, volume_offset, path):
+
+def main(image_filename, volume_offset, path, format="csv", jobs=None):
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
 
     with Mmap(image_filename) as buf:
-        v = FlatVolume(buf, volume_offset)
-        fs = NTFSFilesystem(v)
-        root = fs.get_root_directory()
+        fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+        if path != "/":
+            path = fs.get_record_path(fs.get_root_directory().get_path_entry(path)._record)
+        else:
+            path = FILE_SEP
+        directories = enumerate_directories(fs, path)
 
-        if path == "/":
-            entry = root
+        if jobs == 1:
+            _init_worker(image_filename, volume_offset, format)
+            results = itertools.imap(_process_directory, directories)
+            pool = None
         else:
-            entry = root.get_path_entry(path)
+            pool = multiprocessing.Pool(jobs, _init_worker,
+                                        (image_filename, volume_offset, format))
+            # imap preserves the order of the directories
+            results = pool.imap(_process_directory, directories, CHUNK_DIRECTORIES)
+
+        try:
+            for lines in results:
+                for line in lines:
+                    sys.stdout.write(line)
+                    sys.stdout.write("\n")
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-        v = make_dump_directory_indices_visitor(csv_directory_index_formatter)
-        walk_directories(fs, entry, v)
 
 if __name__ == '__main__':
 
@@ -189,6 +258,10 @@ if __name__ == '__main__':
                                               'to Boot Sector Section',
                         type=int)
     parser.add_argument('path', help='Path')
+    parser.add_argument('-f', '--format', default="csv", choices=sorted(FORMATTERS.keys()),
+                        help='Output format')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of worker processes (default: one per CPU)')
     parser.add_argument('-d', '--debug', default=False, action='store_true')
     args = parser.parse_args()
 
@@ -196,4 +269,5 @@ if __name__ == '__main__':
         logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("ntfs.mft").setLevel(logging.INFO)
 
-    main(args.img_file, args.volume_offset, args.path)
+    main(args.img_file, args.volume_offset, args.path,
+         format=args.format, jobs=args.jobs)
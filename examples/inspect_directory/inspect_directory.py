@@ -9,7 +9,6 @@ from ntfs.filesystem import NTFSFilesystem
 from ntfs.mft.MFT import AttributeNotFoundError
 from ntfs.mft.MFT import ATTR_TYPE
 from ntfs.mft.MFT import MREF
-from ntfs.mft.MFT import INDEX_ALLOCATION
 from ntfs.mft.MFT import INDEX_ROOT
 
 
@@ -39,8 +38,7 @@ def main(image_filename, volume_offset, path):
 
         entries = {}
         try:
-            indx_alloc_attr = record.attribute(ATTR_TYPE.INDEX_ALLOCATION)
-            indx_alloc = INDEX_ALLOCATION(fs.get_attribute_data(indx_alloc_attr), 0)
+            indx_alloc = fs.get_index_allocation(record)
             g_logger.debug("INDEX_ALLOCATION len: %s", hex(len(indx_alloc)))
             g_logger.debug("alloc:\n%s", indx_alloc.get_all_string(indent=2))
             indx = indx_alloc
@@ -0,0 +1,125 @@
+"""
+Measure the aggregate read throughput of a mounted image at
+  several numbers of concurrent readers.
+
+Mount the image first, such as with:
+
+    python mount.py --multithreaded image.bin 0 /mnt/ntfs
+
+then run:
+
+    python benchmark.py /mnt/ntfs
+
+Each round reads every regular file under the mount point once,
+  split across the readers. Use the same image for all rounds: the
+  first round also warms the mount's caches, so use --warmup to
+  discard it.
+"""
+import os
+import sys
+import time
+import Queue
+import logging
+import argparse
+import threading
+
+
+g_logger = logging.getLogger("ntfs.examples.mount.benchmark")
+
+DEFAULT_READERS = (1, 4, 16)
+READ_SIZE = 128 * 1024
+
+
+def list_files(mountpoint):
+    """
+    @rtype: list of str
+    """
+    paths = []
+    for root, _, filenames in os.walk(mountpoint):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+
+def read_file(path):
+    """
+    @return: The number of bytes read.
+    """
+    total = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                return total
+            total += len(chunk)
+
+
+def run_round(paths, readers):
+    """
+    @return: (bytes read, seconds elapsed, number of errors)
+    """
+    queue = Queue.Queue()
+    for path in paths:
+        queue.put(path)
+
+    results = []
+    results_lock = threading.Lock()
+
+    def reader():
+        total = 0
+        errors = 0
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                total += read_file(path)
+            except (IOError, OSError) as e:
+                g_logger.warning("Failed to read %s: %s", path, e)
+                errors += 1
+        with results_lock:
+            results.append((total, errors))
+
+    threads = [threading.Thread(target=reader) for _ in xrange(readers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    return (sum(r[0] for r in results), elapsed, sum(r[1] for r in results))
+
+
+def main(mountpoint, readers=DEFAULT_READERS, warmup=False):
+    paths = list_files(mountpoint)
+    g_logger.info("found %d files", len(paths))
+    if warmup:
+        run_round(paths, max(readers))
+
+    print("readers, bytes, seconds, MB/s, errors")
+    for count in readers:
+        total, elapsed, errors = run_round(paths, count)
+        print("%d, %d, %.3f, %.1f, %d" % (
+            count, total, elapsed,
+            (total / (1024.0 * 1024.0)) / elapsed if elapsed else 0.0, errors))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mountpoint', help='Directory on which the image is mounted')
+    parser.add_argument('-r', '--readers', type=int, action='append', default=None,
+                        help='Number of concurrent readers, may be repeated '
+                             '(default: %s)' % (", ".join(map(str, DEFAULT_READERS))))
+    parser.add_argument('-w', '--warmup', default=False, action='store_true',
+                        help='Read everything once before measuring')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.mountpoint, readers=args.readers or DEFAULT_READERS, warmup=args.warmup)
@@ -2,19 +2,55 @@ from __future__ import with_statement
 
 import os
 import sys
+import time
 import stat
 import errno
-import inspect
+import signal
 import logging
+import threading
+import argparse
 import calendar
 
 from fuse import FUSE, FuseOSError, Operations, fuse_get_context
 
+from ntfs.Cache import MemoryBudget
+from ntfs.Cache import MEGABYTE
+from ntfs.Cache import KILOBYTE
+from ntfs.filesystem import NTFSFile
+from ntfs.filesystem import NTFSDirectory
 from ntfs.filesystem import NTFSFilesystem
-from ntfs.filesystem import ChildNotFoundError
+from ntfs.filesystem import INODE_ROOT
+from ntfs.mft.MFT import MREF
+from ntfs.mft.MFT import MSEQNO
 
 PERMISSION_ALL_READ = int("444", 8)
 
+# statvfs flag of a read-only file system
+ST_RDONLY = 1
+# NTFS names are up to 255 UTF-16 code units
+NAME_MAX = 255
+
+# the memory shared by the record, path, dentry, attribute and directory caches
+DEFAULT_CACHE_BYTES = 256 * MEGABYTE
+
+# the dentry of a path that doesn't exist
+NOT_FOUND = -1
+
+# the virtual directories, under the root, of the records that can't
+#   be reached from the root, and the record numbers standing for them
+ORPHAN_NAME = u"$ORPHAN"
+DELETED_NAME = u"$DELETED"
+ORPHAN_DIRECTORY = -2
+DELETED_DIRECTORY = -3
+
+# separates the name of a file from the name of one of its data streams
+STREAM_SEPARATOR = ":"
+
+# once reads are sequential, readahead starts at the min and
+#   doubles with each read, up to the max
+READAHEAD_MIN = 128 * KILOBYTE
+READAHEAD_MAX = 4 * MEGABYTE
+
 g_logger = logging.getLogger("ntfs.examples.mount")
 
 
@@ -27,131 +63,491 @@ def unixtimestamp(ts):
     return calendar.timegm(ts.utctimetuple())
 
 
-def log(func):
+# where the tracing statistics are exposed, as a virtual file
+STATS_PATH = "/$STATS"
+
+# latencies are counted in power of two buckets of microseconds
+LATENCY_BUCKETS = 32
+
+
+class OperationStats(object):
+    __slots__ = ("count", "errors", "total", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.histogram = [0] * LATENCY_BUCKETS
+
+    def add(self, elapsed, failed):
+        self.count += 1
+        if failed:
+            self.errors += 1
+        self.total += elapsed
+        bucket = min(int(elapsed * 1000000).bit_length(), LATENCY_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def format(self, name):
+        lines = ["%s: calls: %d errors: %d mean: %.1fus" % (
+            name, self.count, self.errors,
+            (self.total * 1000000 / self.count) if self.count else 0.0)]
+        for bucket, count in enumerate(self.histogram):
+            if count:
+                lines.append("  < %dus: %d" % (1 << bucket, count))
+        return "\n".join(lines)
+
+
+class TracingOperations(Operations):
     """
-    log is a decorator that logs the a function call with its
-      parameters and return value.
+    Wrap FUSE operations to count the calls to each and histogram
+      their latencies.
+
+    The wrapper is only installed when tracing is enabled, so an
+      untraced mount pays nothing for it. The statistics are read from
+      the virtual file `STATS_PATH`, or written to stderr by `dump`,
+      such as from a SIGUSR1 handler.
     """
-    def inner(*args, **kwargs):
-        func_name = inspect.stack()[3][3]
-        if func_name == "_wrapper":
-            func_name = inspect.stack()[2][3]
-        (uid, gid, pid) = fuse_get_context()
-        pre = "(%s: UID=%d GID=%d PID=%d ARGS=(%s) KWARGS=(%s))" % (
-            func_name, uid, gid, pid,
-            ", ".join(map(str, list(args)[1:])), str(**kwargs))
+    def __init__(self, operations):
+        super(TracingOperations, self).__init__()
+        self._operations = operations
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self._report = ""
+
+    def __call__(self, op, *args):
+        if args and args[0] == STATS_PATH:
+            return self._stats_file(op, *args)
+
+        debug = g_logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            g_logger.debug("call: %s%r", op, args)
+        failed = True
+        start = time.time()
         try:
-            g_logger.debug("log: call: %s",  pre)
-            ret = func(*args, **kwargs)
-            g_logger.debug("log: result: %s", ret)
+            ret = self._operations(op, *args)
+            failed = False
             return ret
-        except Exception as e:
-            g_logger.warning("log: exception: %s", str(e))
-            raise e
-    return inner
+        finally:
+            elapsed = time.time() - start
+            with self._stats_lock:
+                stats = self._stats.get(op)
+                if stats is None:
+                    stats = OperationStats()
+                    self._stats[op] = stats
+                stats.add(elapsed, failed)
+            if debug:
+                g_logger.debug("%s: %s after %.1fus", op,
+                               "failed" if failed else "returned", elapsed * 1000000)
+
+    def report(self):
+        """
+        @rtype: str
+        """
+        with self._stats_lock:
+            lines = [self._stats[op].format(op) for op in sorted(self._stats)]
+        if hasattr(self._operations, "get_caches"):
+            lines.extend(str(cache) for cache in self._operations.get_caches())
+        return "".join(line + "\n" for line in lines)
+
+    def dump(self, *args):
+        sys.stderr.write(self.report())
+        sys.stderr.flush()
+
+    def _stats_file(self, op, path, *args):
+        if op == "getattr":
+            # snapshot the report, so the size matches what's read
+            self._report = self.report()
+            return {
+                "st_mode": (stat.S_IFREG | PERMISSION_ALL_READ),
+                "st_nlink": 1,
+                "st_size": len(self._report),
+            }
+        elif op == "open":
+            return 0
+        elif op == "read":
+            length, offset, _ = args
+            return self._report[offset:offset + length]
+        elif op in ("flush", "release"):
+            return 0
+        raise FuseOSError(errno.EROFS)
+
+
+class OpenFile(object):
+    """
+    The state of an open file: its data stream, prepared once so that
+      the runlist isn't decoded for each read, and a readahead buffer
+      that grows while the reads are sequential.
+    Reads through one handle are serialized, reads through different
+      handles are not.
+    """
+    __slots__ = ("entry", "_data", "_size", "_next_offset", "_window",
+                 "_buffer", "_buffer_offset", "_lock")
+
+    def __init__(self, entry, stream=""):
+        """
+        @type entry: ntfs.filesystem.NTFSFile
+        @type stream: unicode
+        @param stream: The name of the data stream, by default the unnamed one.
+        """
+        self.entry = entry
+        self._data = entry.get_data(stream)
+        if stream:
+            self._size = entry.get_stream_size(stream) or 0
+        else:
+            self._size = entry.get_size()
+        self._next_offset = 0
+        self._window = 0
+        self._buffer = ""
+        self._buffer_offset = 0
+        self._lock = threading.Lock()
+
+    def read(self, offset, length):
+        if offset >= self._size:
+            return ""
+        length = min(length, self._size - offset)
+        with self._lock:
+            return self._read(offset, length)
+
+    def _read(self, offset, length):
+        buffer_start = offset - self._buffer_offset
+        if 0 <= buffer_start and buffer_start + length <= len(self._buffer):
+            ret = self._buffer[buffer_start:buffer_start + length]
+        elif offset == self._next_offset:
+            self._window = min(max(self._window * 2, READAHEAD_MIN), READAHEAD_MAX)
+            end = min(self._size, offset + max(length, self._window))
+            self._buffer = bytes(self._data[offset:end])
+            self._buffer_offset = offset
+            ret = self._buffer[:length]
+        else:
+            self._window = 0
+            ret = bytes(self._data[offset:offset + length])
+        self._next_offset = offset + length
+        return ret
+
+
+class RecordTable(object):
+    """
+    The parent and allocation state of all the records, built in one
+      pass over the MFT, to list the records that can't be reached from
+      the root: orphans, whose parent directory is gone, and records that
+      were deleted but are still intact. Allocation is read from the
+      $MFT:$BITMAP, rather than trusting the flags of each record.
+    """
+    def __init__(self):
+        super(RecordTable, self).__init__()
+        # lists of (record number, name)
+        self.orphans = []
+        self.deleted = []
+
+    def load(self, fs):
+        """
+        @type fs: ntfs.filesystem.NTFSFilesystem
+        """
+        bitmap = fs.get_mft_bitmap()
+        if bitmap is not None:
+            bitmap = bytearray(bitmap)
+
+        # map from the record number of each directory to its sequence number
+        directories = {}
+        # list of (record number, parent reference, name)
+        allocated_records = []
+        for view in fs.get_mft_enumerator().enumerate_records(flyweight=True):
+            try:
+                if view.base_mft_record() != 0:
+                    # extension records are part of their base record
+                    continue
+                fn = view.filename_information()
+                if fn is None:
+                    continue
+                record_number = view.inode
+                if bitmap is not None and record_number >> 3 < len(bitmap):
+                    allocated = bitmap[record_number >> 3] & (1 << (record_number & 7))
+                else:
+                    allocated = view.is_active()
+
+                if not allocated:
+                    self.deleted.append((record_number, fn.filename()))
+                    continue
+                if view.is_directory():
+                    directories[record_number] = view.sequence_number()
+                allocated_records.append((record_number, fn.mft_parent_reference(),
+                                          fn.filename()))
+            except Exception as e:
+                g_logger.debug("Failed to parse record %d: %s", view.inode, e)
+
+        for record_number, parent_reference, name in allocated_records:
+            if record_number == INODE_ROOT:
+                continue
+            if directories.get(MREF(parent_reference)) != MSEQNO(parent_reference):
+                self.orphans.append((record_number, name))
+        g_logger.debug("found %d orphaned and %d deleted records",
+                       len(self.orphans), len(self.deleted))
+
+    def get_entries(self, directory):
+        """
+        @type directory: int
+        @param directory: ORPHAN_DIRECTORY or DELETED_DIRECTORY.
+        @rtype: list of (int, unicode)
+        @return: The record numbers and names of the directory's entries,
+          which are prefixed with the record number to keep them unique.
+        """
+        if directory == ORPHAN_DIRECTORY:
+            records = self.orphans
+        else:
+            records = self.deleted
+        return [(record_number, u"%d-%s" % (record_number, name))
+                for record_number, name in records]
 
 
 class NTFSFuseOperations(Operations):
-    def __init__(self, filesystem):
+    def __init__(self, filesystem, budget=None, records=None):
+        """
+        @type budget: ntfs.Cache.MemoryBudget
+        @param budget: The memory shared by the mount's caches, which
+          are thread safe if the budget is.
+        @type records: RecordTable
+        @param records: If provided, the orphaned and deleted records are
+          listed in the virtual directories $ORPHAN and $DELETED.
+        """
         self._fs = filesystem
+        self._records = records
+        # map from file handle to OpenFile
         self._opened_files = {}
-
-    def _get_path_entry(self, path):
-        root = self._fs.get_root_directory()
-        if path == "/":
-            g_logger.debug("asking for root")
-            entry = root
+        # released file handles, for reuse
+        self._free_fhs = []
+        self._next_fh = 0
+        self._fh_lock = threading.Lock()
+        if budget is None:
+            budget = MemoryBudget(DEFAULT_CACHE_BYTES)
+        # the image is read-only, so these never need invalidation.
+        # map from lowercase path to record number, or NOT_FOUND
+        self._dentries = budget.cache(name="dentries")
+        # map from record number, or (record number, stream name),
+        #   to getattr result, less the owner
+        self._attrs = budget.cache(name="attrs")
+        # map from record number to the names of the directory's children
+        self._dirents = budget.cache(name="dirents")
+
+    def get_caches(self):
+        return [self._dentries, self._attrs, self._dirents]
+
+    @staticmethod
+    def _dentry_key(path):
+        if isinstance(path, str):
+            path = path.decode("utf-8")
+        return path.lower()
+
+    def _load_directory(self, path, record_number):
+        """
+        List a directory, adding the dentries of all its children,
+          since finding one child decodes them all anyway.
+          Files are followed by their alternate data streams,
+          as "name:stream".
+
+        The dentries may be evicted as soon as they're added, such as
+          while a large directory is loaded into a small budget, so
+          lookups should use the returned map rather than the cache.
+
+        @rtype: (list of unicode, dict of unicode to int)
+        @return: The names of the entries, and the map from the
+          lowercase names of the children to their record numbers.
+        """
+        prefix = self._dentry_key(path).rstrip(u"/") + u"/"
+        names = []
+        children = {}
+        if record_number in (ORPHAN_DIRECTORY, DELETED_DIRECTORY):
+            for child_number, name in self._records.get_entries(record_number):
+                names.append(name)
+                children[name.lower()] = child_number
         else:
-            _, __, rest = path.partition("/")
-            g_logger.debug("asking for: %s", rest)
-            try:
-                entry = root.get_path_entry(rest)
-            except ChildNotFoundError:
+            record = self._fs.get_record(record_number)
+            if not record.is_directory():
+                raise FuseOSError(errno.ENOTDIR)
+
+            for child in self._fs.get_record_children(record):
+                fn = child.filename_information()
+                if fn is None:
+                    continue
+                name = fn.filename()
+                names.append(name)
+                if not child.is_directory():
+                    names.extend(name + STREAM_SEPARATOR + stream
+                                 for stream in NTFSFile(self._fs, child).get_stream_names())
+                for child_fn in child.filename_informations():
+                    children[child_fn.filename().lower()] = child.inode
+
+            if record_number == INODE_ROOT and self._records is not None:
+                for child_number, name in ((ORPHAN_DIRECTORY, ORPHAN_NAME),
+                                           (DELETED_DIRECTORY, DELETED_NAME)):
+                    names.append(name)
+                    children[name.lower()] = child_number
+
+        for name, child_number in children.iteritems():
+            self._dentries.insert(prefix + name, child_number)
+        self._dirents.insert(record_number, names)
+        return names, children
+
+    def _get_record_number(self, path):
+        if path == "/":
+            return INODE_ROOT
+
+        key = self._dentry_key(path)
+        record_number = self._dentries.lookup(key)
+        if record_number is None:
+            parent, _, name = path.rpartition("/")
+            parent = parent or "/"
+            g_logger.debug("loading directory: %s", parent)
+            _, children = self._load_directory(parent, self._get_record_number(parent))
+            record_number = children.get(self._dentry_key(name))
+            if record_number is None:
+                # only a fresh listing can tell that the name doesn't exist
+                record_number = NOT_FOUND
+                self._dentries.insert(key, NOT_FOUND)
+
+        if record_number == NOT_FOUND:
+            raise FuseOSError(errno.ENOENT)
+        return record_number
+
+    def _resolve(self, path):
+        """
+        @rtype: (int, unicode)
+        @return: The record number of the path, and the name of the data
+          stream it names, or "" for the unnamed stream.
+        """
+        parent, _, name = path.rpartition("/")
+        stream = u""
+        if STREAM_SEPARATOR in name:
+            name, _, stream = name.partition(STREAM_SEPARATOR)
+            path = parent + "/" + name
+            if isinstance(stream, str):
+                # stream names are compared with the UTF-16 names of attributes
+                stream = stream.decode("utf-8")
+        return self._get_record_number(path), stream
+
+    def _get_entry(self, record_number, stream=""):
+        if record_number < 0:
+            # a virtual directory
+            raise FuseOSError(errno.EISDIR)
+        record = self._fs.get_record(record_number)
+        if stream:
+            # directories may have alternate data streams, too
+            entry = NTFSFile(self._fs, record)
+            if entry.get_stream_size(stream) is None:
                 raise FuseOSError(errno.ENOENT)
-        return entry
-
-    # Filesystem methods
-    # ==================
-    @log
-    def getattr(self, path, fh=None):
-        (uid, gid, pid) = fuse_get_context()
-        entry = self._get_path_entry(path)
+            return entry
+        if record.is_directory():
+            return NTFSDirectory(self._fs, record)
+        else:
+            return NTFSFile(self._fs, record)
 
-        if entry.is_directory():
+    def _get_path_entry(self, path):
+        return self._get_entry(self._get_record_number(path))
+
+    def _get_attrs(self, record_number, stream=""):
+        key = (record_number, stream) if stream else record_number
+        attrs = self._attrs.lookup(key)
+        if attrs is not None:
+            return attrs
+
+        if record_number < 0:
+            attrs = {
+                "st_atime": 0,
+                "st_ctime": 0,
+                "st_mtime": 0,
+                "st_size": 0,
+                "st_mode": (stat.S_IFDIR | PERMISSION_ALL_READ),
+                "st_nlink": 2,
+            }
+            self._attrs.insert(key, attrs)
+            return attrs
+
+        entry = self._get_entry(record_number, stream)
+        if stream:
+            mode = (stat.S_IFREG | PERMISSION_ALL_READ)
+            nlink = 1
+            size = entry.get_stream_size(stream)
+        elif entry.is_directory():
             mode = (stat.S_IFDIR | PERMISSION_ALL_READ)
             nlink = 2
+            size = entry.get_size()
         else:
             mode = (stat.S_IFREG | PERMISSION_ALL_READ)
             nlink = 1
+            size = entry.get_size()
 
-        return {
+        attrs = {
             "st_atime": unixtimestamp(entry.get_si_accessed_timestamp()),
             "st_ctime": unixtimestamp(entry.get_si_changed_timestamp()),
             "st_crtime": unixtimestamp(entry.get_si_created_timestamp()),
             "st_mtime": unixtimestamp(entry.get_si_modified_timestamp()),
-            "st_size": entry.get_size(),
-            "st_uid": uid,
-            "st_gid": gid,
+            "st_size": size,
             "st_mode": mode,
             "st_nlink": nlink,
         }
+        self._attrs.insert(key, attrs)
+        return attrs
 
-    @log
-    def readdir(self, path, fh):
-        dirents = ['.', '..']
-        entry = self._get_path_entry(path)
+    # Filesystem methods
+    # ==================
+    def getattr(self, path, fh=None):
+        attrs = dict(self._get_attrs(*self._resolve(path)))
+        (uid, gid, pid) = fuse_get_context()
+        attrs["st_uid"] = uid
+        attrs["st_gid"] = gid
+        return attrs
 
-        dirents.extend(map(lambda r: r.get_name(), entry.get_children()))
-        return dirents
+    def readdir(self, path, fh):
+        record_number = self._get_record_number(path)
+        names = self._dirents.lookup(record_number)
+        if names is None:
+            names, _ = self._load_directory(path, record_number)
+        return ['.', '..'] + names
 
-    @log
     def readlink(self, path):
         return path
 
-    @log
     def statfs(self, path):
-        return dict((key, 0) for key in ('f_bavail', 'f_bfree',
-                                         'f_blocks', 'f_bsize', 'f_favail',
-                                         'f_ffree', 'f_files', 'f_flag',
-                                         'f_frsize', 'f_namemax'))
+        stats = self._fs.get_volume_statistics()
+        return {
+            "f_bsize": stats.cluster_size,
+            "f_frsize": stats.cluster_size,
+            "f_blocks": stats.total_clusters,
+            "f_bfree": stats.free_clusters(),
+            "f_bavail": stats.free_clusters(),
+            "f_files": stats.total_records,
+            "f_ffree": stats.free_records(),
+            "f_favail": stats.free_records(),
+            "f_flag": ST_RDONLY,
+            "f_namemax": NAME_MAX,
+        }
 
-    @log
     def chmod(self, path, mode):
         return errno.EROFS
 
-    @log
     def chown(self, path, uid, gid):
         return errno.EROFS
 
-    @log
     def mknod(self, path, mode, dev):
         return errno.EROFS
 
-    @log
     def rmdir(self, path):
         return errno.EROFS
 
-    @log
     def mkdir(self, path, mode):
         return errno.EROFS
 
-    @log
     def unlink(self, path):
         return errno.EROFS
 
-    @log
     def symlink(self, target, name):
         return errno.EROFS
 
-    @log
     def rename(self, old, new):
         return errno.EROFS
 
-    @log
     def link(self, target, name):
         return errno.EROFS
 
-    @log
     def utimens(self, path, times=None):
         return errno.EROFS
 
@@ -161,73 +557,102 @@ class NTFSFuseOperations(Operations):
     def _get_available_fh(self):
         """
         _get_available_fh returns an unused fh
-        The caller must be careful to handle race conditions.
         @rtype: int
         """
-        for i in xrange(65534):
-            if i not in self._opened_files:
-                return i
+        with self._fh_lock:
+            if self._free_fhs:
+                return self._free_fhs.pop()
+            fh = self._next_fh
+            self._next_fh += 1
+            return fh
 
-    @log
     def open(self, path, flags):
         if flags & os.O_WRONLY > 0:
             return errno.EROFS
         if flags & os.O_RDWR > 0:
             return errno.EROFS
 
-        entry = self._get_path_entry(path)
+        record_number, stream = self._resolve(path)
+        entry = self._get_entry(record_number, stream)
+        if not isinstance(entry, NTFSFile):
+            raise FuseOSError(errno.EISDIR)
 
-        # TODO(wb): race here on fh used/unused
         fh = self._get_available_fh()
-        self._opened_files[fh] = entry
+        self._opened_files[fh] = OpenFile(entry, stream)
 
         return fh
 
-    @log
     def read(self, path, length, offset, fh):
-        entry = self._opened_files[fh]
-        return entry.read(offset, length)
+        return self._opened_files[fh].read(offset, length)
 
-    @log
     def flush(self, path, fh):
         return ""
 
-    @log
     def release(self, path, fh):
         del self._opened_files[fh]
+        with self._fh_lock:
+            self._free_fhs.append(fh)
 
-    @log
     def create(self, path, mode, fi=None):
         return errno.EROFS
 
-    @log
     def write(self, path, buf, offset, fh):
         return errno.EROFS
 
-    @log
     def truncate(self, path, length, fh=None):
         return errno.EROFS
 
-    @log
     def fsync(self, path, fdatasync, fh):
         return errno.EPERM
 
 
-def main(image_filename, volume_offset, mountpoint):
+def main(image_filename, volume_offset, mountpoint, trace=False,
+         cache_bytes=DEFAULT_CACHE_BYTES, multithreaded=False, unreachable=True):
     from ntfs.volume import FlatVolume
     from ntfs.BinaryParser import Mmap
 
-    logging.basicConfig(level=logging.DEBUG)
-    logging.getLogger("ntfs.mft").setLevel(logging.INFO)
-
     with Mmap(image_filename) as buf:
         v = FlatVolume(buf, volume_offset)
-        fs = NTFSFilesystem(v)
-        handler = NTFSFuseOperations(fs)
-        FUSE(handler, mountpoint, foreground=True)
+        # the caches of the file system and the mount share one budget,
+        #   and its lock when threads share them
+        budget = MemoryBudget(cache_bytes, thread_safe=multithreaded)
+        fs = NTFSFilesystem(v, budget=budget)
+        records = None
+        if unreachable:
+            records = RecordTable()
+            records.load(fs)
+        handler = NTFSFuseOperations(fs, budget=budget, records=records)
+        if trace:
+            handler = TracingOperations(handler)
+            signal.signal(signal.SIGUSR1, handler.dump)
+        FUSE(handler, mountpoint, foreground=True, nothreads=not multithreaded)
 
 
 if __name__ == '__main__':
-    import sys
-    main(sys.argv[1], int(sys.argv[2]), sys.argv[3])
-
+    parser = argparse.ArgumentParser()
+    parser.add_argument('img_file', help='Path to image file')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int)
+    parser.add_argument('mountpoint', help='Directory on which to mount the volume')
+    parser.add_argument('-t', '--trace', default=False, action='store_true',
+                        help='Count the operations and their latencies, readable '
+                             'from %s in the mount, or dumped on SIGUSR1' % (STATS_PATH))
+    parser.add_argument('-c', '--cache-mb', type=int,
+                        default=DEFAULT_CACHE_BYTES / MEGABYTE,
+                        help='Memory for the record, path, attribute and directory caches')
+    parser.add_argument('-m', '--multithreaded', default=False, action='store_true',
+                        help='Serve operations from many threads')
+    parser.add_argument('-n', '--no-unreachable', default=False, action='store_true',
+                        help='Don\'t scan the MFT at mount time for the orphaned and '
+                             'deleted records listed in /%s and /%s' % (ORPHAN_NAME, DELETED_NAME))
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+        logging.getLogger("ntfs.mft").setLevel(logging.INFO)
+
+    main(args.img_file, args.volume_offset, args.mountpoint, trace=args.trace,
+         cache_bytes=args.cache_mb * MEGABYTE, multithreaded=args.multithreaded,
+         unreachable=not args.no_unreachable)
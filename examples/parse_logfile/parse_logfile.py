@@ -0,0 +1,93 @@
+"""
+Parse the log records of $LogFile into a CSV file.
+"""
+import sys
+import logging
+import argparse
+
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.filesystem import NTFSFilesystem
+from ntfs.logfile import LogFile
+from ntfs.logfile import open_logfile
+from ntfs.logfile import records_parallel
+
+
+g_logger = logging.getLogger("ntfs.examples.parse_logfile")
+
+
+HEADER = ('"lsn", "previous_lsn", "undo_next_lsn", "type", "transaction_id", '
+          '"redo_op", "undo_op", "target_attribute", "target_vcn", "record_offset", '
+          '"attribute_offset", "cluster_block_offset", "lcns", "redo_length", "undo_length"')
+
+ROW = (u'"{lsn:d}", "{previous_lsn:d}", "{undo_next_lsn:d}", "{type:d}", '
+       u'"{transaction_id:d}", "{redo_op:s}", "{undo_op:s}", "{target_attribute}", '
+       u'"{target_vcn}", "{record_offset}", "{attribute_offset}", '
+       u'"{cluster_block_offset}", "{lcns:s}", "{redo_length}", "{undo_length}"')
+
+
+def format_record(record):
+    def field(value):
+        return "" if value is None else value
+    return ROW.format(
+        lsn=record.lsn,
+        previous_lsn=record.client_previous_lsn,
+        undo_next_lsn=record.client_undo_next_lsn,
+        type=record.record_type,
+        transaction_id=record.transaction_id,
+        redo_op=record.redo_operation_name(),
+        undo_op=record.undo_operation_name(),
+        target_attribute=field(record.target_attribute),
+        target_vcn=field(record.target_vcn),
+        record_offset=field(record.record_offset),
+        attribute_offset=field(record.attribute_offset),
+        cluster_block_offset=field(record.cluster_block_offset),
+        lcns=" ".join(map(str, record.lcns())),
+        redo_length=field(record.redo_length),
+        undo_length=field(record.undo_length))
+
+
+def main(filename, volume_offset, raw=False, everything=False, jobs=1):
+    with Mmap(filename) as buf:
+        if raw:
+            logfile = LogFile(buf)
+        else:
+            logfile = open_logfile(NTFSFilesystem(FlatVolume(buf, volume_offset)))
+
+        start_lsn = None
+        if everything:
+            start_lsn = logfile.get_first_lsn()
+
+        if jobs == 1:
+            records = logfile.records(start_lsn=start_lsn)
+        else:
+            records = records_parallel(filename, volume_offset, raw=raw,
+                                       start_lsn=start_lsn, jobs=jobs)
+
+        print(HEADER)
+        for record in records:
+            sys.stdout.write(format_record(record).encode("utf-8"))
+            sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', help='Path to image file, or $LogFile file with --raw')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int, nargs="?", default=0)
+    parser.add_argument('-r', '--raw', default=False, action='store_true',
+                        help='The file is an extracted $LogFile')
+    parser.add_argument('-a', '--all', default=False, action='store_true',
+                        help='Dump all the records since the log last wrapped, '
+                             'rather than just those the restart area still needs')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.filename, args.volume_offset, raw=args.raw,
+         everything=args.all, jobs=args.jobs)
@@ -3,161 +3,186 @@ Parse a UsnJrnl:$J object into a CSV file.
 
 inspired by parser-usnjrnl by Seth Nazarro (http://code.google.com/p/parser-usnjrnl/)
 """
+import sys
 import logging
-import sys, struct, datetime
-
-class BadRecordException(Exception):
-    def __init__(self):
-        pass
-
-
-flag_def = {
-    0x00:       " ",
-    0x01:       "Data in one or more named data streams for the file was overwritten.",
-    0x02:       "The file or directory was added to.",
-    0x04:       "The file or directory was truncated.",
-    0x10:       "Data in one or more named data streams for the file was overwritten.",
-    0x20:       "One or more named data streams for the file were added to.",
-    0x40:       "One or more named data streams for the file was truncated.",
-    0x100:      "The file or directory was created for the first time.",
-    0x200:      "The file or directory was deleted.",
-    0x400:      "The user made a change to the file's or directory's extended attributes.",
-    0x800:      "A change was made in the access rights to the file or directory.",
-    0x1000:     "The file or directory was renamed and the file name in this structure is the previous name.",
-    0x2000:     "The file or directory was renamed and the file name in this structure is the new name.",
-    0x4000:     "A user toggled the FILE_ATTRIBUTE_NOT_CONTENT_INDEXED attribute.",
-    0x8000:     "A user has either changed one or more file or directory attributes or one or more time stamps.",
-    0x10000:    "An NTFS hard link was added to or removed from the file or directory",
-    0x20000:    "The compression state of the file or directory was changed from or to compressed.",
-    0x40000:    "The file or directory was encrypted or decrypted.",
-    0x80000:    "The object identifier of the file or directory was changed.",
-    0x100000:   "The reparse point contained in the file or directory was changed, or a reparse point was added to or deleted from the file or directory.",
-    0x200000:   "A named stream has been added to or removed from the file or a named stream has been renamed.",
-    0x80000000: "The file or directory was closed."
-}
+import argparse
 
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.BinaryParser import format_filetimes
+from ntfs.filesystem import NTFSFilesystem
+from ntfs.mft.MFT import MREF
+from ntfs.mft.MFT import MSEQNO
+from ntfs.usnjrnl import UsnJrnl
+from ntfs.usnjrnl import UsnCheckpoint
+from ntfs.usnjrnl import open_usnjrnl
+from ntfs.usnjrnl import open_path_resolver
+from ntfs.usnjrnl import reason_names
+from ntfs.usnjrnl import USN_RECORD_FIELDS
 
-attrs_def = {
-    1:    'READONLY',
-    2:    'HIDDEN',
-    4:    'SYSTEM',
-    8:    '???',
-    16:   'DIRECTORY',
-    32:   'ARCHIVE',
-    64:   'DEVICE',
-    128:  'NORMAL',
-    256:  'TEMPORARY',
-    512:  'SPARSE_FILE',
-    1024: 'REPARSE_POINT',
-    2048: 'COMPRESSED',
-    4096: 'OFFLINE',
-    8192: 'NOT_CONTENT_INDEXED',
-    16383:'ENCRYPTED',
-    65536:'VIRTUAL'
-}
 
+g_logger = logging.getLogger("ntfs.examples.parse_usnjrnl")
 
-def parse_windows_timestamp(qword):
-    # see http://integriography.wordpress.com/2010/01/16/using-phython-to-parse-and-present-windows-64-bit-timestamps/
-    return datetime.datetime.utcfromtimestamp(float(qword) * 1e-7 - 11644473600)
+
+attrs_def = {
+    0x1:     'READONLY',
+    0x2:     'HIDDEN',
+    0x4:     'SYSTEM',
+    0x10:    'DIRECTORY',
+    0x20:    'ARCHIVE',
+    0x40:    'DEVICE',
+    0x80:    'NORMAL',
+    0x100:   'TEMPORARY',
+    0x200:   'SPARSE_FILE',
+    0x400:   'REPARSE_POINT',
+    0x800:   'COMPRESSED',
+    0x1000:  'OFFLINE',
+    0x2000:  'NOT_CONTENT_INDEXED',
+    0x4000:  'ENCRYPTED',
+    0x10000: 'VIRTUAL'
+}
 
 
-def MREF(mft_reference):
+HEADER = ('"offset", "major", "minor", "file_ref", "file_ref_seq", "file_ref_mft_record_num", '
+          '"parent_ref", "parent_ref_seq", "parent_ref_mft_record_num", "usn", "timestamp", '
+          '"flags", "source", "sid", "attrs", "name"')
+PATH_HEADER = ', "path"'
+
+ROW = (u'"{offset:d}", "{major:d}", "{minor:d}", "{file_ref:d}", "{file_ref_seq:d}", '
+       u'"{file_ref_mft_record_num:d}", "{parent_ref:d}", "{parent_ref_seq:d}", '
+       u'"{parent_ref_mft_record_num:d}", "{usn:d}", "{timestamp:s}", "{flags:s}", '
+       u'"{source:d}", "{sid:d}", "{attrs:s}", "{name:s}"')
+PATH_ROW = u', "{path:s}"'
+
+
+def format_batch(batch):
+    timestamps = format_filetimes(batch["timestamp"])
+    paths = batch.get("path")
+    for i in xrange(len(batch["usn"])):
+        file_ref = batch["file_reference"][i]
+        parent_ref = batch["parent_reference"][i]
+        attrs = batch["file_attributes"][i]
+        line = ROW.format(
+            offset=batch["offset"][i],
+            major=batch["major_version"][i],
+            minor=batch["minor_version"][i],
+            file_ref=file_ref,
+            file_ref_seq=MSEQNO(file_ref),
+            file_ref_mft_record_num=MREF(file_ref),
+            parent_ref=parent_ref,
+            parent_ref_seq=MSEQNO(parent_ref),
+            parent_ref_mft_record_num=MREF(parent_ref),
+            usn=batch["usn"][i],
+            timestamp=(timestamps[i] or "") + "Z",
+            flags=" ".join(reason_names(batch["reason"][i])),
+            source=batch["source_info"][i],
+            sid=batch["security_id"][i],
+            attrs=" ".join([v for (k, v) in sorted(attrs_def.items()) if attrs & k]),
+            name=batch["filename"][i])
+        if paths is not None:
+            line += PATH_ROW.format(path=paths[i])
+        yield line
+
+
+def batches(records, batch_size=0x10000):
     """
-    Given a MREF/mft_reference, return the record number part.
+    Group USN_RECORDs into batches of columns, like `UsnJrnl.record_batches`.
     """
-    return mft_reference & 0xFFFFFFFFFFFF
+    batch = []
+    for record in records:
+        batch.append([getattr(record, field) for field in USN_RECORD_FIELDS])
+        if len(batch) >= batch_size:
+            yield dict(zip(USN_RECORD_FIELDS, map(list, zip(*batch))))
+            batch = []
+    if batch:
+        yield dict(zip(USN_RECORD_FIELDS, map(list, zip(*batch))))
 
 
-def MSEQNO(mft_reference):
+def dump(journal, start_usn=None, checkpoint_path=None, fs=None):
     """
-    Given a MREF/mft_reference, return the sequence number part.
+    Dump the records of the journal, optionally only those following
+      `start_usn`, or the checkpoint stored at `checkpoint_path`.
+      The checkpoint is updated once all the records have been written.
+    If `fs` is provided, the path of each record at the time of the
+      event is resolved against it.
     """
-    return (mft_reference >> 48) & 0xFFFF
-
-
-def process_record(buf):
-    offset = 0
-    while True:
-        record_size = struct.unpack_from("<i", buf[offset:])[0]
-        if record_size < 0:
-            raise BadRecordException
-        if record_size < 60:
-            offset += 4
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = UsnCheckpoint.load(checkpoint_path)
+    if start_usn is not None:
+        checkpoint = UsnCheckpoint(start_usn, start_usn)
+
+    def select():
+        if checkpoint is None:
+            return journal.records()
+        else:
+            return journal.records_since(checkpoint)
+    records = select()
+
+    # remember the last record, to update the checkpoint
+    last = []
+    def tracked(records):
+        for record in records:
+            last[:] = [record]
+            yield record
+
+    record_batches = batches(tracked(records))
+    if fs is None:
+        print(HEADER)
+    else:
+        print(HEADER + PATH_HEADER)
+        # a separate pass to rewind the resolver, see `open_path_resolver`
+        resolver = open_path_resolver(fs, select())
+        record_batches = resolver.annotate_batches(record_batches)
+
+    for batch in record_batches:
+        for line in format_batch(batch):
+            sys.stdout.write(line.encode("utf-8"))
+            sys.stdout.write("\n")
+
+    if checkpoint_path is not None and last:
+        sys.stdout.flush()
+        journal.checkpoint(last[0]).save(checkpoint_path)
+
+
+def main(filename, volume_offset, raw=False, start_usn=None, checkpoint_path=None,
+         paths=False):
+    with Mmap(filename) as buf:
+        fs = None
+        if raw:
+            # an extracted $J stream, where the sparse regions are zeros
+            journal = UsnJrnl(buf)
         else:
-            break
-
-    (size, major, minor, file_ref, parent_ref,
-     usn, timestamp, flags, source, sid, attrs,
-     name_length, unknown) = struct.unpack_from("<IHHQQQQIIIIHH", buf[offset:offset + record_size])
-    name = buf[offset + 0x3C:offset + 0x3C + name_length].decode("utf16")
-    return (offset, size, major, minor, file_ref, parent_ref, usn, timestamp, flags, source, sid, attrs, name_length, unknown, name)
-
-
-def main(filename, offset):
-    with open(filename, "rb") as f:
-        f_offset = 0
-
-        # get file size
-        f.seek(0, 2)
-        f_length = f.tell()
-        f_offset = offset
-        f.seek(f_offset)
-
-        # find start of data
-        while f.read(32) == "\x00" * 32:
-            f_offset += 655360 - 32
-            f.seek(f_offset)
-
-        if f_offset > 655360:
-            f_offset -= 655360
-
-        f.seek(f_offset)
-
-        # data starts within the next 655360
-        buf = f.read(655360)
-        for i in range(len(buf)):
-            if buf[i] != "\x00":
-                f_offset += i
-                f.seek(f_offset)
-                break
-            i += 1
-
-        # we are at the main records now
-        print '"size", "major", "minor", "file_ref", "file_ref_seq", "file_ref_mft_record_num", "parent_ref", "parent_ref_seq", "parent_ref_mft_record_num", "usn", "timestamp", "flags", "source", "sid", "attrs", "name_length", "unknown", "name"'
-        while True:
-            buf = f.read(min((f_length - f_offset), 800))
-            f.seek(f_offset)
-
-            (gap, size, major, minor, file_ref, parent_ref, usn, timestamp, flags, source, sid, attrs, name_length, unknown, name) = process_record(buf)
-            print '"{size:d}", "{major:d}", "{minor:d}", "{file_ref:d}", "{file_ref_seq:d}", "{file_ref_mft_record_num:d}", "{parent_ref:d}", "{parent_ref_seq:d}", "{parent_ref_mft_record_num:d}", "{usn:d}", "{timestamp:s}", "{flags:s}", "{source:d}", "{sid:d}", "{attrs:s}", "{name_length:d}", "{unknown:d}", "{name:s}"'.format(
-                        size=size,
-                        major=major,
-                        minor=minor,
-                        file_ref=file_ref,
-                        file_ref_seq=MSEQNO(file_ref),
-                        file_ref_mft_record_num=MREF(file_ref),
-                        parent_ref=parent_ref,
-                        parent_ref_seq=MSEQNO(parent_ref),
-                        parent_ref_mft_record_num=MREF(parent_ref),
-                        usn=usn,
-                        timestamp=parse_windows_timestamp(timestamp).isoformat("T") + "Z",
-                        flags=" ".join([v for (k, v) in flag_def.items() if flags & k]),
-                        source=source,
-                        sid=sid,
-                        attrs=" ".join([v for (k, v) in attrs_def.items() if attrs & k]),
-                        name_length=name_length,
-                        unknown=unknown,
-                        name=name)
-
-            f_offset += gap + size
-            if f_offset == f_length:
-                break
-            f.seek(f_offset)
+            fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+            journal = open_usnjrnl(fs)
+        dump(journal, start_usn=start_usn, checkpoint_path=checkpoint_path,
+             fs=fs if paths else None)
 
-if __name__ == '__main__':
-    offset = 0
 
-    if len(sys.argv) > 2:
-        offset = int(sys.argv[2])
-    main(sys.argv[1], offset)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', help='Path to image file, or $J file with --raw')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int, nargs="?", default=0)
+    parser.add_argument('-r', '--raw', default=False, action='store_true',
+                        help='The file is an extracted $UsnJrnl:$J stream')
+    parser.add_argument('-s', '--start-usn', type=int, default=None,
+                        help='Only dump the records following this USN')
+    parser.add_argument('-c', '--checkpoint', default=None,
+                        help='Only dump the records following those recorded '
+                             'in this checkpoint file, then update it')
+    parser.add_argument('-p', '--paths', default=False, action='store_true',
+                        help='Add the path of each record at the time of the event')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.paths and args.raw:
+        parser.error("--paths requires an image, not --raw")
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.filename, args.volume_offset, raw=args.raw,
+         start_usn=args.start_usn, checkpoint_path=args.checkpoint,
+         paths=args.paths)
@@ -0,0 +1,96 @@
+"""
+Report the owners and access rights of the files of a volume.
+"""
+import sys
+import logging
+import argparse
+
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.filesystem import NTFSFilesystem
+from ntfs.secure.report import WRITE_ACCESS
+from ntfs.secure.report import open_security_report
+
+
+g_logger = logging.getLogger("ntfs.examples.security_report")
+
+
+SUMMARY_HEADER = '"security_id", "records", "owner", "group", "aces"'
+SUMMARY_ROW = u'"{security_id}", "{records:d}", "{owner}", "{group}", "{aces}"'
+
+RECORD_HEADER = '"record_num", "security_id", "owner", "path"'
+RECORD_ROW = u'"{record_num:d}", "{security_id:d}", "{owner}", "{path}"'
+
+
+def format_aces(summary):
+    if summary.dacl is None:
+        return "NULL DACL"
+    return " ".join("%d:%s:0x%x" % (ace_type, sid, mask)
+                    for ace_type, _, mask, sid in summary.dacl)
+
+
+def output(line):
+    sys.stdout.write(line.encode("utf-8"))
+    sys.stdout.write("\n")
+
+
+def main(filename, volume_offset, owner=None, access=None):
+    with Mmap(filename) as buf:
+        fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+        report = open_security_report(fs)
+
+        if owner is None and access is None:
+            print(SUMMARY_HEADER)
+            for summary, count in report.group_counts():
+                if summary is None:
+                    continue
+                output(SUMMARY_ROW.format(
+                    security_id=summary.security_id,
+                    records=count,
+                    owner=summary.owner or "",
+                    group=summary.group or "",
+                    aces=format_aces(summary)))
+            return
+
+        if owner is not None:
+            records = report.records_owned_by(owner)
+        else:
+            records = report.records_with_access(access, WRITE_ACCESS)
+
+        enumerator = fs.get_mft_enumerator()
+        print(RECORD_HEADER)
+        for record_number, summary in records:
+            try:
+                path = enumerator.get_path(enumerator.get_record(record_number))
+            except Exception as e:
+                g_logger.warning("Failed to resolve path of record %d: %s", record_number, e)
+                path = ""
+            output(RECORD_ROW.format(
+                record_num=record_number,
+                security_id=summary.security_id,
+                owner=summary.owner or "",
+                path=path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', help='Path to image file')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int, nargs="?", default=0)
+    parser.add_argument('-o', '--owner', default=None,
+                        help='List the files owned by this SID')
+    parser.add_argument('-w', '--write-access', default=None, action='append',
+                        help='List the files this SID may write to. Repeat '
+                             'to add the SIDs of the groups of a user')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.owner and args.write_access:
+        parser.error("--owner and --write-access are exclusive")
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.filename, args.volume_offset, owner=args.owner,
+         access=args.write_access)
@@ -0,0 +1,55 @@
+"""
+Report the size and usage of a volume, like df.
+"""
+import logging
+import argparse
+
+from ntfs.volume import FlatVolume
+from ntfs.BinaryParser import Mmap
+from ntfs.filesystem import NTFSFilesystem
+
+
+g_logger = logging.getLogger("ntfs.examples.volume_stats")
+
+
+def percent(part, whole):
+    if whole == 0:
+        return 0
+    return int(round(100.0 * part / whole))
+
+
+def main(image_filename, volume_offset, inodes=False):
+    with Mmap(image_filename) as buf:
+        fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+        stats = fs.get_volume_statistics()
+
+        if inodes:
+            print("%-12s %12s %12s %12s %5s" % ("Volume", "Records", "RUsed", "RFree", "RUse%"))
+            print("%-12s %12d %12d %12d %4d%%" % (
+                volume_offset, stats.total_records, stats.allocated_records,
+                stats.free_records(), percent(stats.allocated_records, stats.total_records)))
+        else:
+            print("%-12s %12s %12s %12s %5s" % ("Volume", "1K-blocks", "Used", "Available", "Use%"))
+            print("%-12s %12d %12d %12d %4d%%" % (
+                volume_offset,
+                stats.total_clusters * stats.cluster_size / 1024,
+                stats.allocated_clusters * stats.cluster_size / 1024,
+                stats.free_clusters() * stats.cluster_size / 1024,
+                percent(stats.allocated_clusters, stats.total_clusters)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('img_file', help='Path to image file')
+    parser.add_argument('volume_offset', help='Offset in bytes '
+                                              'to Boot Sector Section',
+                        type=int, nargs="?", default=0)
+    parser.add_argument('-i', '--inodes', default=False, action='store_true',
+                        help='Report MFT records rather than clusters')
+    parser.add_argument('-d', '--debug', default=False, action='store_true')
+    args = parser.parse_args()
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    main(args.img_file, args.volume_offset, inodes=args.inodes)
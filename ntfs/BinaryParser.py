@@ -24,6 +24,12 @@ import struct
 import logging
 import cPickle
 from datetime import datetime
+from datetime import timedelta
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 g_logger = logging.getLogger("ntfs.BinaryParser")
 
@@ -282,9 +288,109 @@ def dosdate(dosdate, dostime):
         return datetime.datetime.min
 
 
+FILETIME_EPOCH = datetime(1601, 1, 1, 0, 0, 0)
+# the number of 100ns intervals between the FILETIME and Unix epochs
+FILETIME_UNIX_EPOCH = 116444736000000000
+# the largest FILETIME that a `datetime` can represent (9999-12-31)
+FILETIME_MAX = 2650467743999999999
+# len("YYYY-MM-DDTHH:MM:SS.ffffff")
+ISO_MICROSECOND_LENGTH = 26
+
+
 def parse_filetime(qword):
-    # see http://integriography.wordpress.com/2010/01/16/using-phython-to-parse-and-present-windows-64-bit-timestamps/
-    return datetime.utcfromtimestamp(float(qword) * 1e-7 - 11644473600)
+    """
+    Convert a FILETIME (100ns intervals since 1601-01-01 UTC) into
+      a naive UTC `datetime`. The conversion is exact to the microsecond.
+
+    @raise ValueError: if the value cannot be represented by a `datetime`.
+    """
+    try:
+        return FILETIME_EPOCH + timedelta(microseconds=qword // 10)
+    except OverflowError:
+        raise ValueError("FILETIME out of range: %s" % hex(qword))
+
+
+def filetime_from_datetime(dt):
+    """
+    Convert a naive UTC `datetime` into a FILETIME, such as to compare
+      against the raw values returned by `<field>_raw` accessors.
+    """
+    delta = dt - FILETIME_EPOCH
+    return (((delta.days * 86400) + delta.seconds) * 1000000 + delta.microseconds) * 10
+
+
+def _format_filetime(qword):
+    if not 0 <= qword <= FILETIME_MAX:
+        return None
+    dt = FILETIME_EPOCH + timedelta(microseconds=qword // 10)
+    # not strftime, which refuses years before 1900
+    return "%04d-%02d-%02dT%02d:%02d:%02d.%06d%d" % \
+        (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+         dt.microsecond, qword % 10)
+
+
+def _filetime_array(filetimes):
+    """
+    @return: (numpy.ndarray of uint64, numpy.ndarray of bool)
+      the values, and which of them are valid.
+    """
+    values = numpy.asarray(filetimes, dtype=numpy.uint64)
+    return values, values <= numpy.uint64(FILETIME_MAX)
+
+
+def format_filetimes(filetimes):
+    """
+    Convert a sequence of FILETIMEs into ISO 8601 strings with the full
+      100ns precision, like `2013-02-03T04:05:06.1234567`.
+    Invalid values become `None` rather than raising an exception.
+
+    This is vectorised with NumPy, when available.
+
+    @type filetimes: sequence of int, or numpy.ndarray
+    @rtype: list of str
+    """
+    if numpy is None or len(filetimes) == 0:
+        return [_format_filetime(q) for q in filetimes]
+
+    values, valid = _filetime_array(filetimes)
+    safe = numpy.where(valid, values, numpy.uint64(FILETIME_UNIX_EPOCH))
+    # shift to the Unix epoch before going signed, so nothing overflows
+    micros = (safe // numpy.uint64(10)).astype(numpy.int64) - (FILETIME_UNIX_EPOCH // 10)
+    stamps = numpy.datetime_as_string(micros.astype("datetime64[us]"), unit="us")
+    stamps = stamps.astype("S%d" % ISO_MICROSECOND_LENGTH)
+    # append the seventh fractional digit as a byte column,
+    #   which is much faster than numpy.char.add
+    chars = numpy.empty((len(values), ISO_MICROSECOND_LENGTH + 1), dtype=numpy.uint8)
+    chars[:, :-1] = stamps.view(numpy.uint8).reshape(len(values), ISO_MICROSECOND_LENGTH)
+    chars[:, -1] = (safe % numpy.uint64(10)).astype(numpy.uint8) + ord("0")
+    formatted = chars.view("S%d" % (ISO_MICROSECOND_LENGTH + 1)).ravel().tolist()
+    if not valid.all():
+        for i in numpy.nonzero(~valid)[0].tolist():
+            formatted[i] = None
+    return formatted
+
+
+def filetimes_to_timestamps(filetimes):
+    """
+    Convert a sequence of FILETIMEs into Unix timestamps (float seconds).
+    Invalid values become `None` rather than raising an exception.
+
+    This is vectorised with NumPy, when available.
+
+    @type filetimes: sequence of int, or numpy.ndarray
+    @rtype: list of float
+    """
+    if numpy is None or len(filetimes) == 0:
+        return [(q - FILETIME_UNIX_EPOCH) / 1e7 if 0 <= q <= FILETIME_MAX else None
+                for q in filetimes]
+
+    values, valid = _filetime_array(filetimes)
+    seconds = (values.astype(numpy.float64) - FILETIME_UNIX_EPOCH) / 1e7
+    timestamps = seconds.tolist()
+    if not valid.all():
+        for i in numpy.nonzero(~valid)[0].tolist():
+            timestamps[i] = None
+    return timestamps
 
 
 class BinaryParserException(Exception):
@@ -554,6 +660,11 @@ class Block(object):
 
         setattr(self, name, handler)
         setattr(self, "_off_" + name, offset)
+        if type_ == "filetime" and not is_generator:
+            # the raw int FILETIME, which is cheap and never raises ValueError
+            def raw_filetime_handler():
+                return self.unpack_qword(offset)
+            setattr(self, name + "_raw", raw_filetime_handler)
         self.add_explicit_field(offset, typename, name, length, count)
 
     def add_explicit_field(self, offset, typename, name, length=None, count=1):
@@ -866,10 +977,14 @@ class Block(object):
         """
         Returns a datetime from the QWORD Windows timestamp starting at
         the relative offset.
+        Fields declared as "filetime" also get a `<name>_raw` accessor
+        that returns the int FILETIME, which is much cheaper; see
+        `format_filetimes` to convert many of these at once.
         Arguments:
         - `offset`: The relative offset from the start of the block.
         Throws:
         - `OverrunBufferException`
+        - `ValueError`: if the timestamp is out of range.
         """
         return parse_filetime(self.unpack_qword(offset))
 
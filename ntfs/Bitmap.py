@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Allocation bitmaps, such as $Bitmap and $MFT:$BITMAP.
+
+Bit `i` of a bitmap is bit `i % 8` of byte `i / 8`, and is set if the
+  cluster (or record) `i` is allocated. Volumes have millions of
+  clusters, so bits are counted a large slice at a time: each byte is
+  translated to its number of set bits, and the translated slice is
+  tallied with `str.count`, which both run in C. Likewise, runs of
+  clear bits are found by searching for the bytes that end them with
+  a regular expression, and only those bytes are examined bit by bit.
+"""
+import re
+import logging
+
+
+g_logger = logging.getLogger("ntfs.Bitmap")
+
+# the number of bytes counted at a time
+POPCOUNT_CHUNK_SIZE = 0x100000
+
+# maps each byte to the number of bits set in it
+POPCOUNT_TABLE = "".join(chr(bin(i).count("1")) for i in xrange(0x100))
+
+# bytes with at least one clear bit, and with at least one set bit
+NOT_ALL_SET = re.compile("[^\xff]")
+NOT_ALL_CLEAR = re.compile("[^\x00]")
+
+
+def popcount(data):
+    """
+    Count the bits set in a bytestring.
+
+    @type data: str, bytearray or buffer
+    @rtype: int
+    """
+    total = 0
+    for offset in xrange(0, len(data), POPCOUNT_CHUNK_SIZE):
+        counts = bytes(data[offset:offset + POPCOUNT_CHUNK_SIZE]).translate(POPCOUNT_TABLE)
+        for bits in xrange(1, 9):
+            total += bits * counts.count(chr(bits))
+    return total
+
+
+class Bitmap(object):
+    """
+    A read-only bitmap, whose count of set bits is computed once.
+    """
+    def __init__(self, data, bit_count=None):
+        """
+        @type data: str
+        @type bit_count: int
+        @param bit_count: The number of bits in use. Bitmaps are padded,
+          such as $Bitmap past the end of the volume, and the padding
+          isn't counted. By default, all of `data`.
+        """
+        super(Bitmap, self).__init__()
+        if bit_count is None:
+            bit_count = len(data) * 8
+        bit_count = min(bit_count, len(data) * 8)
+        self._data = bytes(data[:(bit_count + 7) // 8])
+        self._bit_count = bit_count
+        self._set_count = None
+
+    def __len__(self):
+        return self._bit_count
+
+    def get_bytes(self):
+        """
+        @rtype: str
+        """
+        return self._data
+
+    def is_set(self, index):
+        if not 0 <= index < self._bit_count:
+            raise IndexError("bit %d is beyond the bitmap of %d bits" %
+                             (index, self._bit_count))
+        return bool(ord(self._data[index >> 3]) & (1 << (index & 7)))
+
+    def count_set(self):
+        """
+        @return: The number of set bits, such as the allocated clusters.
+        """
+        if self._set_count is None:
+            full_bytes = self._bit_count // 8
+            count = popcount(self._data[:full_bytes])
+            tail_bits = self._bit_count % 8
+            if tail_bits:
+                count += popcount(chr(ord(self._data[full_bytes]) & ((1 << tail_bits) - 1)))
+            self._set_count = count
+        return self._set_count
+
+    def count_clear(self):
+        """
+        @return: The number of clear bits, such as the free clusters.
+        """
+        return self._bit_count - self.count_set()
+
+    def clear_runs(self, min_length=1):
+        """
+        Yield the (start, length) runs of clear bits, such as the
+          extents of free clusters, in order.
+
+        @type min_length: int
+        @param min_length: Skip the runs shorter than this.
+        """
+        data = self._data
+        bit_count = self._bit_count
+        run_start = None
+        position = 0
+        while True:
+            # skip the bytes that can't end the current state
+            if run_start is None:
+                match = NOT_ALL_SET.search(data, position)
+            else:
+                match = NOT_ALL_CLEAR.search(data, position)
+            if match is None:
+                break
+            position = match.start()
+
+            b = ord(data[position])
+            index = position * 8
+            for bit in xrange(8):
+                if index + bit >= bit_count:
+                    break
+                if b & (1 << bit):
+                    if run_start is not None:
+                        if index + bit - run_start >= min_length:
+                            yield run_start, index + bit - run_start
+                        run_start = None
+                elif run_start is None:
+                    run_start = index + bit
+            position += 1
+
+        if run_start is not None and bit_count - run_start >= min_length:
+            yield run_start, bit_count - run_start
+
+    @staticmethod
+    def test():
+        assert popcount("") == 0
+        assert popcount("\xff" * 3) == 24
+        data = "".join(chr(i) for i in xrange(0x100)) * 0x2000
+        assert popcount(data) == sum(bin(i).count("1") for i in xrange(0x100)) * 0x2000
+
+        b = Bitmap("\x0f\xff\xff", bit_count=20)
+        assert len(b) == 20
+        assert b.is_set(0)
+        assert not b.is_set(4)
+        assert b.is_set(19)
+        assert b.count_set() == 16
+        assert b.count_clear() == 4
+        assert list(b.clear_runs()) == [(4, 4)]
+
+        b = Bitmap("\x00\x00\x81\xff\x01\x00\xf0", bit_count=53)
+        assert list(b.clear_runs()) == [(0, 16), (17, 6), (33, 19)]
+        assert list(b.clear_runs(min_length=7)) == [(0, 16), (33, 19)]
+        assert list(Bitmap("\xff\xff").clear_runs()) == []
+        assert list(Bitmap("\x00", bit_count=3).clear_runs()) == [(0, 3)]
+        return True
+
+
+def test():
+    if Bitmap.test():
+        print("Bitmap passed tests.")
+
+
+if __name__ == "__main__":
+    test()
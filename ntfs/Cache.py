@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+"""
+Byte-accounted caches with pluggable eviction policies.
+
+A `Cache` maps keys to values, charging each value an estimated number
+  of bytes. When the cache (or the `MemoryBudget` it shares with other
+  caches) goes over its limit, its `policy` chooses which keys to evict.
+
+The policies implemented here are:
+  - `LRUPolicy`: evict the least recently used key.
+  - `CLOCKPolicy`: second-chance approximation of LRU, cheap on hits.
+  - `ARCPolicy`: Adaptive Replacement Cache, balances recency and
+      frequency, and resists scans (like a full MFT enumeration).
+
+Caches shared by threads are `SynchronizedCache`s, best created with
+  `MemoryBudget.cache` from a thread safe budget.
+"""
+import sys
+import logging
+import threading
+from collections import OrderedDict
+
+
+g_logger = logging.getLogger("ntfs.Cache")
+
+KILOBYTE = 1024
+MEGABYTE = 1024 * KILOBYTE
+
+# approximate cost of each field declared on a `Block`:
+#   the handler closure, its cell, and the `_off_` and field dict entries.
+BLOCK_FIELD_OVERHEAD = 0x200
+
+
+def estimate_size(value):
+    """
+    Estimate the number of bytes of memory held by the given value.
+
+    `Block`s (anything with `_buf` and `_declared_fields`) are charged
+      for their buffer plus the closures created for each declared field.
+    Strings and buffers are charged for their contents.
+
+    @rtype: int
+    """
+    size = sys.getsizeof(value)
+    if hasattr(value, "_declared_fields"):
+        size += sys.getsizeof(value.__dict__)
+        size += len(value._declared_fields) * BLOCK_FIELD_OVERHEAD
+        buf = getattr(value, "_buf", None)
+        if buf is not None and not hasattr(buf, "__unpackable__"):
+            try:
+                size += len(buf)
+            except TypeError:
+                pass
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            size += estimate_size(v)
+    return size
+
+
+class CachePolicy(object):
+    """
+    interface
+
+    A policy tracks the keys resident in a cache and decides
+      which one should be evicted next.
+    """
+    def insert(self, k):
+        raise NotImplementedError()
+
+    def touch(self, k):
+        raise NotImplementedError()
+
+    def remove(self, k):
+        raise NotImplementedError()
+
+    def victim(self):
+        """
+        Select, and stop tracking, the key that should be evicted next.
+        @raise KeyError: if no keys are tracked.
+        """
+        raise NotImplementedError()
+
+    def clear(self):
+        raise NotImplementedError()
+
+
+class LRUPolicy(CachePolicy):
+    """
+    Evict the least recently used key.
+    """
+    def __init__(self):
+        super(LRUPolicy, self).__init__()
+        self._q = OrderedDict()
+
+    def insert(self, k):
+        self._q[k] = None
+
+    def touch(self, k):
+        del self._q[k]
+        self._q[k] = None
+
+    def remove(self, k):
+        del self._q[k]
+
+    def victim(self):
+        return self._q.popitem(last=False)[0]
+
+    def clear(self):
+        self._q.clear()
+
+
+class CLOCKPolicy(CachePolicy):
+    """
+    Second-chance eviction: keys sit on a ring with a reference bit.
+    A hit only sets the bit, so it's cheaper than reordering a list.
+    The hand sweeps the ring, clearing bits, and evicts the first key
+      whose bit is already clear.
+    """
+    _EMPTY = object()
+
+    def __init__(self):
+        super(CLOCKPolicy, self).__init__()
+        self.clear()
+
+    def insert(self, k):
+        if self._free:
+            slot = self._free.pop()
+            self._ring[slot] = k
+            self._referenced[slot] = False
+        else:
+            slot = len(self._ring)
+            self._ring.append(k)
+            self._referenced.append(False)
+        self._slots[k] = slot
+
+    def touch(self, k):
+        self._referenced[self._slots[k]] = True
+
+    def remove(self, k):
+        slot = self._slots.pop(k)
+        self._ring[slot] = CLOCKPolicy._EMPTY
+        self._referenced[slot] = False
+        self._free.append(slot)
+
+    def victim(self):
+        if not self._slots:
+            raise KeyError("CLOCKPolicy is empty")
+        ring = self._ring
+        referenced = self._referenced
+        while True:
+            if self._hand >= len(ring):
+                self._hand = 0
+            slot = self._hand
+            self._hand += 1
+            k = ring[slot]
+            if k is CLOCKPolicy._EMPTY:
+                continue
+            if referenced[slot]:
+                referenced[slot] = False
+                continue
+            self.remove(k)
+            return k
+
+    def clear(self):
+        self._ring = []
+        self._slots = {}  # type: dict(object, int)
+        self._referenced = []
+        self._free = []
+        self._hand = 0
+
+
+class ARCPolicy(CachePolicy):
+    """
+    Adaptive Replacement Cache (Megiddo & Modha).
+
+    Resident keys are split into T1 (seen once recently) and T2 (seen at
+      least twice). Ghost lists B1 and B2 remember keys recently evicted
+      from each, and a hit on a ghost shifts the target size `p` of T1.
+    This keeps a single sequential scan from flushing the hot set.
+
+    Since the cache is bounded by bytes rather than entries, the ghost lists
+      are bounded by the number of resident keys.
+    """
+    def __init__(self):
+        super(ARCPolicy, self).__init__()
+        self._t1 = OrderedDict()
+        self._t2 = OrderedDict()
+        self._b1 = OrderedDict()
+        self._b2 = OrderedDict()
+        self._p = 0
+
+    def _resident(self):
+        return len(self._t1) + len(self._t2)
+
+    def insert(self, k):
+        if k in self._b1:
+            delta = max(1, len(self._b2) // max(1, len(self._b1)))
+            self._p = min(self._p + delta, self._resident() + 1)
+            del self._b1[k]
+            self._t2[k] = None
+        elif k in self._b2:
+            delta = max(1, len(self._b1) // max(1, len(self._b2)))
+            self._p = max(self._p - delta, 0)
+            del self._b2[k]
+            self._t2[k] = None
+        else:
+            self._t1[k] = None
+
+    def touch(self, k):
+        if k in self._t1:
+            del self._t1[k]
+        else:
+            del self._t2[k]
+        self._t2[k] = None
+
+    def remove(self, k):
+        if k in self._t1:
+            del self._t1[k]
+        else:
+            del self._t2[k]
+
+    def victim(self):
+        if self._t1 and (len(self._t1) > self._p or not self._t2):
+            k, _ = self._t1.popitem(last=False)
+            self._b1[k] = None
+        elif self._t2:
+            k, _ = self._t2.popitem(last=False)
+            self._b2[k] = None
+        else:
+            raise KeyError("ARCPolicy is empty")
+
+        limit = max(1, self._resident())
+        while len(self._b1) > limit:
+            self._b1.popitem(last=False)
+        while len(self._b2) > limit:
+            self._b2.popitem(last=False)
+        return k
+
+    def clear(self):
+        self._t1.clear()
+        self._t2.clear()
+        self._b1.clear()
+        self._b2.clear()
+        self._p = 0
+
+
+POLICIES = {
+    "lru": LRUPolicy,
+    "clock": CLOCKPolicy,
+    "arc": ARCPolicy,
+}
+
+
+class MemoryBudget(object):
+    """
+    A byte limit shared by one or more `Cache`s.
+
+    When an insertion pushes the total over the limit, entries are evicted
+      from the cache holding the most bytes until the total fits again.
+    For example, the MFT record cache, the path cache and `FileMap` block
+      caches can all draw from one budget.
+    """
+    def __init__(self, byte_limit, thread_safe=False):
+        """
+        @type thread_safe: bool
+        @param thread_safe: If True, the caches created by `cache`
+          are synchronized by a lock shared by the budget, since
+          reclaiming memory evicts entries across caches.
+        """
+        super(MemoryBudget, self).__init__()
+        self._byte_limit = byte_limit
+        self._caches = []
+        self._used = 0
+        self._lock = threading.RLock() if thread_safe else None
+
+    def register(self, cache):
+        self._caches.append(cache)
+
+    def cache(self, **kwargs):
+        """
+        Create a cache drawing from this budget, a `SynchronizedCache`
+          if the budget is thread safe. Takes the arguments of `Cache`.
+
+        @rtype: Cache
+        """
+        if self._lock is not None:
+            return SynchronizedCache(budget=self, lock=self._lock, **kwargs)
+        return Cache(budget=self, **kwargs)
+
+    def charge(self, nbytes):
+        self._used += nbytes
+
+    def release(self, nbytes):
+        self._used -= nbytes
+
+    def get_byte_limit(self):
+        return self._byte_limit
+
+    def get_used(self):
+        return self._used
+
+    def reclaim(self, requester):
+        """
+        Evict entries until the budget is satisfied.
+        The requesting cache is never emptied of its most recent entry.
+        """
+        while self._used > self._byte_limit:
+            candidates = [c for c in self._caches
+                          if len(c) > (1 if c is requester else 0)]
+            if not candidates:
+                return
+            largest = max(candidates, key=lambda c: c.get_used())
+            largest.evict_one()
+
+
+class CacheStats(object):
+    """
+    Hit, miss, and eviction counters for a `Cache`.
+    """
+    def __init__(self):
+        super(CacheStats, self).__init__()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.insertions = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def __str__(self):
+        return "CacheStats(hits: %d, misses: %d, evictions: %d, " \
+            "insertions: %d, hit rate: %.2f)" % (
+                self.hits, self.misses, self.evictions,
+                self.insertions, self.hit_rate())
+
+
+class Cache(object):
+    """
+    A mapping with bounded capacity.
+
+    Capacity may be given in entries (`size_limit`), in bytes
+      (`byte_limit`), or by a `MemoryBudget` shared with other caches.
+    Values are charged `sizeof(value)` bytes, see `estimate_size`.
+    """
+    def __init__(self, size_limit=None, byte_limit=None, policy="lru",
+                 sizeof=estimate_size, budget=None, name="cache"):
+        """
+        @type policy: str or CachePolicy
+        @param policy: one of "lru", "clock", "arc", or a policy instance.
+        """
+        super(Cache, self).__init__()
+        if isinstance(policy, basestring):
+            policy = POLICIES[policy]()
+        self._c = {}
+        self._sizes = {}
+        self._used = 0
+        self._size_limit = size_limit
+        self._byte_limit = byte_limit
+        self._policy = policy
+        self._sizeof = sizeof
+        self._budget = budget
+        self._name = name
+        self.stats = CacheStats()
+        if budget is not None:
+            budget.register(self)
+
+    def __len__(self):
+        return len(self._c)
+
+    def __contains__(self, k):
+        return k in self._c
+
+    def insert(self, k, v):
+        """
+        add a key and value to the front
+        """
+        if k in self._c:
+            self.remove(k)
+        size = self._sizeof(v)
+        self._c[k] = v
+        self._sizes[k] = size
+        self._used += size
+        self._policy.insert(k)
+        self.stats.insertions += 1
+        if self._budget is not None:
+            self._budget.charge(size)
+        self._enforce()
+
+    def _enforce(self):
+        if self._size_limit is not None:
+            while len(self._c) > self._size_limit:
+                self.evict_one()
+        if self._byte_limit is not None:
+            while self._used > self._byte_limit and len(self._c) > 1:
+                self.evict_one()
+        if self._budget is not None:
+            self._budget.reclaim(self)
+
+    def exists(self, k):
+        return k in self._c
+
+    def touch(self, k):
+        """
+        bring a key to the front
+        """
+        self._policy.touch(k)
+
+    def get(self, k):
+        return self._c[k]
+
+    def lookup(self, k, default=None):
+        """
+        Fetch a value and mark it as used, counting the hit or miss.
+        Prefer this over `exists`/`touch`/`get` on hot paths.
+        """
+        try:
+            v = self._c[k]
+        except KeyError:
+            self.stats.misses += 1
+            return default
+        self.stats.hits += 1
+        self._policy.touch(k)
+        return v
+
+    def remove(self, k):
+        del self._c[k]
+        size = self._sizes.pop(k)
+        self._used -= size
+        self._policy.remove(k)
+        if self._budget is not None:
+            self._budget.release(size)
+
+    def evict_one(self):
+        k = self._policy.victim()
+        del self._c[k]
+        size = self._sizes.pop(k)
+        self._used -= size
+        self.stats.evictions += 1
+        if self._budget is not None:
+            self._budget.release(size)
+
+    def clear(self):
+        if self._budget is not None:
+            self._budget.release(self._used)
+        self._c.clear()
+        self._sizes.clear()
+        self._used = 0
+        self._policy.clear()
+
+    def get_used(self):
+        """
+        @return: the number of bytes charged to this cache.
+        """
+        return self._used
+
+    def __str__(self):
+        return "Cache(name: %s, entries: %d, bytes: %d, %s)" % (
+            self._name, len(self._c), self._used, self.stats)
+
+    @staticmethod
+    def test():
+        for policy in POLICIES.keys():
+            c = Cache(size_limit=2, policy=policy, sizeof=lambda v: 1)
+            c.insert(0, "a")
+            c.insert(1, "b")
+            assert c.lookup(0) == "a"
+            c.insert(2, "c")
+            assert len(c) == 2
+            assert c.stats.evictions == 1
+            assert c.lookup(2) == "c"
+            assert c.lookup(3) is None
+            assert c.stats.misses == 1
+
+        c = Cache(size_limit=2, policy="lru", sizeof=lambda v: 1)
+        c.insert(0, "a")
+        c.insert(1, "b")
+        c.touch(0)
+        c.insert(2, "c")
+        assert c.exists(0)
+        assert not c.exists(1)
+
+        c = Cache(byte_limit=10, sizeof=len)
+        c.insert(0, "aaaa")
+        c.insert(1, "bbbb")
+        c.insert(2, "cccc")
+        assert len(c) == 2
+        assert c.get_used() == 8
+
+        budget = MemoryBudget(10)
+        c1 = Cache(budget=budget, sizeof=len)
+        c2 = Cache(budget=budget, sizeof=len)
+        c1.insert(0, "aaaa")
+        c1.insert(1, "bbbb")
+        c2.insert(0, "cccc")
+        assert budget.get_used() <= 10
+        assert len(c1) == 1
+        assert len(c2) == 1
+        c1.clear()
+        assert budget.get_used() == 4
+
+        budget = MemoryBudget(100, thread_safe=True)
+        caches = [budget.cache(sizeof=len) for _ in range(4)]
+        assert all(isinstance(cache, SynchronizedCache) for cache in caches)
+
+        def churn(c):
+            for i in range(2000):
+                c.insert(i, "x" * (i % 7))
+                c.lookup(i - 1)
+        threads = [threading.Thread(target=churn, args=(cache,)) for cache in caches]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert budget.get_used() <= 100
+        assert budget.get_used() == sum(cache.get_used() for cache in caches)
+        return True
+
+
+class SynchronizedCache(Cache):
+    """
+    A `Cache` that may be shared by threads.
+
+    Caches that share a `MemoryBudget` evict each other's entries,
+      so they must share one lock, too. See `MemoryBudget.cache`.
+    """
+    def __init__(self, lock=None, **kwargs):
+        super(SynchronizedCache, self).__init__(**kwargs)
+        if lock is None:
+            lock = threading.RLock()
+        self._lock = lock
+
+    def __len__(self):
+        with self._lock:
+            return Cache.__len__(self)
+
+    def __contains__(self, k):
+        with self._lock:
+            return Cache.__contains__(self, k)
+
+    def insert(self, k, v):
+        with self._lock:
+            Cache.insert(self, k, v)
+
+    def exists(self, k):
+        with self._lock:
+            return Cache.exists(self, k)
+
+    def touch(self, k):
+        with self._lock:
+            Cache.touch(self, k)
+
+    def get(self, k):
+        with self._lock:
+            return Cache.get(self, k)
+
+    def lookup(self, k, default=None):
+        with self._lock:
+            return Cache.lookup(self, k, default)
+
+    def remove(self, k):
+        with self._lock:
+            Cache.remove(self, k)
+
+    def evict_one(self):
+        with self._lock:
+            Cache.evict_one(self)
+
+    def clear(self):
+        with self._lock:
+            Cache.clear(self)
+
+    def __str__(self):
+        with self._lock:
+            return Cache.__str__(self)
+
+
+def test():
+    if Cache.test():
+        print("Cache passed tests.")
+
+
+if __name__ == "__main__":
+    test()
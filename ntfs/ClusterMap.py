@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+"""
+A reverse map from the clusters of a volume to the attributes that own them.
+
+Finding the file that owns a cluster, such as the hit of a carver or a
+  bad sector, means decoding the runlists of every record. Instead, the
+  runlists are decoded once, in one pass over the MFT, into a table of
+  extents (lcn, length, record number, attribute type, attribute name,
+  vcn) sorted by lcn, held in parallel arrays. A lookup is then a binary
+  search of the starts, and a batch of sorted lookups is a single merge
+  walk over the table.
+
+Extents don't overlap on a healthy volume, but cross-linked clusters do
+  occur on damaged ones. So, alongside the starts, the table keeps the
+  greatest end of the extents up to each one, which bounds how far back
+  a lookup must search for the other owners of a cluster.
+
+The table can be saved next to the image and loaded again, as long as
+  it was built from the same volume.
+"""
+import os
+import json
+import array
+import bisect
+import struct
+import logging
+import tempfile
+
+from ntfs.mft.MFT import MREF
+
+
+g_logger = logging.getLogger("ntfs.ClusterMap")
+
+CLUSTER_MAP_MAGIC = "NTFSCMAP"
+CLUSTER_MAP_VERSION = 1
+# magic, version, length of the JSON header
+CLUSTER_MAP_HEADER_STRUCT = struct.Struct("<8sII")
+CLUSTER_MAP_SUFFIX = ".clustermap"
+
+# the arrays of the table, in the order they're saved
+CLUSTER_MAP_ARRAYS = ("_lcns", "_lengths", "_max_ends", "_record_numbers",
+                      "_attribute_types", "_name_indices", "_vcns")
+
+
+class ClusterMapError(Exception):
+    def __init__(self, msg="no details"):
+        super(ClusterMapError, self).__init__(msg)
+        self._msg = msg
+
+    def __str__(self):
+        return "ClusterMapError(%s)" % (self._msg)
+
+
+class ClusterOwner(object):
+    """
+    An extent of clusters, and the attribute to which it is allocated.
+    """
+    __slots__ = ("lcn", "length", "record_number", "attribute_type",
+                 "attribute_name", "vcn")
+
+    def __init__(self, lcn, length, record_number, attribute_type, attribute_name, vcn):
+        self.lcn = lcn
+        self.length = length
+        self.record_number = record_number
+        self.attribute_type = attribute_type
+        self.attribute_name = attribute_name
+        self.vcn = vcn
+
+    def __repr__(self):
+        return "ClusterOwner(lcn=%r, length=%r, record_number=%r, attribute_type=%s, " \
+            "attribute_name=%r, vcn=%r)" % (self.lcn, self.length, self.record_number,
+                                            hex(self.attribute_type), self.attribute_name,
+                                            self.vcn)
+
+    def get_vcn(self, lcn):
+        """
+        @return: The cluster of the attribute stored at `lcn`.
+        """
+        return self.vcn + (lcn - self.lcn)
+
+
+def default_cluster_map_path(image_filename, volume_offset=0):
+    """
+    @return: The path of the cluster map saved next to an image.
+    """
+    if volume_offset:
+        return "%s.%d%s" % (image_filename, volume_offset, CLUSTER_MAP_SUFFIX)
+    return image_filename + CLUSTER_MAP_SUFFIX
+
+
+class ClusterMap(object):
+    """
+    The extents of all the non-resident attributes of a volume, by lcn.
+    """
+    def __init__(self, cluster_size, cluster_count, serial_number=0):
+        """
+        @type cluster_size: int
+        @type cluster_count: int
+        @type serial_number: int
+        @param serial_number: The serial number of the volume, from its
+          VBR, used to check that a saved map matches the volume.
+        """
+        super(ClusterMap, self).__init__()
+        self._cluster_size = cluster_size
+        self._cluster_count = cluster_count
+        self._serial_number = serial_number
+        self._lcns = array.array("L")
+        self._lengths = array.array("L")
+        self._max_ends = array.array("L")
+        self._record_numbers = array.array("L")
+        self._attribute_types = array.array("L")
+        self._name_indices = array.array("L")
+        self._vcns = array.array("L")
+        # attribute names, most of which are "", are stored once
+        self._names = [""]
+        self._name_table = {"": 0}
+
+    def __len__(self):
+        return len(self._lcns)
+
+    def get_cluster_size(self):
+        return self._cluster_size
+
+    def get_cluster_count(self):
+        return self._cluster_count
+
+    def get_serial_number(self):
+        return self._serial_number
+
+    def _add(self, lcn, length, record_number, attribute_type, name_index, vcn):
+        self._lcns.append(lcn)
+        self._lengths.append(length)
+        self._record_numbers.append(record_number)
+        self._attribute_types.append(attribute_type)
+        self._name_indices.append(name_index)
+        self._vcns.append(vcn)
+
+    def _intern_name(self, name):
+        index = self._name_table.get(name)
+        if index is None:
+            index = len(self._names)
+            self._names.append(name)
+            self._name_table[name] = index
+        return index
+
+    def load_mft(self, enumerator):
+        """
+        Add the extents of the non-resident attributes of each active
+          record of the MFT. The extents of an extension record are
+          owned by its base record. Extents that don't fit in the
+          volume, from corrupt runlists, are dropped: a single huge
+          extent would otherwise claim every later cluster.
+
+        @type enumerator: ntfs.mft.MFT.MFTEnumerator
+        """
+        cluster_count = self._cluster_count
+        for view in enumerator.enumerate_records(flyweight=True):
+            if not view.is_active():
+                continue
+            record_number = view.inode
+            base = MREF(view.base_mft_record())
+            if base != 0:
+                record_number = base
+            try:
+                for attribute in view.attributes():
+                    if not attribute.non_resident():
+                        continue
+                    name_index = self._intern_name(attribute.name())
+                    vcn = attribute.lowest_vcn()
+                    for lcn, length in attribute.runlist().runs():
+                        if lcn is None:
+                            pass
+                        elif lcn < 0 or length <= 0 or lcn + length > cluster_count:
+                            g_logger.debug("Dropping extent (%d, %d) of record %d, "
+                                           "beyond the volume of %d clusters",
+                                           lcn, length, view.inode, cluster_count)
+                        else:
+                            self._add(lcn, length, record_number, attribute.type(),
+                                      name_index, vcn)
+                        vcn += length
+            except Exception as e:
+                g_logger.debug("Failed to parse runlists of record %d: %s", view.inode, e)
+        self._sort()
+
+    def _sort(self):
+        """
+        Order the extents by lcn, and compute their running greatest end.
+        """
+        lcns = self._lcns
+        order = sorted(xrange(len(lcns)), key=lcns.__getitem__)
+        for name in CLUSTER_MAP_ARRAYS:
+            if name == "_max_ends":
+                continue
+            values = getattr(self, name)
+            setattr(self, name, array.array(values.typecode, (values[i] for i in order)))
+
+        max_ends = array.array("L")
+        max_end = 0
+        for lcn, length in zip(self._lcns, self._lengths):
+            max_end = max(max_end, lcn + length)
+            max_ends.append(max_end)
+        self._max_ends = max_ends
+
+    def _get_owner(self, index):
+        return ClusterOwner(self._lcns[index], self._lengths[index],
+                            self._record_numbers[index], self._attribute_types[index],
+                            self._names[self._name_indices[index]], self._vcns[index])
+
+    def _owners_before(self, lcn, index):
+        """
+        Collect the owners of `lcn` among the extents up to `index`,
+          the last extent starting at or before `lcn`.
+        """
+        owners = []
+        while index >= 0 and self._max_ends[index] > lcn:
+            if lcn < self._lcns[index] + self._lengths[index]:
+                owners.append(self._get_owner(index))
+            index -= 1
+        owners.reverse()
+        return owners
+
+    def owners_of(self, lcn):
+        """
+        @type lcn: int
+        @rtype: list of ClusterOwner
+        @return: The extents containing the cluster, in lcn order. More
+          than one means the cluster is cross-linked.
+        """
+        return self._owners_before(lcn, bisect.bisect_right(self._lcns, lcn) - 1)
+
+    def owner_of(self, lcn):
+        """
+        @type lcn: int
+        @rtype: ClusterOwner, or None if the cluster isn't allocated to
+          a non-resident attribute.
+        @return: If the cluster is cross-linked, the extent starting last.
+        """
+        index = bisect.bisect_right(self._lcns, lcn) - 1
+        if index >= 0 and lcn < self._lcns[index] + self._lengths[index]:
+            return self._get_owner(index)
+        owners = self._owners_before(lcn, index)
+        if owners:
+            return owners[-1]
+        return None
+
+    def owners_of_lcns(self, lcns):
+        """
+        Yield (lcn, list of ClusterOwner) for each of the clusters.
+          Sorted clusters are found in a single pass over the extents;
+          out of order clusters are each found by a binary search.
+
+        @type lcns: iterable of int
+        """
+        starts = self._lcns
+        count = len(starts)
+        index = -1
+        previous = None
+        for lcn in lcns:
+            if previous is not None and lcn < previous:
+                index = bisect.bisect_right(starts, lcn) - 1
+            else:
+                while index + 1 < count and starts[index + 1] <= lcn:
+                    index += 1
+            previous = lcn
+            yield lcn, self._owners_before(lcn, index)
+
+    def owners_of_offsets(self, offsets):
+        """
+        Yield (offset, list of ClusterOwner) for each of the byte
+          offsets into the volume, best sorted (see `owners_of_lcns`).
+
+        @type offsets: iterable of int
+        @param offsets: Relative to the start of the volume, not the image.
+        """
+        cluster_size = self._cluster_size
+        offsets = list(offsets)
+        results = self.owners_of_lcns(offset // cluster_size for offset in offsets)
+        for offset, (_, owners) in zip(offsets, results):
+            yield offset, owners
+
+    def _get_header(self):
+        return {
+            "cluster_size": self._cluster_size,
+            "cluster_count": self._cluster_count,
+            "serial_number": self._serial_number,
+            "extent_count": len(self._lcns),
+            "itemsize": self._lcns.itemsize,
+            "names": self._names,
+        }
+
+    def save(self, path):
+        """
+        Write the map atomically, so that an interrupted run leaves
+          either the old or the new map, never a partial one.
+        """
+        header = json.dumps(self._get_header())
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".clustermap-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(CLUSTER_MAP_HEADER_STRUCT.pack(CLUSTER_MAP_MAGIC,
+                                                       CLUSTER_MAP_VERSION,
+                                                       len(header)))
+                f.write(header)
+                for name in CLUSTER_MAP_ARRAYS:
+                    getattr(self, name).tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows won't rename over an existing file
+                os.remove(path)
+                os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        @rtype: ClusterMap, or None if the file doesn't exist.
+        @raises ClusterMapError: if the file isn't a map this version can
+          read, such as one written on a platform of another word size.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            buf = f.read(CLUSTER_MAP_HEADER_STRUCT.size)
+            if len(buf) != CLUSTER_MAP_HEADER_STRUCT.size:
+                raise ClusterMapError("truncated header")
+            magic, version, header_length = CLUSTER_MAP_HEADER_STRUCT.unpack(buf)
+            if magic != CLUSTER_MAP_MAGIC:
+                raise ClusterMapError("not a cluster map")
+            if version != CLUSTER_MAP_VERSION:
+                raise ClusterMapError("unsupported version %d" % (version))
+            try:
+                header = json.loads(f.read(header_length))
+            except ValueError as e:
+                raise ClusterMapError("invalid header: %s" % (e))
+
+            cluster_map = cls(header["cluster_size"], header["cluster_count"],
+                              header["serial_number"])
+            if header["itemsize"] != cluster_map._lcns.itemsize:
+                raise ClusterMapError("saved with %d byte entries, rather than %d" %
+                                      (header["itemsize"], cluster_map._lcns.itemsize))
+            try:
+                for name in CLUSTER_MAP_ARRAYS:
+                    getattr(cluster_map, name).fromfile(f, header["extent_count"])
+            except EOFError:
+                raise ClusterMapError("truncated extents")
+
+        cluster_map._names = header["names"]
+        cluster_map._name_table = dict((n, i) for i, n in enumerate(cluster_map._names))
+        return cluster_map
+
+    def matches(self, fs):
+        """
+        @type fs: ntfs.filesystem.NTFSFilesystem
+        @return: True if the map could have been built from the file system.
+        """
+        return (self._serial_number == fs.get_volume_serial_number() and
+                self._cluster_size == fs.get_cluster_size() and
+                self._cluster_count == fs.get_cluster_count())
+
+    @classmethod
+    def from_filesystem(cls, fs):
+        """
+        @type fs: ntfs.filesystem.NTFSFilesystem
+        @rtype: ClusterMap
+        """
+        cluster_map = cls(fs.get_cluster_size(), fs.get_cluster_count(),
+                          fs.get_volume_serial_number())
+        cluster_map.load_mft(fs.get_mft_enumerator())
+        return cluster_map
+
+    @staticmethod
+    def test():
+        m = ClusterMap(4096, 100)
+        m._add(50, 10, 30, 0x80, m._intern_name(""), 0)
+        m._add(10, 5, 20, 0x80, m._intern_name(""), 0)
+        m._add(15, 5, 20, 0x80, m._intern_name(""), 8)
+        m._add(70, 20, 40, 0x80, m._intern_name("ads"), 0)
+        # cross-linked with the end of record 40
+        m._add(85, 2, 41, 0xA0, m._intern_name("$I30"), 3)
+        m._sort()
+
+        assert len(m) == 5
+        assert m.owner_of(9) is None
+        assert m.owner_of(10).record_number == 20
+        assert m.owner_of(19).get_vcn(19) == 12
+        assert m.owner_of(20) is None
+        assert m.owner_of(59).record_number == 30
+        assert m.owner_of(72).attribute_name == "ads"
+        assert [o.record_number for o in m.owners_of(86)] == [40, 41]
+        assert [o.record_number for o in m.owners_of(89)] == [40]
+        assert m.owner_of(89).record_number == 40
+        assert m.owner_of(90) is None
+
+        # the extent starting last doesn't contain the cluster
+        c = ClusterMap(4096, 100)
+        c._add(10, 20, 1, 0x80, c._intern_name(""), 0)
+        c._add(12, 15, 2, 0x80, c._intern_name(""), 0)
+        c._add(15, 2, 3, 0x80, c._intern_name(""), 0)
+        c._sort()
+        assert [o.record_number for o in c.owners_of(20)] == [1, 2]
+        assert c.owner_of(20).record_number == 2
+
+        lcns = [0, 12, 16, 55, 86, 99, 11]
+        expected = [[o.record_number for o in m.owners_of(lcn)] for lcn in lcns]
+        assert [[o.record_number for o in owners]
+                for _, owners in m.owners_of_lcns(lcns)] == expected
+        assert [offset for offset, _ in m.owners_of_offsets([4096 * 10 + 1])] == [4096 * 10 + 1]
+
+        fd, path = tempfile.mkstemp(suffix=CLUSTER_MAP_SUFFIX)
+        os.close(fd)
+        try:
+            m.save(path)
+            n = ClusterMap.load(path)
+        finally:
+            os.remove(path)
+        assert len(n) == len(m)
+        assert n.get_cluster_size() == 4096
+        assert [o.record_number for o in n.owners_of(86)] == [40, 41]
+        assert n.owner_of(86).attribute_name == "$I30"
+
+        class TestAttribute(object):
+            def __init__(self, runs):
+                self._runs = runs
+
+            def non_resident(self):
+                return 1
+
+            def name(self):
+                return u""
+
+            def type(self):
+                return 0x80
+
+            def lowest_vcn(self):
+                return 0
+
+            def runlist(self):
+                return self
+
+            def runs(self):
+                return self._runs
+
+        class TestRecord(object):
+            def __init__(self, inode, runs, base=0):
+                self.inode = inode
+                self._runs = runs
+                self._base = base
+
+            def is_active(self):
+                return True
+
+            def base_mft_record(self):
+                return self._base
+
+            def attributes(self):
+                return [TestAttribute(self._runs)]
+
+        class TestEnumerator(object):
+            def enumerate_records(self, flyweight=False):
+                return [TestRecord(20, [(10, 5), (None, 3), (40, 2)]),
+                        # a corrupt runlist, whose extents run past the volume
+                        TestRecord(21, [(30, 2), (50, 1 << 40), (-5, 2)]),
+                        TestRecord(22, [(60, 4)], base=(3 << 48) | 20)]
+
+        m = ClusterMap(4096, 100)
+        m.load_mft(TestEnumerator())
+        assert [(o.lcn, o.record_number, o.vcn) for o in map(m._get_owner, xrange(len(m)))] == \
+            [(10, 20, 0), (30, 21, 0), (40, 20, 8), (60, 20, 0)]
+        assert m.owner_of(99) is None
+        return True
+
+
+def open_cluster_map(fs, path=None):
+    """
+    Load the cluster map of a file system from `path`, or build it, and
+      save it to `path` for next time.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @type path: str
+    @param path: Where the map is saved, such as from `default_cluster_map_path`.
+      By default, the map is built and not saved.
+    @rtype: ClusterMap
+    """
+    if path is not None:
+        try:
+            cluster_map = ClusterMap.load(path)
+        except (ClusterMapError, IOError) as e:
+            g_logger.warning("Failed to load cluster map %s, rebuilding: %s", path, e)
+            cluster_map = None
+        if cluster_map is not None:
+            if cluster_map.matches(fs):
+                return cluster_map
+            g_logger.warning("Cluster map %s is of another volume, rebuilding", path)
+
+    cluster_map = ClusterMap.from_filesystem(fs)
+    if path is not None:
+        try:
+            cluster_map.save(path)
+        except (IOError, OSError) as e:
+            g_logger.warning("Failed to save cluster map %s: %s", path, e)
+    return cluster_map
+
+
+def test():
+    if ClusterMap.test():
+        print("ClusterMap passed tests.")
+
+
+if __name__ == "__main__":
+    test()
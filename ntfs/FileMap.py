@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import sys
+import threading
 from struct import unpack_from as old_unpack_from
 from struct import unpack_from as old_unpack
 from struct import calcsize
@@ -8,6 +9,7 @@ from struct import calcsize
 from collections import OrderedDict
 # From: http://code.activestate.com/recipes/577197-sortedcollection/
 from SortedCollection import SortedCollection
+from Cache import Cache
 
 
 MEGABYTE = 1024 * 1024
@@ -289,10 +291,13 @@ class FileMap(object):
     """
     __unpackable__ = True
     def __init__(self, filelike, block_size=MEGABYTE,
-                 cache_size=10, size=None):
+                 cache_size=10, size=None, budget=None):
         """
         If `size` is not provided, then `filelike` must have the
           `seek` and `tell` methods implemented.
+        If `budget` (a `ntfs.Cache.MemoryBudget`) is provided, then
+          cached blocks are charged against it, too. A thread safe
+          budget makes the FileMap safe to share across threads.
         """
         super(FileMap, self).__init__()
         if size is None:
@@ -302,24 +307,22 @@ class FileMap(object):
         self._f = filelike
         self._block_size = block_size
         self._size = size
-        self._block_cache = RangeCache(cache_size)
+        # blocks are always aligned, so they can be keyed by their start
+        if budget is None:
+            self._block_cache = Cache(size_limit=cache_size, sizeof=len,
+                                      name="FileMap")
+        else:
+            self._block_cache = budget.cache(size_limit=cache_size, sizeof=len,
+                                             name="FileMap")
+        # seeking and reading must not interleave across threads
+        self._io_lock = threading.Lock()
 
     def __getitem__(self, index):
         if index < 0:
             index = self._size + index
         block_index = index % self._block_size
-        block_start = index - block_index
-
-        try:
-            hit = self._block_cache.get(index)
-            buf = hit[2]
-            self._block_cache.touch(hit)
-            return buf[block_index]
-        except ValueError:
-            self._f.seek(block_start)
-            buf = self._f.read(self._block_size)
-            self._block_cache.push((block_start, self._block_size, buf))
-            return buf[block_index]
+        buf = self._get_containing_block(index)
+        return buf[block_index]
 
     def _get_containing_block(self, index):
         """
@@ -329,16 +332,16 @@ class FileMap(object):
         block_index = index % self._block_size
         block_start = index - block_index
 
-        try:
-            hit = self._block_cache.get(block_start)
-            buf = hit[2]
-            self._block_cache.touch(hit)
-            return buf
-        except ValueError:
-            self._f.seek(block_start)
-            buf = self._f.read(self._block_size)
-            self._block_cache.push((block_start, self._block_size, buf))
-            return buf
+        buf = self._block_cache.lookup(block_start)
+        if buf is None:
+            with self._io_lock:
+                self._f.seek(block_start)
+                buf = self._f.read(self._block_size)
+            self._block_cache.insert(block_start, buf)
+        return buf
+
+    def get_cache_stats(self):
+        return self._block_cache.stats
 
     def __getslice__(self, start, end):
         if end == sys.maxint:
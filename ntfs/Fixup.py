@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Bulk application of NTFS update sequence arrays ("fixups").
+
+Multi-sector structures (FILE records, INDX blocks, $LogFile pages) store
+  an update sequence number in the last word of each sector, and keep the
+  original words in the update sequence array near the structure header.
+  Before a structure can be parsed, each sector's last word must be
+  verified against the update sequence number and replaced.
+
+`apply_fixups` does this for a whole chunk of consecutive, equally sized
+  structures at once. When NumPy is available, records that share a
+  layout are patched with strided array operations; otherwise a tight
+  loop over `bytearray` slices is used.
+"""
+import struct
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+g_logger = logging.getLogger("ntfs.Fixup")
+
+SECTOR_SIZE = 512
+
+# the header fields shared by all multi-sector structures
+USA_OFFSET_OFFSET = 0x4
+USA_COUNT_OFFSET = 0x6
+
+
+def _usa_is_sane(usa_offset, usa_count, record_size, sector_size):
+    return usa_count >= 2 and \
+        (usa_count - 1) * sector_size <= record_size and \
+        usa_offset % 2 == 0 and \
+        usa_offset >= 0x8 and \
+        usa_offset + 2 * usa_count <= sector_size
+
+
+def fixup_record(buf, usa_offset, usa_count, offset=0, sector_size=SECTOR_SIZE):
+    """
+    Apply the fixups of the single structure at `offset` in `buf`, in place,
+      using the given update sequence array location and length.
+
+    @type buf: bytearray
+    @rtype: list of int
+    @return: The indices of sectors whose check value did not match, or
+      whose check value or original value lie beyond the end of `buf`.
+      These sectors are left unpatched.
+    """
+    bad = []
+    size = len(buf)
+    usa = offset + usa_offset
+    if usa + 2 > size:
+        return range(max(usa_count - 1, 0))
+    fixup_value = buf[usa:usa + 2]
+    for i in xrange(usa_count - 1):
+        check = offset + sector_size * (i + 1) - 2
+        value = usa + 2 + 2 * i
+        # an out of range slice assignment would resize the buffer
+        if check + 2 > size or value + 2 > size or \
+           buf[check:check + 2] != fixup_value:
+            bad.append(i)
+            continue
+        buf[check:check + 2] = buf[value:value + 2]
+    return bad
+
+
+def _apply_fixups_python(buf, record_size, offset, count, sector_size):
+    bad = []
+    for index in xrange(count):
+        base = offset + index * record_size
+        usa_offset, usa_count = struct.unpack_from("<HH", buf, base + USA_OFFSET_OFFSET)
+        if not _usa_is_sane(usa_offset, usa_count, record_size, sector_size):
+            continue
+        for sector in fixup_record(buf, usa_offset, usa_count,
+                                   offset=base, sector_size=sector_size):
+            bad.append((index, sector))
+    return bad
+
+
+def _apply_fixups_numpy(buf, record_size, offset, count, sector_size):
+    bad = []
+    words = numpy.frombuffer(buf, dtype="<u2", count=count * record_size // 2,
+                             offset=offset).reshape(count, record_size // 2)
+    usa_offsets = words[:, USA_OFFSET_OFFSET // 2]
+    usa_counts = words[:, USA_COUNT_OFFSET // 2]
+
+    # the common case: every sector is protected, and the
+    #   array lies in the first sector.
+    num_sectors = record_size // sector_size
+    full = (usa_counts == num_sectors + 1) & \
+        (usa_offsets % 2 == 0) & \
+        (usa_offsets >= 0x8) & \
+        (usa_offsets.astype(numpy.uint32) + 2 * usa_counts <= sector_size)
+
+    sector_ends = numpy.arange(1, num_sectors + 1) * (sector_size // 2) - 1
+    for usa_offset in numpy.unique(usa_offsets[full]):
+        rows = numpy.nonzero(full & (usa_offsets == usa_offset))[0]
+        usa = int(usa_offset) // 2
+        fixup_values = words[rows, usa]
+        checks = words[rows[:, None], sector_ends[None, :]]
+        values = words[rows, usa + 1:usa + 1 + num_sectors]
+
+        ok = checks == fixup_values[:, None]
+        words[rows[:, None], sector_ends[None, :]] = numpy.where(ok, values, checks)
+
+        bad_rows, bad_sectors = numpy.nonzero(~ok)
+        bad.extend(zip(rows[bad_rows].tolist(), bad_sectors.tolist()))
+
+    # anything unusual (partial arrays, garbage headers) goes the slow way,
+    #   which skips structures whose header isn't sane.
+    for index in numpy.nonzero(~full)[0].tolist():
+        for _, sector in _apply_fixups_python(buf, record_size,
+                                              offset + index * record_size,
+                                              1, sector_size):
+            bad.append((index, sector))
+
+    bad.sort()
+    return bad
+
+
+def apply_fixups(buf, record_size, offset=0, count=None,
+                 sector_size=SECTOR_SIZE, use_numpy=True):
+    """
+    Apply the fixups of `count` consecutive structures of `record_size`
+      bytes each, starting at `offset` in `buf`, in place.
+
+    Structures whose update sequence array header is implausible (such as
+      unused, zeroed MFT slots) are left untouched.
+
+    @type buf: bytearray
+    @param buf: A writable buffer.
+    @type count: int
+    @param count: The number of structures, by default as many as fit.
+    @rtype: list of (int, int)
+    @return: The (structure index, sector index) of each sector whose
+      check value did not match the update sequence number. These
+      sectors are left unpatched.
+    """
+    if count is None:
+        count = (len(buf) - offset) // record_size
+    if count <= 0:
+        return []
+    if offset + count * record_size > len(buf):
+        raise ValueError("buffer too small for %d structures of %s bytes" %
+                         (count, hex(record_size)))
+
+    if use_numpy and numpy is not None and count > 1:
+        return _apply_fixups_numpy(buf, record_size, offset, count, sector_size)
+    return _apply_fixups_python(buf, record_size, offset, count, sector_size)
+
+
+def format_bad_fixups(bad, base_offset, record_size, sector_size=SECTOR_SIZE):
+    """
+    Summarize the result of `apply_fixups` for logging.
+    """
+    return ", ".join(hex(base_offset + index * record_size + (sector + 1) * sector_size - 2)
+                     for index, sector in bad)
+
+
+def _make_test_record(record_size, usa_offset, usn, sector_size=SECTOR_SIZE):
+    """
+    Build a structure whose sectors each end with the words (i, i),
+      protected by an update sequence array at `usa_offset`.
+    """
+    record = bytearray(record_size)
+    usa_count = record_size // sector_size + 1
+    struct.pack_into("<HH", record, USA_OFFSET_OFFSET, usa_offset, usa_count)
+    struct.pack_into("<H", record, usa_offset, usn)
+    for i in xrange(usa_count - 1):
+        check = sector_size * (i + 1) - 2
+        struct.pack_into("<H", record, usa_offset + 2 + 2 * i, 0x101 * (i + 1))
+        struct.pack_into("<H", record, check, usn)
+    return record
+
+
+def test():
+    record_size = 1024
+    good = _make_test_record(record_size, 0x30, 0x0102)
+    other = _make_test_record(record_size, 0x28, 0x0304)
+    torn = _make_test_record(record_size, 0x30, 0x0506)
+    struct.pack_into("<H", torn, 2 * SECTOR_SIZE - 2, 0xFFFF)
+    empty = bytearray(record_size)
+    chunk = good + other + torn + empty
+
+    expected = bytearray(chunk)
+    for index in xrange(3):
+        for i in xrange(2):
+            check = index * record_size + SECTOR_SIZE * (i + 1) - 2
+            struct.pack_into("<H", expected, check, 0x101 * (i + 1))
+    struct.pack_into("<H", expected, 2 * record_size + 2 * SECTOR_SIZE - 2, 0xFFFF)
+
+    paths = [False]
+    if numpy is not None:
+        paths.append(True)
+    for use_numpy in paths:
+        buf = bytearray(chunk)
+        bad = apply_fixups(buf, record_size, use_numpy=use_numpy)
+        assert bad == [(2, 1)]
+        assert buf == expected
+
+    buf = bytearray(4) + bytearray(good)
+    assert apply_fixups(buf, record_size, offset=4, count=1) == []
+    assert buf[4:] == expected[:record_size]
+    # an update sequence array that runs off the end of the buffer
+    buf = bytearray(good)
+    assert fixup_record(buf, record_size - 2, 3) == [0, 1]
+    assert len(buf) == record_size
+    buf = bytearray(good[:SECTOR_SIZE])
+    assert fixup_record(buf, 0x30, 3) == [1]
+    assert buf == expected[:SECTOR_SIZE]
+    assert format_bad_fixups([(2, 1)], 0x1000, record_size) == hex(0x1000 + 2 * record_size + 0x3fe)
+    print("Fixup passed tests.")
+
+
+if __name__ == "__main__":
+    test()
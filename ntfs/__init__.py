@@ -5,4 +5,5 @@ __all__ = [
     "mft",
     "logfile",
     "usnjrnl",
+    "carve",
 ]
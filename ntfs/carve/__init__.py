@@ -0,0 +1,395 @@
+"""
+Carve INDX blocks and FILE records from a raw volume.
+
+Candidates are found by searching for the structure signatures at
+  sector alignment, using the native `find` of the underlying buffer
+  (see `Volume.find`), so only hits are ever copied. Each candidate is
+  checked with a few cheap header tests, has its fixups applied, and
+  is then parsed by the existing `INDEX_BLOCK` and `MFTRecord` parsers.
+
+The search can be limited to the unallocated clusters of a file
+  system, and large volumes can be split into windows that are carved
+  by a pool of worker processes.
+"""
+import struct
+import logging
+import multiprocessing
+
+from ntfs.BinaryParser import Mmap
+from ntfs.BinaryParser import ParseException
+from ntfs.Fixup import apply_fixups
+from ntfs.mft.MFT import INDEX_BLOCK
+from ntfs.mft.MFT import MFTRecord
+from ntfs.volume import FlatVolume
+from ntfs.volume import split_aligned_ranges
+from ntfs.filesystem import NTFSFilesystem
+
+
+g_logger = logging.getLogger("ntfs.carve")
+
+INDX_SIGNATURE = "INDX"
+FILE_SIGNATURE = "FILE"
+
+SECTOR_SIZE = 512
+
+# the size of the ranges searched at a time by `carve`, and handed
+#   to workers by `carve_parallel`
+WINDOW_SIZE = 64 * 1024 * 1024
+
+# the header fields shared by both structures
+USA_STRUCT = struct.Struct("<4sHH")
+# entries_offset, index_length, allocated_size of the INDEX header
+INDX_INDEX_HEADER_STRUCT = struct.Struct("<III")
+INDX_INDEX_HEADER_OFFSET = 0x18
+# attrs_offset, flags, bytes_in_use, bytes_allocated
+FILE_HEADER_STRUCT = struct.Struct("<HHII")
+FILE_HEADER_OFFSET = 0x14
+
+MIN_STRUCTURE_SIZE = 0x400
+MAX_STRUCTURE_SIZE = 0x10000
+
+
+class CarvedStructure(object):
+    """
+    A structure recovered from the volume.
+    """
+    def __init__(self, signature, offset, buf):
+        """
+        @type signature: str
+        @param signature: One of INDX_SIGNATURE, FILE_SIGNATURE.
+        @type offset: int
+        @param offset: The offset of the structure in the volume.
+        @type buf: str
+        @param buf: The raw structure, without fixups applied.
+        """
+        super(CarvedStructure, self).__init__()
+        self.signature = signature
+        self.offset = offset
+        self.buf = buf
+
+    def __repr__(self):
+        return "CarvedStructure(signature=%r, offset=%s, size=%s)" % \
+            (self.signature, hex(self.offset), hex(len(self.buf)))
+
+    def structure(self):
+        """
+        Parse the structure.
+
+        @rtype: INDEX_BLOCK or MFTRecord
+        """
+        if self.signature == INDX_SIGNATURE:
+            return INDEX_BLOCK(self.buf, 0, block_size=len(self.buf))
+        else:
+            return MFTRecord(self.buf, 0, None)
+
+
+def _structure_size(buf):
+    """
+    Get the size of a multi-sector structure from the length of its
+      update sequence array, or None if the array is implausible.
+    """
+    _, usa_offset, usa_count = USA_STRUCT.unpack_from(buf, 0)
+    size = (usa_count - 1) * SECTOR_SIZE
+    if not MIN_STRUCTURE_SIZE <= size <= MAX_STRUCTURE_SIZE:
+        return None
+    if usa_offset < 0x28 or usa_offset % 2 != 0 or \
+       usa_offset + 2 * usa_count > SECTOR_SIZE:
+        return None
+    return size
+
+
+def _is_plausible_index_block(data, size):
+    entries_offset, index_length, allocated_size = \
+        INDX_INDEX_HEADER_STRUCT.unpack_from(data, INDX_INDEX_HEADER_OFFSET)
+    return 0x10 <= entries_offset <= index_length <= allocated_size and \
+        INDX_INDEX_HEADER_OFFSET + allocated_size <= size
+
+
+def _is_plausible_mft_record(data, size):
+    attrs_offset, flags, bytes_in_use, bytes_allocated = \
+        FILE_HEADER_STRUCT.unpack_from(data, FILE_HEADER_OFFSET)
+    return bytes_allocated == size and \
+        0x30 <= attrs_offset < bytes_in_use <= bytes_allocated and \
+        flags <= 0xF
+
+
+def validate_candidate(volume, signature, offset):
+    """
+    Check whether there's a plausible structure at the given offset.
+
+    @rtype: CarvedStructure, or None
+    """
+    header = volume[offset:offset + USA_STRUCT.size]
+    if len(header) < USA_STRUCT.size:
+        return None
+    size = _structure_size(header)
+    if size is None:
+        return None
+
+    buf = bytes(volume[offset:offset + size])
+    if len(buf) < size:
+        return None
+
+    data = bytearray(buf)
+    if apply_fixups(data, size, count=1, use_numpy=False):
+        return None
+
+    if signature == INDX_SIGNATURE:
+        if not _is_plausible_index_block(data, size):
+            return None
+        try:
+            INDEX_BLOCK(data, 0, fixed_up=True, block_size=size).index().header()
+        except (ParseException, struct.error):
+            return None
+    else:
+        if not _is_plausible_mft_record(data, size):
+            return None
+        try:
+            # MFTRecord applies the fixups itself, so give it the raw buffer
+            record = MFTRecord(buf, 0, None)
+            for attribute in record.attributes():
+                attribute.name()
+                if not attribute.non_resident():
+                    attribute.value()
+        except (ParseException, struct.error):
+            return None
+    return CarvedStructure(signature, offset, buf)
+
+
+def find_signature(volume, signature, start=0, end=None, alignment=SECTOR_SIZE):
+    """
+    Yield the offsets of the signature between `start` and `end` that
+      are aligned to `alignment`.
+    """
+    if end is None:
+        end = len(volume)
+    offset = volume.find(signature, start, end)
+    while offset != -1:
+        if offset % alignment == 0:
+            yield offset
+            offset = volume.find(signature, offset + alignment, end)
+        else:
+            # skip to the next aligned offset
+            offset = volume.find(signature, offset + alignment - offset % alignment, end)
+
+
+def carve(volume, ranges=None, signatures=(INDX_SIGNATURE, FILE_SIGNATURE),
+          alignment=SECTOR_SIZE, window_size=WINDOW_SIZE):
+    """
+    Yield the structures found in the volume, ordered by offset.
+
+    The ranges are searched one window at a time, so that structures
+      are yielded as they are found, and only the hits of one window
+      are held at once.
+
+    @type ranges: iterable of (int, int)
+    @param ranges: The (start, end) byte ranges of the volume to search,
+      such as from `unallocated_ranges`. By default, the whole volume.
+    @rtype: generator of CarvedStructure
+    """
+    if ranges is None:
+        ranges = [(0, len(volume))]
+
+    for start, end in split_ranges(ranges, window_size):
+        hits = []
+        for signature in signatures:
+            for offset in find_signature(volume, signature, start, end, alignment):
+                hits.append((offset, signature))
+        hits.sort()
+        for offset, signature in hits:
+            carved = validate_candidate(volume, signature, offset)
+            if carved is not None:
+                yield carved
+
+
+def carve_index_entries(carved_structures):
+    """
+    Yield (CarvedStructure, bool, MFT_INDEX_ENTRY) for each active and
+      slack entry of the carved INDX blocks. The bool is True for active
+      entries.
+    """
+    for carved in carved_structures:
+        if carved.signature != INDX_SIGNATURE:
+            continue
+        index = carved.structure().index()
+        for entry in index.entries():
+            yield carved, True, entry
+        for entry in index.slack_entries():
+            yield carved, False, entry
+
+
+def unallocated_ranges(fs, min_clusters=1):
+    """
+    Yield the (start, end) byte ranges of the runs of unallocated
+      clusters in the file system, per $Bitmap.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @type min_clusters: int
+    @param min_clusters: Skip the runs smaller than this.
+    """
+    cluster_size = fs.get_cluster_size()
+    for lcn, count in fs.get_free_extents(min_clusters):
+        yield lcn * cluster_size, (lcn + count) * cluster_size
+
+
+def split_ranges(ranges, window_size=WINDOW_SIZE):
+    """
+    Split the (start, end) ranges into windows no larger than `window_size`.
+    """
+    for start, end in ranges:
+        while start < end:
+            yield start, min(start + window_size, end)
+            start += window_size
+
+
+# state private to each worker process, set up by `_init_worker`
+g_worker = {}
+
+
+def _init_worker(image_filename, volume_offset, state):
+    """
+    @type state: dict
+    @param state: Anything else the worker function needs, such as the
+      signatures to carve, added to `g_worker`.
+    """
+    mmap = Mmap(image_filename)
+    g_worker["mmap"] = mmap
+    g_worker["volume"] = FlatVolume(mmap.__enter__(), volume_offset)
+    g_worker.update(state)
+
+
+def _carve_window(window):
+    return list(carve(g_worker["volume"], ranges=[window],
+                      signatures=g_worker["signatures"],
+                      alignment=g_worker["alignment"]))
+
+
+def carve_parallel(image_filename, volume_offset=0, ranges=None,
+                   signatures=(INDX_SIGNATURE, FILE_SIGNATURE),
+                   alignment=SECTOR_SIZE, window_size=WINDOW_SIZE, jobs=None):
+    """
+    Like `carve`, but opens the image in a pool of worker processes, and
+      carves windows of the volume in parallel.
+    Results are yielded in the same order as `carve`.
+    """
+    if ranges is None:
+        with Mmap(image_filename) as buf:
+            ranges = [(0, len(FlatVolume(buf, volume_offset)))]
+    windows = split_ranges(ranges, window_size)
+
+    pool = multiprocessing.Pool(jobs, _init_worker,
+                                (image_filename, volume_offset,
+                                 {"signatures": signatures, "alignment": alignment}))
+    try:
+        for carved_structures in pool.imap(_carve_window, windows):
+            for carved in carved_structures:
+                yield carved
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _consume_window(window):
+    start, end = window
+    return g_worker["consumer"](start, g_worker["volume"][start:end])
+
+
+def consume_unallocated_parallel(image_filename, consumer, volume_offset=0,
+                                 min_clusters=1, window_size=WINDOW_SIZE, overlap=0,
+                                 jobs=None):
+    """
+    Call `consumer(offset, data)` for each window of the unallocated
+      clusters of the file system, in a pool of worker processes that
+      each open the image, and yield the results in volume order.
+    The windows don't cross multiples of `window_size`, other than by
+      `overlap` bytes (see `split_aligned_ranges`).
+
+    @type consumer: callable(int, str)
+    @param consumer: A module level function, so it can be pickled,
+      such as a keyword search that returns the offsets of its hits.
+    @type overlap: int
+    @param overlap: For a keyword search, one less than the length of the
+      longest keyword, so that hits that cross windows aren't lost.
+    """
+    with Mmap(image_filename) as buf:
+        fs = NTFSFilesystem(FlatVolume(buf, volume_offset))
+        ranges = list(unallocated_ranges(fs, min_clusters))
+    windows = split_aligned_ranges(ranges, window_size, overlap=overlap)
+
+    pool = multiprocessing.Pool(jobs, _init_worker,
+                                (image_filename, volume_offset, {"consumer": consumer}))
+    try:
+        for result in pool.imap(_consume_window, windows):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _make_test_structure(signature, size, usa_offset, usn, header):
+    """
+    Build a multi-sector structure with valid fixups, whose header
+      fields at `header[0]` are packed with the struct `header[1]`.
+    """
+    usa_count = size // SECTOR_SIZE + 1
+    data = bytearray(size)
+    USA_STRUCT.pack_into(data, 0, signature, usa_offset, usa_count)
+    header_offset, header_struct, values = header
+    header_struct.pack_into(data, header_offset, *values)
+    struct.pack_into("<H", data, usa_offset, usn)
+    for i in xrange(usa_count - 1):
+        struct.pack_into("<H", data, SECTOR_SIZE * (i + 1) - 2, usn)
+    return bytes(data)
+
+
+def test():
+    record = _make_test_structure(FILE_SIGNATURE, 0x400, 0x30, 0x0102,
+                                  (FILE_HEADER_OFFSET, FILE_HEADER_STRUCT,
+                                   (0x38, 0x1, 0x100, 0x400)))
+    block = _make_test_structure(INDX_SIGNATURE, 0x400, 0x28, 0x0304,
+                                 (INDX_INDEX_HEADER_OFFSET, INDX_INDEX_HEADER_STRUCT,
+                                  (0x28, 0x38, 0x3e8)))
+    torn = bytearray(record)
+    torn[SECTOR_SIZE - 2:SECTOR_SIZE] = "\xff\xff"
+    bad_header = bytearray(record)
+    FILE_HEADER_STRUCT.pack_into(bad_header, FILE_HEADER_OFFSET, 0x38, 0x1, 0x800, 0x400)
+    # a resident attribute whose value runs past the end of the record
+    bad_attribute = bytearray(record)
+    struct.pack_into("<IIBBHHHIH", bad_attribute, 0x38,
+                     0x10, 0x18, 0, 0, 0, 0, 0, 0x1000, 0x18)
+
+    volume = FlatVolume(
+        "\x00" * 0x200 +
+        "FILE" + "\x00" * 0x1fc +   # a bare signature, with no update sequence array
+        record +
+        bytes(torn) +
+        "\x00\x00FILE" + "\x00" * 0x1fa +  # unaligned
+        block +
+        bytes(bad_header) +
+        bytes(bad_attribute), 0)
+
+    assert list(find_signature(volume, FILE_SIGNATURE)) == [0x200, 0x400, 0x800, 0x1200, 0x1600]
+    assert validate_candidate(volume, FILE_SIGNATURE, 0x200) is None
+    assert validate_candidate(volume, FILE_SIGNATURE, 0x800) is None
+    assert validate_candidate(volume, FILE_SIGNATURE, 0x1200) is None
+    assert validate_candidate(volume, FILE_SIGNATURE, 0x1600) is None
+    carved = validate_candidate(volume, FILE_SIGNATURE, 0x400)
+    assert carved.buf == record
+    assert carved.structure().mft_record_number() == 0
+
+    assert [(c.signature, c.offset) for c in carve(volume)] == \
+        [(FILE_SIGNATURE, 0x400), (INDX_SIGNATURE, 0xe00)]
+    assert [c.offset for c in carve(volume, ranges=[(0xc00, 0x1200)])] == [0xe00]
+    # a structure is found in the window where it starts
+    assert [c.offset for c in carve(volume, window_size=0x600)] == [0x400, 0xe00]
+    assert list(split_ranges([(0, 10), (20, 25)], window_size=4)) == \
+        [(0, 4), (4, 8), (8, 10), (20, 24), (24, 25)]
+    assert list(split_aligned_ranges([(2, 10), (13, 15)], window_size=4)) == \
+        [(2, 4), (4, 8), (8, 10), (13, 15)]
+    assert list(split_aligned_ranges([(2, 10), (13, 15)], window_size=4, overlap=1)) == \
+        [(2, 5), (4, 9), (8, 10), (13, 15)]
+    print("carve passed tests.")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,8 +1,11 @@
 import sys
+import bisect
 import logging
 
 import math
 
+from ntfs.Bitmap import Bitmap
+from ntfs.volume import split_aligned_ranges
 from ntfs.BinaryParser import Block
 from ntfs.BinaryParser import OverrunBufferException
 from ntfs.mft.MFT import InvalidRecordException
@@ -15,6 +18,7 @@ from ntfs.mft.MFT import MFTEnumerator
 from ntfs.mft.MFT import MFT_RECORD_SIZE
 from ntfs.mft.MFT import INDEX_ALLOCATION
 from ntfs.mft.MFT import AttributeNotFoundError
+from ntfs.secure import SecureFile
 
 
 g_logger = logging.getLogger("ntfs.filesystem")
@@ -132,9 +136,39 @@ class NTFSFile(File, NTFSFileMetadataMixin):
     def __str__(self):
         return "File(name: %s)" % (self.get_name())
 
+    def get_data(self, stream=""):
+        """
+        Get a $DATA stream, by default the unnamed one, which may be
+          sliced like a bytestring. Holding on to it avoids decoding the
+          runlist for each read.
+        """
+        data_attribute = self._record.data_attribute(stream)
+        if data_attribute is None:
+            return ""
+        return self._fs.get_attribute_data(data_attribute)
+
+    def get_stream_names(self):
+        """
+        Get the names of the alternate data streams of the file.
+
+        @rtype: list of unicode
+        """
+        return [attr.name() for attr in self._record.attributes()
+                if attr.type() == ATTR_TYPE.DATA and attr.name() != ""]
+
+    def get_stream_size(self, stream):
+        """
+        @rtype: int, or None if there's no such stream
+        """
+        data_attribute = self._record.data_attribute(stream)
+        if data_attribute is None:
+            return None
+        if data_attribute.non_resident() == 0:
+            return len(data_attribute.value())
+        return data_attribute.data_size()
+
     def read(self, offset, length):
-        data_attribute = self._record.data_attribute()
-        data = self._fs.get_attribute_data(data_attribute)
+        data = self.get_data()
         return data[offset:offset+length]
 
     def get_full_path(self):
@@ -397,6 +431,15 @@ INODE_RESERVED2 = 14
 INODE_RESERVED3 = 15
 INODE_FIRST_USER = 16
 
+# the name of the attributes that make up a directory index
+I30 = "$I30"
+
+# the unit of index block VCNs, when blocks are smaller than a cluster
+SECTOR_SIZE = 512
+
+# the size, and alignment, of the reads of `read_free_extents`
+FREE_EXTENT_READ_SIZE = 4 * 1024 * 1024
+
 
 class NonResidentAttributeData(object):
     """
@@ -413,39 +456,40 @@ class NonResidentAttributeData(object):
         self._clusters = clusters
         self._runlist = runlist
         self._runentries = list(self._runlist.runs())
-        self._len = None
+        # the run table: the byte offset at which each run starts,
+        #   so the run holding an offset is found by bisection.
+        csize = clusters.get_cluster_size()
+        self._run_starts = []
+        offset = 0
+        for _, num_clusters in self._runentries:
+            self._run_starts.append(offset)
+            offset += num_clusters * csize
+        self._len = offset
+
+    def _find_run(self, index):
+        """
+        @return: the index of the run that holds the byte at `index`.
+        """
+        return bisect.bisect_right(self._run_starts, index) - 1
 
     def __getitem__(self, index):
-        # TODO: clarify variable names and their units
-        # units: bytes
-        current_run_start_offset = 0
-
         if index < 0:
             index = len(self) + index
+        if not 0 <= index < len(self):
+            raise IndexError("%d is greater than the non resident "
+                             "attribute data length %s", index, len(self))
 
         clusters = self._clusters
         csize = clusters.get_cluster_size()
 
-        # units: clusters
-        for cluster_offset, num_clusters in self._runentries:
-            # units: bytes
-            run_length = num_clusters * csize
-            right_border = current_run_start_offset + run_length
-
-            # Check if the target byte in the run entry
-            if current_run_start_offset <= index < right_border:
-                # units: bytes
-                target_idx = index - current_run_start_offset
-                # The index of the cluster that contains the target byte
-                target_cluster_idx = int(target_idx/csize)
-                # The index of the target byte relative to the cluster
-                byte_relative_idx = (target_idx - target_cluster_idx * csize)
-                cluster = clusters[cluster_offset+target_cluster_idx]
-                return cluster[byte_relative_idx]
-            # else looking at next run entry
-            current_run_start_offset += run_length
-        raise IndexError("%d is greater than the non resident "
-                         "attribute data length %s", index, len(self))
+        run = self._find_run(index)
+        cluster_offset, _ = self._runentries[run]
+        if cluster_offset is None:
+            return "\x00"
+        # units: bytes
+        target_idx = index - self._run_starts[run]
+        cluster = clusters[cluster_offset + target_idx // csize]
+        return cluster[target_idx % csize]
 
     def __getslice__(self, start, stop):
         """
@@ -454,8 +498,6 @@ class NonResidentAttributeData(object):
         :param stop: stop byte
         :return:
         """
-        # TODO: there are some pretty bad inefficiencies here, i believe
-        # TODO: clarify variable names and their units
         g_logger.debug("NonResidentAttributeData: getslice: "
                        "start: %x end: %x", start, stop)
         _len = len(self)
@@ -472,33 +514,26 @@ class NonResidentAttributeData(object):
             raise IndexError("(%d, %d) is greater "
                              "than the non resident attribute data length %s",
                              start, stop, _len)
+        if start >= stop:
+            return bytearray()
+
         clusters = self._clusters
         csize = clusters.get_cluster_size()
 
         ret = bytearray()
-        virt_cluster_offset = 0
-        virt_byte_offset = 0
-        have_found_start = False
-
-        for run, (cluster_offset, num_clusters) in enumerate(self._runentries):
+        first_run = self._find_run(start)
+        for run in xrange(first_run, len(self._runentries)):
+            cluster_offset, num_clusters = self._runentries[run]
             g_logger.debug("NonResidentAttributeData: "
-                           "getslice: runentry: start: %x len: %x",
-                           cluster_offset * csize, num_clusters * csize)
-            run_byte_len = num_clusters * csize
-            # check if start byte in the data run
-            virt_byte_stop = virt_byte_offset + run_byte_len
-            is_start_in_run = (virt_byte_offset <= start < virt_byte_stop)
-
-            if not have_found_start:
-                if is_start_in_run:
-                    have_found_start = True
-                else:
-                    virt_byte_offset += run_byte_len
-                    continue
-
-            cluster_stop = cluster_offset + num_clusters
-
+                           "getslice: runentry: start: %s len: %x",
+                           "sparse" if cluster_offset is None else hex(cluster_offset * csize),
+                           num_clusters * csize)
+            # units: bytes
+            virt_byte_offset = self._run_starts[run]
+            virt_byte_stop = virt_byte_offset + num_clusters * csize
+            is_start_in_run = run == first_run
             is_stop_in_run = stop <= virt_byte_stop
+
             # This is the situation when we have only one data run
             # everything is in this run
             if is_start_in_run and is_stop_in_run:
@@ -508,42 +543,98 @@ class NonResidentAttributeData(object):
 
                 cstop = int(math.ceil(float(_stop)/csize))
                 cstart = _start/csize
-                abs_start = cluster_offset + cstart
-                abs_stop = cluster_offset + cstop
-                _bytes = clusters[abs_start:abs_stop]
+                _bytes = self._read_clusters(cluster_offset, cstart, cstop)
                 # byte offset relative to virtual clusters
-                rbyte_offset = (start/csize)*csize
-                return _bytes[start - rbyte_offset:stop - rbyte_offset]
+                rbyte_offset = cstart * csize
+                return _bytes[_start - rbyte_offset:_stop - rbyte_offset]
 
-            _bytes = clusters[cluster_offset:cluster_stop]
+            # only read the clusters of the run within the slice
+            cstart = 0
+            cstop = num_clusters
+            if is_start_in_run:
+                cstart = (start - virt_byte_offset) / csize
+            if is_stop_in_run:
+                cstop = int(math.ceil(float(stop - virt_byte_offset) / csize))
+            _bytes = self._read_clusters(cluster_offset, cstart, cstop)
+            rbyte_offset = virt_byte_offset + cstart * csize
             _start = _stop = None
             if is_start_in_run:
-                _start = start - virt_byte_offset
+                _start = start - rbyte_offset
             if is_stop_in_run:
-                _stop = stop - virt_byte_offset
-            # if start and stop are not in the data run,
-            # then copy all bytes from the data run's clusters
-            # _bytes[None:None] === _bytes[:]
+                _stop = stop - rbyte_offset
             ret.extend(_bytes[_start:_stop])
-            virt_cluster_offset += num_clusters
-            virt_byte_offset += run_byte_len
+            if is_stop_in_run:
+                break
 
         return ret
 
+    def _read_clusters(self, cluster_offset, start, stop):
+        """
+        Read clusters `start` to `stop` of the run at `cluster_offset`,
+          which are zeros for a sparse run.
+        """
+        if cluster_offset is None:
+            return "\x00" * ((stop - start) * self._clusters.get_cluster_size())
+        return self._clusters[cluster_offset + start:cluster_offset + stop]
+
+    def get_allocated_ranges(self):
+        """
+        Yield the (start, end) byte ranges of the data that are backed
+          by clusters, that is, not sparse. Adjacent runs are merged.
+        """
+        csize = self._clusters.get_cluster_size()
+        offset = 0
+        range_start = None
+        for cluster_offset, num_clusters in self._runentries:
+            if cluster_offset is None:
+                if range_start is not None:
+                    yield range_start, offset
+                    range_start = None
+            elif range_start is None:
+                range_start = offset
+            offset += num_clusters * csize
+        if range_start is not None:
+            yield range_start, offset
+
     def __len__(self):
-        if self._len is not None:
-            return self._len
-        ret = 0
-        for cluster_start, num_clusters in self._runentries:
-            g_logger.debug("NonResidentAttributeData: len: run: "
-                           "cluster: %x len: %x", cluster_start, num_clusters)
-            ret += num_clusters * self._clusters.get_cluster_size()
-        self._len = ret
-        return ret
+        return self._len
+
+
+class VolumeStatistics(object):
+    """
+    The size and usage of a volume, in clusters and MFT records.
+    """
+    __slots__ = ("cluster_size", "total_clusters", "allocated_clusters",
+                 "total_records", "allocated_records")
+
+    def __init__(self, cluster_size, total_clusters, allocated_clusters,
+                 total_records, allocated_records):
+        self.cluster_size = cluster_size
+        self.total_clusters = total_clusters
+        self.allocated_clusters = allocated_clusters
+        self.total_records = total_records
+        self.allocated_records = allocated_records
+
+    def free_clusters(self):
+        return self.total_clusters - self.allocated_clusters
+
+    def free_records(self):
+        return self.total_records - self.allocated_records
+
+    def __str__(self):
+        return "VolumeStatistics(clusters: %d/%d, records: %d/%d)" % (
+            self.allocated_clusters, self.total_clusters,
+            self.allocated_records, self.total_records)
 
 
 class NTFSFilesystem(object):
-    def __init__(self, volume, cluster_size=None):
+    def __init__(self, volume, cluster_size=None, budget=None):
+        """
+        @type budget: ntfs.Cache.MemoryBudget
+        @param budget: An optional memory budget shared by the MFT record
+          and path caches (and anything else the caller attaches, such
+          as the `FileMap` underlying `volume`).
+        """
         oem_id = volume[3:7]
         assert oem_id == 'NTFS', 'Wrong OEM signature'
 
@@ -557,6 +648,9 @@ class NTFSFilesystem(object):
 
         self._clusters = ClusterAccessor(volume, cluster_size)
         self._logger = logging.getLogger("NTFSFilesystem")
+        self._secure = None
+        self._volume_bitmap = None
+        self._volume_statistics = None
 
         # balance memory usage with performance
         try:
@@ -584,7 +678,7 @@ class NTFSFilesystem(object):
         #     #  to avoid getslice lookups
         #     self._mft_data = b[:]
         self._mft_data = b
-        self._enumerator = MFTEnumerator(self._mft_data)
+        self._enumerator = MFTEnumerator(self._mft_data, budget=budget)
 
         # test there's at least some user content (aside from root), or we'll
         #   assume something's up
@@ -629,6 +723,116 @@ class NTFSFilesystem(object):
         g_logger.debug("get_record: %d", record_number)
         return self._enumerator.get_record(record_number)
 
+    def get_cluster_size(self):
+        return self._cluster_size
+
+    def get_cluster_count(self):
+        """
+        Get the number of clusters in the volume, per the VBR. The image
+          may hold more data after the end of the volume.
+
+        @rtype: int
+        """
+        vbr = self._vbr
+        return vbr.total_sectors() * vbr.bytes_per_sector() // self._cluster_size
+
+    def get_volume_serial_number(self):
+        return self._vbr.volume_serial_number()
+
+    def get_cluster_bitmap(self):
+        """
+        Get the contents of $Bitmap, one bit per cluster, set if the
+          cluster is allocated.
+
+        @rtype: str
+        """
+        record = self.get_record(INODE_BITMAP)
+        return bytes(self.get_attribute_data(record.data_attribute())[:])
+
+    def get_volume_bitmap(self):
+        """
+        Get $Bitmap, trimmed to the clusters of the volume.
+          It's loaded once, as is its count of allocated clusters.
+
+        @rtype: ntfs.Bitmap.Bitmap
+        """
+        if self._volume_bitmap is None:
+            self._volume_bitmap = Bitmap(self.get_cluster_bitmap(),
+                                         self.get_cluster_count())
+        return self._volume_bitmap
+
+    def get_free_extents(self, min_clusters=1):
+        """
+        Yield the (lcn, cluster count) extents of the clusters that
+          aren't allocated to any file, per $Bitmap.
+
+        @type min_clusters: int
+        @param min_clusters: Skip the extents smaller than this.
+        """
+        return self.get_volume_bitmap().clear_runs(min_length=min_clusters)
+
+    def read_free_extents(self, min_clusters=1, read_size=FREE_EXTENT_READ_SIZE):
+        """
+        Yield the (offset, data) chunks of the free extents, read
+          `read_size` at a time. Chunks don't cross multiples of
+          `read_size`, so the reads are aligned, except at the ends of
+          the extents.
+
+        @type read_size: int
+        @param read_size: A multiple of the cluster size.
+        """
+        cluster_size = self._cluster_size
+        extents = ((lcn * cluster_size, (lcn + count) * cluster_size)
+                   for lcn, count in self.get_free_extents(min_clusters))
+        for start, stop in split_aligned_ranges(extents, read_size):
+            yield start, self._volume[start:stop]
+
+    def get_volume_statistics(self):
+        """
+        Count the clusters allocated per $Bitmap, and the MFT records
+          allocated per $MFT:$BITMAP, out of those the $MFT can hold.
+          Computed once.
+
+        @rtype: VolumeStatistics
+        """
+        if self._volume_statistics is not None:
+            return self._volume_statistics
+
+        clusters = self.get_volume_bitmap()
+        total_records = self.get_record(INODE_MFT).data_attribute().data_size() / MFT_RECORD_SIZE
+        mft_bitmap = self.get_mft_bitmap()
+        if mft_bitmap is None:
+            allocated_records = 0
+        else:
+            allocated_records = Bitmap(mft_bitmap, total_records).count_set()
+
+        self._volume_statistics = VolumeStatistics(
+            self._cluster_size, len(clusters), clusters.count_set(),
+            total_records, allocated_records)
+        return self._volume_statistics
+
+    def get_mft_bitmap(self):
+        """
+        Get the contents of $MFT:$BITMAP, one bit per MFT record, set
+          if the record is allocated.
+
+        @rtype: str, or None if the $MFT has no $BITMAP
+        """
+        try:
+            attribute = self.get_record(INODE_MFT).attribute(ATTR_TYPE.BITMAP)
+        except AttributeNotFoundError:
+            return None
+        return bytes(self.get_attribute_data(attribute)[:])
+
+    def get_mft_enumerator(self):
+        """
+        @rtype: MFTEnumerator
+        """
+        return self._enumerator
+
+    def get_cache_stats(self):
+        return self._enumerator.get_cache_stats()
+
     def get_record_path(self, record):
         return self._enumerator.get_path(record)
 
@@ -656,6 +860,90 @@ class NTFSFilesystem(object):
 
         return NTFSDirectory(self, parent_record)
 
+    def get_index_root(self, record, name=I30, index_entry_class=None):
+        """
+        @type name: str
+        @param name: The name of the index, by default the directory
+          index, $I30.
+        @type index_entry_class: type
+        @param index_entry_class: The type of the entries of the index,
+          by default MFT_INDEX_ENTRY.
+        @raises AttributeNotFoundError: if the record has no such index
+        """
+        indx_root_attr = record.attribute(ATTR_TYPE.INDEX_ROOT, name=name)
+        return INDEX_ROOT(self.get_attribute_data(indx_root_attr), 0,
+                          index_entry_class=index_entry_class)
+
+    def get_index_allocation(self, record, indx_root=None, name=I30,
+                             index_entry_class=None):
+        """
+        Get the INDEX_ALLOCATION of an index, by default the $I30 index
+          of a directory, sized using the index record size from its
+          INDEX_ROOT, and aware of which blocks are in use per its $BITMAP.
+
+        @raises AttributeNotFoundError: if the index is small
+        """
+        indx_alloc_attr = record.attribute(ATTR_TYPE.INDEX_ALLOCATION, name=name)
+        if indx_root is None:
+            indx_root = self.get_index_root(record, name=name)
+
+        try:
+            bitmap_attr = record.attribute(ATTR_TYPE.BITMAP, name=name)
+            bitmap = self.get_attribute_data(bitmap_attr)[:]
+        except AttributeNotFoundError:
+            g_logger.debug("record %d has no %s $BITMAP", record.inode, name)
+            bitmap = None
+
+        return INDEX_ALLOCATION(self.get_attribute_data(indx_alloc_attr), 0,
+                                block_size=indx_root.index_record_size_bytes(),
+                                bitmap=bitmap,
+                                index_entry_class=index_entry_class)
+
+    def find_index_entry(self, record, key, name, index_entry_class):
+        """
+        Search an index of the record for the entry with the given key,
+          descending the B+ tree from the INDEX_ROOT through the blocks
+          of the INDEX_ALLOCATION, rather than reading every block.
+
+        @type index_entry_class: type
+        @param index_entry_class: The type of the entries of the index,
+          which must implement `key()`, such as SII_INDEX_ENTRY.
+        @return: An instance of `index_entry_class`, or None.
+        @raises AttributeNotFoundError: if the record has no such index
+        """
+        indx_root = self.get_index_root(record, name=name,
+                                        index_entry_class=index_entry_class)
+        entry, vcn = indx_root.index().search(key)
+        if vcn is None:
+            return entry
+
+        indx_alloc = self.get_index_allocation(record, indx_root=indx_root, name=name,
+                                               index_entry_class=index_entry_class)
+        block_size = indx_root.index_record_size_bytes()
+        if block_size >= self._cluster_size:
+            vcn_size = self._cluster_size
+        else:
+            # small index blocks are addressed in sectors
+            vcn_size = SECTOR_SIZE
+
+        seen = set()
+        while vcn is not None and vcn not in seen:
+            seen.add(vcn)
+            entry, vcn = indx_alloc.block_at(vcn * vcn_size).index().search(key)
+        return entry
+
+    def get_security_descriptor(self, security_id):
+        """
+        Get the security descriptor with the given ID, such as from
+          `StandardInformation.security_id`, see `ntfs.secure.SecureFile`.
+
+        @rtype: ntfs.secure.SDS.SECURITY_DESCRIPTOR_RELATIVE
+        @raises ntfs.secure.SecurityDescriptorNotFoundError
+        """
+        if self._secure is None:
+            self._secure = SecureFile(self)
+        return self._secure.get_security_descriptor(security_id)
+
     def get_record_children(self, record):
         # we use a map here to de-dup entries with different filename types
         #  such as 8.3, POSIX, or Windows,  but the same ultimate MFT reference
@@ -663,34 +951,24 @@ class NTFSFilesystem(object):
         if not record.is_directory():
             return ret.values()
 
-        # TODO: cleanup the duplication here
-        try:
-            indx_alloc_attr = record.attribute(ATTR_TYPE.INDEX_ALLOCATION)
-            indx_alloc = INDEX_ALLOCATION(self.get_attribute_data(indx_alloc_attr), 0)
-            #g_logger.debug("INDEX_ALLOCATION len: %s", hex(len(indx_alloc)))
-            #g_logger.debug("alloc:\n%s", indx_alloc.get_all_string(indent=2))
-            indx = indx_alloc
-
-            for block in indx.blocks():
-                for entry in block.index().entries():
-                    ref = MREF(entry.header().mft_reference())
-                    if ref == INODE_ROOT and \
-                       entry.filename_information().filename() == ".":
-                        continue
-                    ret[ref] = self._enumerator.get_record(ref)
-
-        except AttributeNotFoundError:
-            indx_root_attr = record.attribute(ATTR_TYPE.INDEX_ROOT)
-            indx_root = INDEX_ROOT(self.get_attribute_data(indx_root_attr), 0)
-            indx = indx_root
-
-            for entry in indx.index().entries():
+        def add_entries(index):
+            for entry in index.entries():
                 ref = MREF(entry.header().mft_reference())
                 if ref == INODE_ROOT and \
                    entry.filename_information().filename() == ".":
                     continue
                 ret[ref] = self._enumerator.get_record(ref)
 
+        indx_root = self.get_index_root(record)
+        add_entries(indx_root.index())
+        try:
+            indx_alloc = self.get_index_allocation(record, indx_root=indx_root)
+        except AttributeNotFoundError:
+            return ret.values()
+
+        for block in indx_alloc.blocks():
+            add_entries(block.index())
+
         return ret.values()
 
 
@@ -0,0 +1,986 @@
+"""
+Parse the NTFS transaction log, $LogFile.
+
+$LogFile begins with two copies of the restart page ("RSTR"), followed
+  by a few tail pages, and then a circular buffer of log record pages
+  ("RCRD"). Each page is a multi-sector structure protected by fixups.
+  Log records are addressed by LSN, which encodes the byte offset of the
+  record in the file and the number of times the log has wrapped. A
+  record may continue onto following pages, after their headers.
+
+Rather than decoding every page, the parser reads the restart area to
+  find the current LSN and the oldest LSN its clients still need, and
+  walks the log records between the two. Newer copies of pages held in
+  the tail pages take precedence over the pages in the circular buffer.
+
+An `LsnIndex` joins the log to the MFT: it maps LSNs to log records,
+  and MFT record numbers to the LSNs of the operations that targeted
+  them, using sorted arrays searched with `bisect`.
+
+The LSN window can be split into segments of pages, whose first records
+  are found from the preceding page headers, so that the segments can be
+  decoded by a pool of worker processes, see `records_parallel`.
+"""
+import bisect
+import struct
+import logging
+import multiprocessing
+
+from ntfs.BinaryParser import Block
+from ntfs.BinaryParser import Mmap
+from ntfs.Fixup import apply_fixups
+from ntfs.Fixup import format_bad_fixups
+from ntfs.mft.MFT import FixupBlock
+from ntfs.mft.MFT import MFT_RECORD_SIZE
+
+
+g_logger = logging.getLogger("ntfs.logfile")
+
+LOGFILE_RECORD_NUMBER = 2
+
+RSTR_MAGIC = 0x52545352  # "RSTR"
+RCRD_MAGIC = 0x44524352  # "RCRD"
+
+DEFAULT_PAGE_SIZE = 0x1000
+
+# the number of tail pages after the two restart pages: older versions
+#   of Windows keep 2, while Windows 8 and later keep 32, regardless of
+#   the version of the log
+OLD_TAIL_PAGES = 2
+TAIL_PAGES = 32
+
+# the number of log pages decoded by a worker at a time
+SEGMENT_PAGES = 64
+
+# RCRD page flags
+LOG_PAGE_LOG_RECORD_END = 0x1
+
+# log record types
+LOG_RECORD_CLIENT_RECORD = 0x1
+LOG_RECORD_CLIENT_RESTART = 0x2
+
+# log record flags
+LOG_RECORD_MULTI_PAGE = 0x1
+
+NO_CLIENT = 0xFFFF
+
+# this_lsn, client_previous_lsn, client_undo_next_lsn, client_data_length,
+#   client sequence number, client index, record type, transaction id, flags
+LOG_RECORD_HEADER_STRUCT = struct.Struct("<QQQIHHIIH")
+# the header of an NTFS client record: redo operation, undo operation,
+#   redo offset, redo length, undo offset, undo length, target attribute,
+#   lcns to follow, record offset, attribute offset, cluster block offset,
+#   reserved, target vcn
+NTFS_LOG_RECORD_STRUCT = struct.Struct("<HHHHHHHHHHHHQ")
+LCN_STRUCT = struct.Struct("<Q")
+
+# target_vcn and cluster_block_offset address the target in these units
+CLUSTER_BLOCK_SIZE = 0x200
+
+
+class LOG_OPERATIONS:
+    Noop = 0x00
+    CompensationLogRecord = 0x01
+    InitializeFileRecordSegment = 0x02
+    DeallocateFileRecordSegment = 0x03
+    WriteEndOfFileRecordSegment = 0x04
+    CreateAttribute = 0x05
+    DeleteAttribute = 0x06
+    UpdateResidentValue = 0x07
+    UpdateNonresidentValue = 0x08
+    UpdateMappingPairs = 0x09
+    DeleteDirtyClusters = 0x0A
+    SetNewAttributeSizes = 0x0B
+    AddIndexEntryRoot = 0x0C
+    DeleteIndexEntryRoot = 0x0D
+    AddIndexEntryAllocation = 0x0E
+    DeleteIndexEntryAllocation = 0x0F
+    WriteEndOfIndexBuffer = 0x10
+    SetIndexEntryVcnRoot = 0x11
+    SetIndexEntryVcnAllocation = 0x12
+    UpdateFileNameRoot = 0x13
+    UpdateFileNameAllocation = 0x14
+    SetBitsInNonresidentBitMap = 0x15
+    ClearBitsInNonresidentBitMap = 0x16
+    HotFix = 0x17
+    EndTopLevelAction = 0x18
+    PrepareTransaction = 0x19
+    CommitTransaction = 0x1A
+    ForgetTransaction = 0x1B
+    OpenNonresidentAttribute = 0x1C
+    OpenAttributeTableDump = 0x1D
+    AttributeNamesDump = 0x1E
+    DirtyPageTableDump = 0x1F
+    TransactionTableDump = 0x20
+    UpdateRecordDataRoot = 0x21
+    UpdateRecordDataAllocation = 0x22
+    UpdateRelativeDataInIndex = 0x23
+    UpdateRelativeDataInIndex2 = 0x24
+    ZeroEndOfFileRecord = 0x25
+
+
+LOG_OPERATION_NAMES = dict((v, k) for k, v in LOG_OPERATIONS.__dict__.items()
+                           if not k.startswith("_"))
+
+
+# the operations that always target an MFT record, so the record number
+#   follows from target_vcn and cluster_block_offset
+MFT_RECORD_OPERATIONS = frozenset([
+    LOG_OPERATIONS.InitializeFileRecordSegment,
+    LOG_OPERATIONS.DeallocateFileRecordSegment,
+    LOG_OPERATIONS.WriteEndOfFileRecordSegment,
+    LOG_OPERATIONS.CreateAttribute,
+    LOG_OPERATIONS.DeleteAttribute,
+    LOG_OPERATIONS.UpdateResidentValue,
+    LOG_OPERATIONS.UpdateMappingPairs,
+    LOG_OPERATIONS.SetNewAttributeSizes,
+    LOG_OPERATIONS.AddIndexEntryRoot,
+    LOG_OPERATIONS.DeleteIndexEntryRoot,
+    LOG_OPERATIONS.SetIndexEntryVcnRoot,
+    LOG_OPERATIONS.UpdateFileNameRoot,
+    LOG_OPERATIONS.UpdateRecordDataRoot,
+    LOG_OPERATIONS.ZeroEndOfFileRecord,
+])
+
+
+def operation_name(operation):
+    """
+    @rtype: str
+    """
+    return LOG_OPERATION_NAMES.get(operation, "Unknown(%s)" % (hex(operation)))
+
+
+class InvalidLogFileError(Exception):
+    def __init__(self, msg):
+        self._msg = msg
+
+    def __str__(self):
+        return "Invalid $LogFile: %s" % (self._msg)
+
+
+class LOG_CLIENT_RECORD(Block):
+    def __init__(self, buf, offset, parent):
+        super(LOG_CLIENT_RECORD, self).__init__(buf, offset)
+        self.declare_field("qword", "oldest_lsn", 0x0)
+        self.declare_field("qword", "client_restart_lsn")
+        self.declare_field("word", "prev_client")
+        self.declare_field("word", "next_client")
+        self.declare_field("word", "seq_number")
+        self.declare_field("binary", "reserved", self.current_field_offset(), 0x6)
+        self.declare_field("dword", "client_name_length")
+        self.declare_field("binary", "client_name_buffer", self.current_field_offset(), 0x80)
+
+    def client_name(self):
+        length = min(self.client_name_length(), 0x80)
+        return bytes(self.client_name_buffer()[:length]).decode("utf-16le", "replace")
+
+    @staticmethod
+    def structure_size(buf, offset, parent):
+        return 0xA0
+
+    def __len__(self):
+        return 0xA0
+
+
+class RESTART_AREA(Block):
+    def __init__(self, buf, offset, parent):
+        super(RESTART_AREA, self).__init__(buf, offset)
+        self.declare_field("qword", "current_lsn", 0x0)
+        self.declare_field("word", "log_clients")
+        self.declare_field("word", "client_free_list")
+        self.declare_field("word", "client_in_use_list")
+        self.declare_field("word", "flags")
+        self.declare_field("dword", "seq_number_bits")
+        self.declare_field("word", "restart_area_length")
+        self.declare_field("word", "client_array_offset")
+        self.declare_field("qword", "file_size")
+        self.declare_field("dword", "last_lsn_data_length")
+        self.declare_field("word", "log_record_header_length")
+        self.declare_field("word", "log_page_data_offset")
+        self.declare_field("dword", "restart_log_open_count")
+
+    def client(self, index):
+        """
+        @rtype: LOG_CLIENT_RECORD
+        """
+        return LOG_CLIENT_RECORD(self._buf,
+                                 self.offset() + self.client_array_offset() + index * 0xA0,
+                                 self)
+
+    def clients(self):
+        """
+        Yield the clients in use, following the in-use list.
+
+        @rtype: generator of LOG_CLIENT_RECORD
+        """
+        index = self.client_in_use_list()
+        seen = set()
+        while index != NO_CLIENT and index < self.log_clients() and index not in seen:
+            seen.add(index)
+            client = self.client(index)
+            yield client
+            index = client.next_client()
+
+
+class RESTART_PAGE(FixupBlock):
+    def __init__(self, buf, offset, parent=None):
+        super(RESTART_PAGE, self).__init__(buf, offset, parent)
+        self.declare_field("dword", "magic", 0x0)
+        self.declare_field("word", "usa_offset")
+        self.declare_field("word", "usa_count")
+        self.declare_field("qword", "chkdsk_lsn")
+        self.declare_field("dword", "system_page_size")
+        self.declare_field("dword", "log_page_size")
+        self.declare_field("word", "restart_area_offset")
+        self.declare_field("word", "minor_version")
+        self.declare_field("word", "major_version")
+        if self.magic() == RSTR_MAGIC:
+            self.fixup(self.usa_count(), self.usa_offset())
+
+    def is_valid(self):
+        return self.magic() == RSTR_MAGIC and \
+            not self.bad_fixups() and \
+            self.system_page_size() >= 0x200 and \
+            self.log_page_size() >= 0x200 and \
+            0 < self.restart_area_offset() < self.system_page_size()
+
+    def restart_area(self):
+        """
+        @rtype: RESTART_AREA
+        """
+        return RESTART_AREA(self._buf, self.offset() + self.restart_area_offset(), self)
+
+
+class RECORD_PAGE(FixupBlock):
+    def __init__(self, buf, offset, parent=None, fixed_up=False):
+        """
+        @type fixed_up: bool
+        @param fixed_up: Set if the fixups have already been applied to `buf`.
+        """
+        super(RECORD_PAGE, self).__init__(buf, offset, parent)
+        self.declare_field("dword", "magic", 0x0)
+        self.declare_field("word", "usa_offset")
+        self.declare_field("word", "usa_count")
+        self.declare_field("qword", "last_lsn")
+        self.declare_field("dword", "flags")
+        self.declare_field("word", "page_count")
+        self.declare_field("word", "page_position")
+        self.declare_field("word", "next_record_offset")
+        self.declare_field("binary", "reserved", self.current_field_offset(), 0x6)
+        self.declare_field("qword", "last_end_lsn")
+        if not fixed_up and self.magic() == RCRD_MAGIC:
+            self.fixup(self.usa_count(), self.usa_offset())
+
+    def is_valid(self):
+        return self.magic() == RCRD_MAGIC
+
+
+# the fields of a record, in the order of the tuples produced by
+#   `LogFile.record_tuples`. the fields from `redo_operation` through
+#   `target_vcn` are None for records that aren't NTFS client records.
+LOG_RECORD_FIELDS = (
+    "lsn",
+    "client_previous_lsn",
+    "client_undo_next_lsn",
+    "record_type",
+    "transaction_id",
+    "flags",
+    "client_index",
+    "redo_operation",
+    "undo_operation",
+    "redo_offset",
+    "redo_length",
+    "undo_offset",
+    "undo_length",
+    "target_attribute",
+    "lcns_to_follow",
+    "record_offset",
+    "attribute_offset",
+    "cluster_block_offset",
+    "target_vcn",
+    "data",
+)
+
+NO_NTFS_FIELDS = (None,) * (len(NTFS_LOG_RECORD_STRUCT.unpack(
+    "\x00" * NTFS_LOG_RECORD_STRUCT.size)) - 1)
+
+
+class LogRecord(object):
+    """
+    A decoded log record.
+
+    `data` is the client data that follows the log record header. For
+      NTFS client records, it begins with the NTFS log record header,
+      whose fields are decoded, and contains the redo and undo data.
+    """
+    __slots__ = LOG_RECORD_FIELDS
+
+    def __init__(self, *values):
+        for name, value in zip(LOG_RECORD_FIELDS, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "LogRecord(lsn=%d, redo=%s, undo=%s)" % \
+            (self.lsn, self.redo_operation_name(), self.undo_operation_name())
+
+    def is_client_record(self):
+        return self.redo_operation is not None
+
+    def redo_operation_name(self):
+        if self.redo_operation is None:
+            return ""
+        return operation_name(self.redo_operation)
+
+    def undo_operation_name(self):
+        if self.undo_operation is None:
+            return ""
+        return operation_name(self.undo_operation)
+
+    def redo_data(self):
+        if self.redo_offset is None:
+            return ""
+        return self.data[self.redo_offset:self.redo_offset + self.redo_length]
+
+    def undo_data(self):
+        if self.undo_offset is None:
+            return ""
+        return self.data[self.undo_offset:self.undo_offset + self.undo_length]
+
+    def lcns(self):
+        """
+        @rtype: list of int
+        @return: The clusters of the target pages.
+        """
+        if self.lcns_to_follow is None:
+            return []
+        ret = []
+        for i in xrange(self.lcns_to_follow):
+            offset = NTFS_LOG_RECORD_STRUCT.size + i * LCN_STRUCT.size
+            if offset + LCN_STRUCT.size > len(self.data):
+                break
+            ret.append(LCN_STRUCT.unpack_from(self.data, offset)[0])
+        return ret
+
+    def target_mft_record_number(self, cluster_size, record_size=MFT_RECORD_SIZE):
+        """
+        Get the number of the MFT record targeted by the operation,
+          or None if it doesn't target an MFT record.
+        """
+        if not (self.redo_operation in MFT_RECORD_OPERATIONS or
+                self.undo_operation in MFT_RECORD_OPERATIONS):
+            return None
+        offset = self.target_vcn * cluster_size + self.cluster_block_offset * CLUSTER_BLOCK_SIZE
+        return offset // record_size
+
+
+def _make_record_tuple(header, data):
+    (lsn, client_previous_lsn, client_undo_next_lsn, _, _, client_index,
+     record_type, transaction_id, flags) = header
+    if record_type == LOG_RECORD_CLIENT_RECORD and len(data) >= NTFS_LOG_RECORD_STRUCT.size:
+        ntfs_fields = NTFS_LOG_RECORD_STRUCT.unpack_from(data, 0)
+        # drop the reserved word
+        ntfs_fields = ntfs_fields[:11] + ntfs_fields[12:]
+    else:
+        ntfs_fields = NO_NTFS_FIELDS
+    return (lsn, client_previous_lsn, client_undo_next_lsn, record_type,
+            transaction_id, flags, client_index) + ntfs_fields + (data,)
+
+
+class LogFile(object):
+    """
+    A $LogFile, from its restart area.
+    """
+    def __init__(self, data, size=None):
+        """
+        @type data: buffer
+        @param data: The contents of $LogFile, such as from
+          `NTFSFilesystem.get_attribute_data`.
+        @raises InvalidLogFileError: if neither restart page is valid.
+        """
+        super(LogFile, self).__init__()
+        self._data = data
+        if size is None:
+            size = len(data)
+        self._size = size
+
+        self._restart_page = self._find_restart_page()
+        self._restart_area = self._restart_page.restart_area()
+        self._system_page_size = self._restart_page.system_page_size()
+        self._page_size = self._restart_page.log_page_size()
+        self._seq_number_bits = self._restart_area.seq_number_bits()
+        self._offset_bits = 64 - self._seq_number_bits
+        self._header_length = max(self._restart_area.log_record_header_length(),
+                                  LOG_RECORD_HEADER_STRUCT.size)
+        self._data_offset = self._restart_area.log_page_data_offset()
+        self._file_size = min(self._restart_area.file_size(), self._size)
+        if not 0 < self._seq_number_bits < 64 or \
+           not 0 < self._data_offset < self._page_size:
+            raise InvalidLogFileError("implausible restart area")
+        tail_pages = self._guess_tail_pages()
+        self._first_page_offset = 2 * self._system_page_size + tail_pages * self._page_size
+        if self._first_page_offset >= self._file_size:
+            raise InvalidLogFileError("too small")
+
+        self._page_sources = self._find_tail_copies(tail_pages)
+
+    def _find_restart_page(self):
+        """
+        Of the two restart pages, get the valid one with the latest current LSN.
+        """
+        candidates = []
+        offset = 0
+        for _ in xrange(2):
+            try:
+                page = RESTART_PAGE(self._data, offset)
+            except Exception as e:
+                g_logger.debug("Failed to parse restart page at %s: %s", hex(offset), e)
+                page = None
+            if page is not None and page.is_valid():
+                candidates.append((page.restart_area().current_lsn(), offset, page))
+                offset += page.system_page_size()
+            else:
+                offset += DEFAULT_PAGE_SIZE
+        if not candidates:
+            raise InvalidLogFileError("no valid restart page")
+        return max(candidates)[2]
+
+    def _is_tail_page(self, offset):
+        """
+        Is the page at the given offset not part of the circular buffer?
+          The last record to start in a page of the buffer starts in the
+          page itself, while tail pages are copies of other pages.
+        """
+        magic = self._data[offset:offset + 4]
+        if magic != "RCRD":
+            return True
+        last_lsn = RECORD_PAGE(self._data, offset, fixed_up=True).last_lsn()
+        target = self.lsn_to_offset(last_lsn)
+        return target - target % self._page_size != offset
+
+    def _guess_tail_pages(self):
+        """
+        Get the number of tail pages: 32, unless one of the pages in the
+          would-be tail is part of the circular buffer.
+        """
+        offset = 2 * self._system_page_size
+        if offset + TAIL_PAGES * self._page_size >= self._file_size:
+            return OLD_TAIL_PAGES
+        for i in xrange(OLD_TAIL_PAGES, TAIL_PAGES):
+            if not self._is_tail_page(offset + i * self._page_size):
+                return OLD_TAIL_PAGES
+        return TAIL_PAGES
+
+    def _find_tail_copies(self, tail_pages):
+        """
+        Get the map from page offset to the offset of its newest copy,
+          for the pages whose newest copy is a tail page.
+        """
+        newest = {}
+        for i in xrange(tail_pages):
+            offset = 2 * self._system_page_size + i * self._page_size
+            page = self._read_page(offset)
+            if page is None:
+                continue
+            header = RECORD_PAGE(page, 0, fixed_up=True)
+            if not header.flags() & LOG_PAGE_LOG_RECORD_END:
+                continue
+            target = self.lsn_to_offset(header.last_end_lsn())
+            target -= target % self._page_size
+            if not self._first_page_offset <= target < self._file_size:
+                continue
+            if target not in newest or newest[target][0] < header.last_lsn():
+                newest[target] = (header.last_lsn(), offset)
+
+        sources = {}
+        for target, (last_lsn, offset) in newest.items():
+            page = self._read_page(target)
+            if page is not None and RECORD_PAGE(page, 0, fixed_up=True).last_lsn() >= last_lsn:
+                continue
+            sources[target] = offset
+        return sources
+
+    def _read_page(self, source):
+        """
+        Get a fixed up copy of the record page at the given offset.
+
+        @rtype: bytearray, or None
+        """
+        buf = bytearray(self._data[source:source + self._page_size])
+        if len(buf) < self._page_size or not buf.startswith("RCRD"):
+            return None
+        bad = apply_fixups(buf, self._page_size, count=1, use_numpy=False)
+        if bad:
+            g_logger.warning("Bad fixups at %s",
+                             format_bad_fixups(bad, source, self._page_size))
+        return buf
+
+    def get_page(self, page_offset):
+        """
+        Get the newest copy of the record page at the given offset in
+          the circular buffer, fixed up.
+
+        @rtype: bytearray, or None
+        """
+        return self._read_page(self._page_sources.get(page_offset, page_offset))
+
+    def get_restart_page(self):
+        """
+        @rtype: RESTART_PAGE
+        """
+        return self._restart_page
+
+    def get_restart_area(self):
+        """
+        @rtype: RESTART_AREA
+        """
+        return self._restart_area
+
+    def lsn_to_offset(self, lsn):
+        return (lsn & ((1 << self._offset_bits) - 1)) << 3
+
+    def lsn_sequence(self, lsn):
+        return lsn >> self._offset_bits
+
+    def offset_to_lsn(self, offset, sequence):
+        return (sequence << self._offset_bits) | (offset >> 3)
+
+    def get_window(self):
+        """
+        Get the LSNs of the oldest record needed by the clients of the
+          log, and of the current record, from the restart area.
+
+        @rtype: (int, int)
+        """
+        current_lsn = self._restart_area.current_lsn()
+        oldest = [client.oldest_lsn() for client in self._restart_area.clients()
+                  if 0 < client.oldest_lsn() <= current_lsn]
+        if not oldest:
+            return current_lsn, current_lsn
+        return min(oldest), current_lsn
+
+    def get_first_lsn(self):
+        """
+        Get the LSN of the first record written since the log last
+          wrapped, which is usually the oldest record that's still
+          intact. Fall back to the start of `get_window`.
+
+        @rtype: int
+        """
+        current_lsn = self._restart_area.current_lsn()
+        sequence = self.lsn_sequence(current_lsn)
+        page = self.get_page(self._first_page_offset)
+        if page is not None:
+            lsn = self.offset_to_lsn(self._first_page_offset + self._data_offset, sequence)
+            if LOG_RECORD_HEADER_STRUCT.unpack_from(page, self._data_offset)[0] == lsn:
+                return lsn
+            # a record spans the wrap, so the first to start is the last of the page
+            last_lsn = RECORD_PAGE(page, 0, fixed_up=True).last_lsn()
+            if self.lsn_sequence(last_lsn) == sequence and last_lsn <= current_lsn:
+                return last_lsn
+        return self.get_window()[0]
+
+    def _normalize(self, offset, sequence):
+        """
+        Move a position to where the next record header can start: past
+          page headers, the unusable end of a page, and the end of the file.
+
+        @rtype: (int, int)
+        @return: The offset and sequence number.
+        """
+        while True:
+            if offset >= self._file_size:
+                offset = self._first_page_offset + self._data_offset
+                sequence += 1
+                continue
+            position = offset % self._page_size
+            if position < self._data_offset:
+                offset += self._data_offset - position
+                continue
+            if self._page_size - position < self._header_length:
+                offset += self._page_size - position
+                continue
+            return offset, sequence
+
+    def _decode(self, start_lsn, end_lsn):
+        """
+        Yield (tuple, int, int) for each record from `start_lsn` through
+          `end_lsn`: the record, and the offset and sequence number where
+          the following record may start.
+        """
+        sequence = self.lsn_sequence(start_lsn)
+        offset = self.lsn_to_offset(start_lsn)
+        cached_offset = None
+        page = None
+        while True:
+            offset, sequence = self._normalize(offset, sequence)
+            lsn = self.offset_to_lsn(offset, sequence)
+            if lsn > end_lsn:
+                return
+
+            position = offset % self._page_size
+            page_offset = offset - position
+            if page_offset != cached_offset:
+                page = self.get_page(page_offset)
+                cached_offset = page_offset
+            if page is None:
+                g_logger.warning("Invalid log page at %s", hex(page_offset))
+                return
+
+            header = LOG_RECORD_HEADER_STRUCT.unpack_from(page, position)
+            if header[0] != lsn:
+                g_logger.debug("No log record at LSN %s", hex(lsn))
+                return
+            remaining = header[3]
+            if remaining > self._file_size:
+                g_logger.debug("Invalid log record length at LSN %s", hex(lsn))
+                return
+
+            # the client data may continue onto the following pages
+            chunks = []
+            position += self._header_length
+            while True:
+                length = min(remaining, self._page_size - position)
+                chunks.append(page[position:position + length])
+                remaining -= length
+                position += length
+                if remaining == 0:
+                    break
+                page_offset += self._page_size
+                if page_offset >= self._file_size:
+                    page_offset = self._first_page_offset
+                    sequence += 1
+                page = self.get_page(page_offset)
+                cached_offset = page_offset
+                if page is None:
+                    g_logger.warning("Invalid log page at %s", hex(page_offset))
+                    return
+                position = self._data_offset
+
+            offset = (page_offset + position + 7) & ~7
+            yield _make_record_tuple(header, bytes(bytearray().join(chunks))), offset, sequence
+
+    def _resolve_window(self, start_lsn, end_lsn):
+        window_start, window_end = self.get_window()
+        if start_lsn is None:
+            start_lsn = window_start
+        if end_lsn is None:
+            end_lsn = window_end
+        return start_lsn, end_lsn
+
+    def record_tuples(self, start_lsn=None, end_lsn=None):
+        """
+        Yield the records from `start_lsn` through `end_lsn`, in LSN order,
+          as tuples of `LOG_RECORD_FIELDS`. By default, the window from the
+          restart area, see `get_window`.
+
+        @rtype: generator of tuple
+        """
+        start_lsn, end_lsn = self._resolve_window(start_lsn, end_lsn)
+        for values, _, _ in self._decode(start_lsn, end_lsn):
+            yield values
+
+    def records(self, start_lsn=None, end_lsn=None):
+        """
+        Like `record_tuples`, but yield LogRecords.
+
+        @rtype: generator of LogRecord
+        """
+        for values in self.record_tuples(start_lsn=start_lsn, end_lsn=end_lsn):
+            yield LogRecord(*values)
+
+    def _next_lsn(self, lsn):
+        """
+        Get the LSN of the record that follows the one at `lsn`,
+          or None if there's no record at `lsn`.
+        """
+        for _, offset, sequence in self._decode(lsn, lsn):
+            offset, sequence = self._normalize(offset, sequence)
+            return self.offset_to_lsn(offset, sequence)
+        return None
+
+    def get_segments(self, start_lsn=None, end_lsn=None, segment_pages=SEGMENT_PAGES):
+        """
+        Split the LSNs from `start_lsn` through `end_lsn` into ranges
+          that each cover `segment_pages` pages, and can be decoded
+          independently. The first record of each segment is found
+          from the last record that starts in the preceding page.
+
+        @rtype: list of (int, int)
+        @return: The inclusive (start, end) LSNs of each segment.
+        """
+        start_lsn, end_lsn = self._resolve_window(start_lsn, end_lsn)
+        starts = [start_lsn]
+
+        sequence = self.lsn_sequence(start_lsn)
+        offset = self.lsn_to_offset(start_lsn)
+        page_offset = offset - offset % self._page_size
+        end_offset = self.lsn_to_offset(end_lsn)
+        end_offset -= end_offset % self._page_size
+        end_sequence = self.lsn_sequence(end_lsn)
+        num_log_pages = (self._file_size - self._first_page_offset) // self._page_size
+
+        for _ in xrange(num_log_pages):
+            if (page_offset, sequence) == (end_offset, end_sequence):
+                break
+            previous_offset = page_offset
+            page_offset += self._page_size
+            if page_offset >= self._file_size:
+                page_offset = self._first_page_offset
+                sequence += 1
+            if (page_offset - self._first_page_offset) // self._page_size % segment_pages != 0:
+                continue
+
+            page = self.get_page(previous_offset)
+            if page is None:
+                continue
+            next_lsn = self._next_lsn(RECORD_PAGE(page, 0, fixed_up=True).last_lsn())
+            if next_lsn is None or next_lsn <= starts[-1]:
+                continue
+            if next_lsn > end_lsn:
+                break
+            starts.append(next_lsn)
+
+        ends = [lsn - 1 for lsn in starts[1:]] + [end_lsn]
+        return zip(starts, ends)
+
+
+class LsnIndex(object):
+    """
+    Lookups from LSN to log record, and from MFT record number to the
+      log records that operated on the MFT record.
+
+    Both are served from sorted arrays with binary search, built once
+      from the records of the log.
+    """
+    def __init__(self, records, cluster_size, record_size=MFT_RECORD_SIZE):
+        """
+        @type records: iterable of LogRecord
+        @param records: Such as from `LogFile.records`.
+        @type cluster_size: int
+        @param cluster_size: The cluster size of the volume, used to find
+          the MFT records targeted by operations.
+        """
+        super(LsnIndex, self).__init__()
+        self._records = sorted(records, key=lambda record: record.lsn)
+        self._lsns = [record.lsn for record in self._records]
+
+        targets = []
+        for i, record in enumerate(self._records):
+            record_number = record.target_mft_record_number(cluster_size, record_size)
+            if record_number is not None:
+                targets.append((record_number, i))
+        targets.sort()
+        # parallel arrays, sorted by record number, then LSN
+        self._target_record_numbers = [target for target, _ in targets]
+        self._target_indices = [i for _, i in targets]
+
+    def __len__(self):
+        return len(self._records)
+
+    def get_record(self, lsn):
+        """
+        Get the log record with the given LSN, such as from
+          `MFTRecord.lsn` or `INDEX_BLOCK.lsn`.
+
+        @rtype: LogRecord, or None
+        """
+        i = bisect.bisect_left(self._lsns, lsn)
+        if i < len(self._lsns) and self._lsns[i] == lsn:
+            return self._records[i]
+        return None
+
+    def get_records_between(self, start_lsn, end_lsn):
+        """
+        @rtype: list of LogRecord
+        @return: The log records from `start_lsn` through `end_lsn`.
+        """
+        i = bisect.bisect_left(self._lsns, start_lsn)
+        j = bisect.bisect_right(self._lsns, end_lsn)
+        return self._records[i:j]
+
+    def get_lsns(self, record_number):
+        """
+        @rtype: list of int
+        @return: The LSNs of the operations on the given MFT record,
+          in order.
+        """
+        return [record.lsn for record in self.get_operations(record_number)]
+
+    def get_operations(self, record_number, until_lsn=None):
+        """
+        Get the log records of the operations on the given MFT record,
+          in LSN order.
+
+        @type until_lsn: int
+        @param until_lsn: If provided, only the operations up to this LSN,
+          such as the `MFTRecord.lsn` of the record, which are those
+          reflected in the record as it was written to disk.
+        @rtype: list of LogRecord
+        """
+        i = bisect.bisect_left(self._target_record_numbers, record_number)
+        j = bisect.bisect_right(self._target_record_numbers, record_number)
+        ret = [self._records[k] for k in self._target_indices[i:j]]
+        if until_lsn is not None:
+            ret = [record for record in ret if record.lsn <= until_lsn]
+        return ret
+
+    def get_record_operations(self, record):
+        """
+        Get the log records of the operations on an MFTRecord.
+
+        @type record: ntfs.mft.MFT.MFTRecord
+        @rtype: list of LogRecord
+        """
+        return self.get_operations(record.inode)
+
+
+def open_logfile(fs):
+    """
+    Open the transaction log of a file system.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @rtype: LogFile
+    @raises InvalidLogFileError: if the log can't be parsed.
+    """
+    record = fs.get_record(LOGFILE_RECORD_NUMBER)
+    attribute = record.data_attribute()
+    if attribute is None:
+        raise InvalidLogFileError("no data attribute")
+    if attribute.non_resident() == 0:
+        data = attribute.value()
+        size = len(data)
+    else:
+        data = fs.get_attribute_data(attribute)
+        size = attribute.data_size()
+    return LogFile(data, size=size)
+
+
+def open_lsn_index(fs, start_lsn=None):
+    """
+    Index the log of a file system, by default from the last wrap.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @rtype: LsnIndex
+    """
+    logfile = open_logfile(fs)
+    if start_lsn is None:
+        start_lsn = logfile.get_first_lsn()
+    return LsnIndex(logfile.records(start_lsn=start_lsn), fs.get_cluster_size())
+
+
+def _open(buf, volume_offset, raw):
+    if raw:
+        return LogFile(buf)
+    # imported here, as ntfs.filesystem depends on much of the package
+    from ntfs.volume import FlatVolume
+    from ntfs.filesystem import NTFSFilesystem
+    return open_logfile(NTFSFilesystem(FlatVolume(buf, volume_offset)))
+
+
+# state private to each worker process, set up by `_init_worker`
+g_worker = {}
+
+
+def _init_worker(filename, volume_offset, raw):
+    mmap = Mmap(filename)
+    g_worker["mmap"] = mmap
+    g_worker["logfile"] = _open(mmap.__enter__(), volume_offset, raw)
+
+
+def _decode_segment(segment):
+    start_lsn, end_lsn = segment
+    return list(g_worker["logfile"].record_tuples(start_lsn, end_lsn))
+
+
+def records_parallel(filename, volume_offset=0, raw=False, start_lsn=None, end_lsn=None,
+                     segment_pages=SEGMENT_PAGES, jobs=None):
+    """
+    Like `LogFile.records`, but decode segments of the log in a pool of
+      worker processes, each of which opens the file itself.
+    Records are yielded in LSN order.
+
+    @type filename: str
+    @param filename: The path to an image, or to an extracted $LogFile
+      if `raw` is set.
+    @rtype: generator of LogRecord
+    """
+    with Mmap(filename) as buf:
+        segments = _open(buf, volume_offset, raw).get_segments(
+            start_lsn, end_lsn, segment_pages=segment_pages)
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (filename, volume_offset, raw))
+    try:
+        for record_tuples in pool.imap(_decode_segment, segments):
+            for values in record_tuples:
+                yield LogRecord(*values)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _make_test_record(lsn, redo_operation, undo_operation, target_vcn=0,
+                      cluster_block_offset=0, redo_data="", undo_data="", lcns=()):
+    """
+    Build the LogRecord of an NTFS client record, from its raw header and data.
+    """
+    redo_offset = NTFS_LOG_RECORD_STRUCT.size + LCN_STRUCT.size * len(lcns)
+    undo_offset = redo_offset + len(redo_data)
+    data = NTFS_LOG_RECORD_STRUCT.pack(
+        redo_operation, undo_operation, redo_offset, len(redo_data),
+        undo_offset, len(undo_data), 0, len(lcns), 0, 0, cluster_block_offset,
+        0, target_vcn)
+    data += "".join(LCN_STRUCT.pack(lcn) for lcn in lcns) + redo_data + undo_data
+    header = LOG_RECORD_HEADER_STRUCT.unpack(LOG_RECORD_HEADER_STRUCT.pack(
+        lsn, lsn - 1, 0, len(data), 0, 0, LOG_RECORD_CLIENT_RECORD, 0x18, 0))
+    return LogRecord(*_make_record_tuple(header, data))
+
+
+def test():
+    record = _make_test_record(0x100, LOG_OPERATIONS.UpdateResidentValue,
+                               LOG_OPERATIONS.UpdateResidentValue,
+                               target_vcn=2, cluster_block_offset=4,
+                               redo_data="new", undo_data="old!", lcns=(0x1234,))
+    assert record.is_client_record()
+    assert record.lsn == 0x100
+    assert record.transaction_id == 0x18
+    assert record.redo_operation_name() == "UpdateResidentValue"
+    assert record.redo_data() == "new"
+    assert record.undo_data() == "old!"
+    assert record.lcns() == [0x1234]
+    # cluster 2, plus 4 blocks of 0x200: the record at 0x2800
+    assert record.target_mft_record_number(0x1000) == 10
+    assert operation_name(0x99) == "Unknown(0x99)"
+
+    header = LOG_RECORD_HEADER_STRUCT.unpack(LOG_RECORD_HEADER_STRUCT.pack(
+        0x200, 0, 0, 0, 0, 0, LOG_RECORD_CLIENT_RESTART, 0, 0))
+    restart = LogRecord(*_make_record_tuple(header, ""))
+    assert not restart.is_client_record()
+    assert restart.redo_data() == ""
+    assert restart.lcns() == []
+    assert restart.target_mft_record_number(0x1000) is None
+
+    # record 10 is written twice, and record 11 once, out of LSN order
+    records = [
+        _make_test_record(0x300, LOG_OPERATIONS.SetNewAttributeSizes,
+                          LOG_OPERATIONS.SetNewAttributeSizes, target_vcn=2, cluster_block_offset=6),
+        record,
+        restart,
+        _make_test_record(0x180, LOG_OPERATIONS.Noop, LOG_OPERATIONS.DeleteAttribute,
+                          target_vcn=2, cluster_block_offset=4),
+        _make_test_record(0x280, LOG_OPERATIONS.UpdateNonresidentValue,
+                          LOG_OPERATIONS.Noop, target_vcn=2, cluster_block_offset=4),
+    ]
+    index = LsnIndex(records, 0x1000)
+    assert len(index) == 5
+    assert index.get_record(0x180) is records[3]
+    assert index.get_record(0x181) is None
+    assert [r.lsn for r in index.get_records_between(0x100, 0x280)] == [0x100, 0x180, 0x200, 0x280]
+    assert index.get_lsns(10) == [0x100, 0x180]
+    assert index.get_lsns(11) == [0x300]
+    assert index.get_lsns(12) == []
+    assert [r.lsn for r in index.get_operations(10, until_lsn=0x100)] == [0x100]
+    print("logfile passed tests.")
+
+
+if __name__ == "__main__":
+    test()
@@ -1,21 +1,30 @@
 #!/usr/bin/env python
 
-import array
 import os
+import re
 import sys
 import struct
 import logging
 from datetime import datetime
-from collections import OrderedDict  # python 2.7 only
 
 from .. import Progress
 from .. import BinaryParser
+from ..Cache import Cache
+from ..Cache import MEGABYTE
 from ..BinaryParser import Block
 from ..BinaryParser import Nestable
+from ..BinaryParser import filetime_from_datetime
+from ..Fixup import apply_fixups
+from ..Fixup import fixup_record
+from ..Fixup import format_bad_fixups
 
 
 g_logger = logging.getLogger("ntfs.mft")
 
+# the window of plausible timestamps for entries recovered from slack
+RECENT_FILETIME = filetime_from_datetime(datetime(1990, 1, 1, 0, 0, 0))
+FUTURE_FILETIME = filetime_from_datetime(datetime(2025, 1, 1, 0, 0, 0))
+
 
 class INDXException(Exception):
     """
@@ -55,27 +64,25 @@ class FixupBlock(Block):
         super(FixupBlock, self).__init__(buf, offset)
 
     def fixup(self, num_fixups, fixup_value_offset):
-        fixup_buffer = array.array("b", self.unpack_binary(0, length=(num_fixups - 1) * 512))
+        size = max(num_fixups - 1, 0) * 512
+        fixup_buffer = bytearray(self.unpack_binary(0, length=size))
+        original_offset = self.offset()
         self._buf = fixup_buffer
         self._offset = 0
 
-        fixup_value = self.unpack_word(fixup_value_offset)
-
-        for i in range(0, num_fixups - 1):
-            fixup_offset = 512 * (i + 1) - 2
-            check_value = self.unpack_word(fixup_offset)
-
-            if check_value != fixup_value:
-                logging.warning("Bad fixup at %s", hex(self.offset() + fixup_offset))
-                continue
-
-            new_value = self.unpack_word(fixup_value_offset + 2 + 2 * i)
-            self.pack_word(fixup_offset, new_value)
+        bad_sectors = fixup_record(fixup_buffer, fixup_value_offset, num_fixups)
+        self._bad_fixups = [(0, sector) for sector in bad_sectors]
+        if bad_sectors:
+            logging.warning("Bad fixups at %s",
+                            format_bad_fixups(self._bad_fixups, original_offset, size))
 
-            check_value = self.unpack_word(fixup_offset)
-            g_logger.debug("Fixup verified at %s and patched from %s to %s.",
-                          hex(self.offset() + fixup_offset),
-                          hex(fixup_value), hex(check_value))
+    def bad_fixups(self):
+        """
+        @rtype: list of (int, int)
+        @return: The (structure index, sector index) of each sector
+          whose fixup could not be applied, see `ntfs.Fixup.apply_fixups`.
+        """
+        return getattr(self, "_bad_fixups", [])
 
 
 class INDEX_ENTRY_FLAGS:
@@ -176,25 +183,16 @@ class MFT_INDEX_ENTRY(Block, Nestable):
 
     def is_valid(self):
         # this is a bit of a mess, but it should work
-        recent_date = datetime(1990, 1, 1, 0, 0, 0)
-        future_date = datetime(2025, 1, 1, 0, 0, 0)
         try:
             fn = self.filename_information()
         except:
             return False
         if not fn:
             return False
-        try:
-            return fn.modified_time() > recent_date and \
-                   fn.accessed_time() > recent_date and \
-                   fn.changed_time() > recent_date and \
-                   fn.created_time() > recent_date and \
-                   fn.modified_time() < future_date and \
-                   fn.accessed_time() < future_date and \
-                   fn.changed_time() < future_date and \
-                   fn.created_time() < future_date
-        except ValueError:
-            return False
+        return RECENT_FILETIME < fn.modified_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.accessed_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.changed_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.created_time_raw() < FUTURE_FILETIME
 
 
 class SII_INDEX_ENTRY(Block, Nestable):
@@ -205,6 +203,11 @@ class SII_INDEX_ENTRY(Block, Nestable):
         super(SII_INDEX_ENTRY, self).__init__(buf, offset)
         self.declare_field(SECURE_INDEX_ENTRY_HEADER, "header", 0x0)
         self.declare_field("dword", "security_id")
+        # the data: a copy of the header of the $SDS entry
+        self.declare_field("dword", "descriptor_hash")
+        self.declare_field("dword", "descriptor_security_id")
+        self.declare_field("qword", "descriptor_offset")
+        self.declare_field("dword", "descriptor_length")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -213,10 +216,13 @@ class SII_INDEX_ENTRY(Block, Nestable):
     def __len__(self):
         return self.header().length()
 
+    def key(self):
+        return self.security_id()
+
     def is_valid(self):
         # TODO(wb): test
         return 1 < self.header().length() < 0x30 and \
-            1 < self.header().key_lenght() < 0x20
+            1 < self.header().key_length() < 0x20
 
 
 class SDH_INDEX_ENTRY(Block, Nestable):
@@ -228,6 +234,11 @@ class SDH_INDEX_ENTRY(Block, Nestable):
         self.declare_field(SECURE_INDEX_ENTRY_HEADER, "header", 0x0)
         self.declare_field("dword", "hash")
         self.declare_field("dword", "security_id")
+        # the data: a copy of the header of the $SDS entry
+        self.declare_field("dword", "descriptor_hash")
+        self.declare_field("dword", "descriptor_security_id")
+        self.declare_field("qword", "descriptor_offset")
+        self.declare_field("dword", "descriptor_length")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -236,10 +247,13 @@ class SDH_INDEX_ENTRY(Block, Nestable):
     def __len__(self):
         return self.header().length()
 
+    def key(self):
+        return self.hash(), self.security_id()
+
     def is_valid(self):
         # TODO(wb): test
         return 1 < self.header().length() < 0x30 and \
-            1 < self.header().key_lenght() < 0x20
+            1 < self.header().key_length() < 0x20
 
 
 class INDEX_HEADER_FLAGS:
@@ -312,27 +326,59 @@ class INDEX(Block, Nestable):
             offset += len(e)
             yield e
 
+    def search(self, key):
+        """
+        Search this node of a B+ tree index for the entry with the given
+          key, comparing with the `key()` of the entries, which are sorted.
+
+        @rtype: (INDEX_ENTRY, int)
+        @return: The matching entry and None, or None and the VCN of the
+          child node to search next, or (None, None) if the key isn't
+          in the index.
+        """
+        offset = self.header().entries_offset()
+        end = self.header().index_length()
+        while offset != 0 and offset + 0x10 <= end:
+            header = INDEX_ENTRY_HEADER(self._buf, self.offset() + offset, self)
+            length = header.length()
+            if not header.is_index_entry_end():
+                entry = self._INDEX_ENTRY(self._buf, self.offset() + offset, self)
+                entry_key = entry.key()
+                if entry_key == key:
+                    return entry, None
+                if entry_key < key and length > 0:
+                    offset += length
+                    continue
+            if header.is_index_entry_node():
+                # the VCN of the child node is the last field of the entry
+                return None, self.unpack_qword(offset + length - 8)
+            return None, None
+        return None, None
+
     def slack_entries(self):
         """
         A generator that yields INDEX_ENTRYs found in the slack space
         associated with this header.
         """
-        offset = self.header().index_length()
+        start = self.offset() + self.header().index_length()
+        end = self.offset() + self.header().allocated_size()
+        if self._INDEX_ENTRY is MFT_INDEX_ENTRY:
+            for e in scan_slack_entries(self._buf, start, end, MFT_INDEX_ENTRY, self):
+                yield e
+            return
+
+        offset = start
         try:
-            while offset <= self.header().allocated_size() - 0x52:
+            while offset <= end - 0x52:
                 try:
-                    g_logger.debug("Trying to find slack entry at %s.", hex(offset))
                     e = self._INDEX_ENTRY(self._buf, offset, self)
                     if e.is_valid():
-                        g_logger.debug("Slack entry is valid.")
                         offset += len(e) or 1
                         yield e
                     else:
-                        g_logger.debug("Slack entry is invalid.")
                         # TODO(wb): raise a custom exception
                         raise BinaryParser.ParseException("Not a deleted entry")
                 except BinaryParser.ParseException:
-                    g_logger.debug("Scanning one byte forward.")
                     offset += 1
         except struct.error:
             logging.debug("Slack entry parsing overran buffer.")
@@ -340,8 +386,14 @@ class INDEX(Block, Nestable):
 
 
 class INDEX_ROOT(Block, Nestable):
-    def __init__(self, buf, offset, parent=None):
+    def __init__(self, buf, offset, parent=None, index_entry_class=None):
+        """
+        @type index_entry_class: type
+        @param index_entry_class: The type of the entries of the index,
+          by default MFT_INDEX_ENTRY, for directory indices.
+        """
         super(INDEX_ROOT, self).__init__(buf, offset)
+        self._index_entry_class = index_entry_class or MFT_INDEX_ENTRY
         self.declare_field("dword", "type", 0x0)
         self.declare_field("dword", "collation_rule")
         self.declare_field("dword", "index_record_size_bytes")
@@ -354,7 +406,7 @@ class INDEX_ROOT(Block, Nestable):
 
     def index(self):
         return INDEX(self._buf, self._offset + self._index_offset,
-                     self, MFT_INDEX_ENTRY)
+                     self, self._index_entry_class)
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -394,23 +446,10 @@ class NTATTR_STANDARD_INDEX_HEADER(Block):
         A generator that yields INDX entries found in the slack space
         associated with this header.
         """
-        offset = self.entry_list_end()
-        try:
-            # 0x52 is an approximate size of a small index entry
-            while offset <= self.entry_list_allocation_end() - 0x52:
-                try:
-                    e = SlackIndexEntry(self._buf, offset, self)
-                    if e.is_valid():
-                        offset += e.length() or 1
-                        yield e
-                    else:
-                        # TODO(wb): raise a custom exception
-                        raise BinaryParser.ParseException("Not a deleted entry")
-                except BinaryParser.ParseException:
-                    # ensure we're always moving forward
-                    offset += 1
-        except struct.error:
-            pass
+        return scan_slack_entries(self._buf,
+                                  self.offset() + self.entry_list_end(),
+                                  self.offset() + self.entry_list_allocation_end(),
+                                  SlackIndexEntry, self)
 
 
 class IndexRootHeader(Block):
@@ -448,9 +487,28 @@ class IndexRecordHeader(FixupBlock):
                                self)
 
 
+# the usual size of an INDX block, when the INDEX_ROOT isn't at hand
+DEFAULT_INDEX_BLOCK_SIZE = 0x1000
+
+
 class INDEX_BLOCK(FixupBlock):
-    def __init__(self, buf, offset, parent=None):
+    def __init__(self, buf, offset, parent=None, fixed_up=False,
+                 block_size=DEFAULT_INDEX_BLOCK_SIZE, index_entry_class=None):
+        """
+        @type fixed_up: bool
+        @param fixed_up: Set if the fixups have already been applied to
+          `buf`, such as by `ntfs.Fixup.apply_fixups`, so that the block
+          can be parsed in place without a copy.
+        @type block_size: int
+        @param block_size: The index record size, from
+          `INDEX_ROOT.index_record_size_bytes`.
+        @type index_entry_class: type
+        @param index_entry_class: The type of the entries of the index,
+          by default MFT_INDEX_ENTRY, for directory indices.
+        """
         super(INDEX_BLOCK, self).__init__(buf, offset, parent)
+        self._block_size = block_size
+        self._index_entry_class = index_entry_class or MFT_INDEX_ENTRY
         self.declare_field("dword", "magic", 0x0)
         self.declare_field("word",  "usa_offset")
         self.declare_field("word",  "usa_count")
@@ -458,51 +516,152 @@ class INDEX_BLOCK(FixupBlock):
         self.declare_field("qword", "vcn")
         self._index_offset = self.current_field_offset()
         self.add_explicit_field(self._index_offset, INDEX, "index")
-        self.fixup(self.usa_count(), self.usa_offset())
+        if not fixed_up:
+            self.fixup(self.usa_count(), self.usa_offset())
 
     def index(self):
         return INDEX(self._buf, self._offset + self._index_offset,
-                     self, MFT_INDEX_ENTRY)
+                     self, self._index_entry_class)
 
     @staticmethod
     def structure_size(buf, offset, parent):
         return 0x30 + INDEX.structure_size(buf, offset + 0x10, parent)
 
     def __len__(self):
-        return 0x1000
+        return self._block_size
+
+
+INDX_MAGIC = 0x58444e49  # "INDX"
 
 
 class INDEX_ALLOCATION(FixupBlock):
-    def __init__(self, buf, offset, parent=None):
+    def __init__(self, buf, offset, parent=None,
+                 block_size=DEFAULT_INDEX_BLOCK_SIZE, bitmap=None,
+                 index_entry_class=None):
+        """
+        @type block_size: int
+        @param block_size: The index record size, from
+          `INDEX_ROOT.index_record_size_bytes`.
+        @type bitmap: str
+        @param bitmap: The contents of the index's $BITMAP attribute,
+          one bit per block, set if the block is in use. If not provided,
+          then blocks are probed for the INDX magic until one is missing.
+        @type index_entry_class: type
+        @param index_entry_class: The type of the entries of the index,
+          by default MFT_INDEX_ENTRY, for directory indices.
+        """
         super(INDEX_ALLOCATION, self).__init__(buf, offset, parent)
+        self._block_size = block_size
+        self._index_entry_class = index_entry_class
+        self._bitmap = None
+        if bitmap is not None:
+            self._bitmap = bytearray(bitmap)
         self.add_explicit_field(0, INDEX_BLOCK, "blocks")
 
     @staticmethod
-    def guess_num_blocks(buf, offset):
+    def guess_num_blocks(buf, offset, block_size=DEFAULT_INDEX_BLOCK_SIZE):
         count = 0
-        # TODO: don't hardcode things
-        BLOCK_SIZE = 0x1000
         try:
-            while BinaryParser.read_dword(buf, offset) == 0x58444e49:  # "INDX"
-                offset += BLOCK_SIZE
+            while BinaryParser.read_dword(buf, offset) == INDX_MAGIC:
+                offset += block_size
                 count += 1
         except (IndexError, BinaryParser.OverrunBufferException):
             return count
         return count
 
+    def num_blocks(self):
+        """
+        The number of blocks the allocation has room for, live or not.
+        """
+        if self._bitmap is None:
+            return INDEX_ALLOCATION.guess_num_blocks(self._buf, self.offset(),
+                                                     self._block_size)
+        return (len(self._buf) - self._offset) // self._block_size
+
+    def is_block_allocated(self, index):
+        if self._bitmap is None:
+            return index < self.num_blocks()
+        if index >> 3 >= len(self._bitmap):
+            return False
+        return bool(self._bitmap[index >> 3] & (1 << (index & 7)))
+
+    def _block_runs(self, allocated):
+        """
+        Yield (first block index, number of blocks) for each run of
+          consecutive blocks that are (or aren't) allocated.
+        """
+        count = self.num_blocks()
+        if self._bitmap is None:
+            if allocated and count > 0:
+                yield 0, count
+            return
+
+        run_start = None
+        for i in xrange(count):
+            if self.is_block_allocated(i) == allocated:
+                if run_start is None:
+                    run_start = i
+            elif run_start is not None:
+                yield run_start, i - run_start
+                run_start = None
+        if run_start is not None:
+            yield run_start, count - run_start
+
+    def _read_blocks(self, first, count):
+        """
+        Copy `count` blocks starting at index `first` once, and fix them
+          up together.
+        """
+        size = self._block_size
+        start = self._offset + first * size
+        data = bytearray(self._buf[start:start + size * count])
+        return data, apply_fixups(data, size, count=count)
+
     def blocks(self):
-        for i in xrange(INDEX_ALLOCATION.guess_num_blocks(self._buf, self.offset())):
-            # TODO: don't hardcode things
-            yield INDEX_BLOCK(self._buf, self._offset + 0x1000 * i)
+        """
+        A generator of the INDEX_BLOCKs in use, per the index $BITMAP.
+        """
+        size = self._block_size
+        for first, count in self._block_runs(True):
+            data, bad = self._read_blocks(first, count)
+            if bad:
+                logging.warning("Bad fixups at %s",
+                                format_bad_fixups(bad, self._offset + first * size, size))
+            for i in xrange(count):
+                yield INDEX_BLOCK(data, size * i, fixed_up=True, block_size=size,
+                                  index_entry_class=self._index_entry_class)
+
+    def block_at(self, offset):
+        """
+        Get the block at the given byte offset into the allocation,
+          such as the target of a B+ tree child VCN.
+
+        @rtype: INDEX_BLOCK
+        """
+        return INDEX_BLOCK(self._buf, self._offset + offset, block_size=self._block_size,
+                           index_entry_class=self._index_entry_class)
+
+    def unallocated_blocks(self):
+        """
+        A generator of the stale INDEX_BLOCKs that are marked free in the
+          index $BITMAP, but still have the INDX magic. Their entries are
+          all slack. Requires the $BITMAP.
+        """
+        size = self._block_size
+        for first, count in self._block_runs(False):
+            data, _ = self._read_blocks(first, count)
+            for i in xrange(count):
+                if BinaryParser.read_dword(data, size * i) != INDX_MAGIC:
+                    continue
+                yield INDEX_BLOCK(data, size * i, fixed_up=True, block_size=size,
+                                  index_entry_class=self._index_entry_class)
 
     @staticmethod
     def structure_size(buf, offset, parent):
-        # TODO: don't hardcode things
-        return 0x1000 * INDEX_ALLOCATION.guess_num_blocks(buf, offset)
+        return DEFAULT_INDEX_BLOCK_SIZE * INDEX_ALLOCATION.guess_num_blocks(buf, offset)
 
     def __len__(self):
-        # TODO: don't hardcode things
-        return 0x1000 * INDEX_ALLOCATION.guess_num_blocks(self._buf, self._offset)
+        return self._block_size * self.num_blocks()
 
 
 class IndexEntry(Block):
@@ -639,25 +798,86 @@ class SlackIndexEntry(IndexEntry):
 
     def is_valid(self):
         # this is a bit of a mess, but it should work
-        recent_date = datetime(1990, 1, 1, 0, 0, 0)
-        future_date = datetime(2025, 1, 1, 0, 0, 0)
         try:
             fn = self.filename_information()
         except:
             return False
         if not fn:
             return False
+        return RECENT_FILETIME < fn.modified_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.accessed_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.changed_time_raw() < FUTURE_FILETIME and \
+               RECENT_FILETIME < fn.created_time_raw() < FUTURE_FILETIME
+
+
+# the fixed portion of a directory index entry: the entry header,
+#   then the $FILE_NAME attribute up to the name.
+SLACK_ENTRY_STRUCT = struct.Struct("<QHHIQQQQQQQIIBB")
+SLACK_ENTRY_TIMESTAMPS_OFFSET = 0x18
+# valid FILETIMEs from the 1990s until well past 2025 have 0x01 as
+#   their most significant byte, so require it of all four timestamps.
+SLACK_ENTRY_SIGNATURE = re.compile(
+    "(?s)(?=.{7}\x01.{7}\x01.{7}\x01.{7}\x01)")
+# the root directory is the first record that can be a parent, and
+#   2**32 records is more than any volume will hold.
+MIN_PARENT_RECORD_NUMBER = 5
+MAX_PARENT_RECORD_NUMBER = 0xFFFFFFFF
+
+
+def _is_plausible_slack_entry(buf, offset, end):
+    """
+    Cheaply check the raw bytes of a candidate directory index entry.
+    """
+    (_, _, _, _, parent, created, modified, changed, accessed,
+     _, _, _, _, name_length, name_type) = SLACK_ENTRY_STRUCT.unpack_from(buf, offset)
+    return name_length >= 1 and \
+        name_type <= 3 and \
+        offset + 0x52 + 2 * name_length <= end and \
+        MIN_PARENT_RECORD_NUMBER <= parent & 0xFFFFFFFFFFFF <= MAX_PARENT_RECORD_NUMBER and \
+        RECENT_FILETIME < created < FUTURE_FILETIME and \
+        RECENT_FILETIME < modified < FUTURE_FILETIME and \
+        RECENT_FILETIME < changed < FUTURE_FILETIME and \
+        RECENT_FILETIME < accessed < FUTURE_FILETIME
+
+
+def scan_slack_entries(buf, start, end, entry_class, parent):
+    """
+    A generator that yields the directory index entries found in the
+      slack space `buf[start:end]`.
+
+    Rather than parsing a candidate entry at every byte, this searches
+      for the signature of four timestamps, and screens each hit with
+      integer compares on the raw bytes. Only survivors are parsed.
+
+    @type entry_class: type
+    @param entry_class: A directory index entry class with the layout of
+      `MFT_INDEX_ENTRY`, such as `SlackIndexEntry`.
+    @rtype: generator of `entry_class`
+    """
+    if end - start < 0x52:
+        return
+    data = buf[start:end]
+    if not isinstance(data, (str, bytearray)):
+        data = str(data)
+
+    next_offset = 0
+    for match in SLACK_ENTRY_SIGNATURE.finditer(data, SLACK_ENTRY_TIMESTAMPS_OFFSET):
+        offset = match.start() - SLACK_ENTRY_TIMESTAMPS_OFFSET
+        if offset < next_offset:
+            continue
+        if offset + 0x52 > len(data):
+            break
+        if not _is_plausible_slack_entry(data, offset, len(data)):
+            continue
         try:
-            return fn.modified_time() > recent_date and \
-                   fn.accessed_time() > recent_date and \
-                   fn.changed_time() > recent_date and \
-                   fn.created_time() > recent_date and \
-                   fn.modified_time() < future_date and \
-                   fn.accessed_time() < future_date and \
-                   fn.changed_time() < future_date and \
-                   fn.created_time() < future_date
-        except ValueError:
-            return False
+            e = entry_class(buf, start + offset, parent)
+            if not e.is_valid():
+                continue
+        except (BinaryParser.ParseException, struct.error):
+            continue
+        # don't trust the length in the entry header, which may be stale
+        next_offset = offset + 0x52 + 2 * BinaryParser.read_byte(data, offset + 0x50)
+        yield e
 
 
 class Runentry(Block, Nestable):
@@ -682,7 +902,13 @@ class Runentry(Block, Nestable):
         return 0x1 + (self._length_length + self._offset_length)
 
     def is_valid(self):
-        return self._offset_length > 0 and self._length_length > 0
+        return self._length_length > 0
+
+    def is_sparse(self):
+        """
+        Sparse runs have no offset, and are not backed by any clusters.
+        """
+        return self._offset_length == 0
 
     def lsb2num(self, binary):
         count = 0
@@ -712,6 +938,8 @@ class Runentry(Block, Nestable):
 
     def offset(self):
         # TODO(wb): make this run_offset
+        if self.is_sparse():
+            return 0
         return self.lsb2signednum(self.offset_binary())
 
     def length(self):
@@ -752,10 +980,14 @@ class Runlist(Block):
     def runs(self, length=None):
         """
         Yields tuples (volume offset, length).
-        Recall that the entries are relative to one another
+        Recall that the entries are relative to one another.
+        The volume offset of a sparse run is None.
         """
         last_offset = 0
         for e in self._entries(length=length):
+            if e.is_sparse():
+                yield (None, e.length())
+                continue
             current_offset = last_offset + e.offset()
             current_length = e.length()
             last_offset = current_offset
@@ -768,6 +1000,7 @@ class ATTR_TYPE:
     DATA = 0x80
     INDEX_ROOT = 0x90
     INDEX_ALLOCATION = 0xA0
+    BITMAP = 0xB0
 
 
 class Attribute(Block, Nestable):
@@ -862,6 +1095,9 @@ class Attribute(Block, Nestable):
         return self.unpack_wstring(self.name_offset(), self.name_length())
 
 
+MFT_RECORD_SIZE = 1024
+
+
 class MFT_RECORD_FLAGS:
     MFT_RECORD_IN_USE = 0x1
     MFT_RECORD_IS_DIRECTORY = 0x2
@@ -888,7 +1124,11 @@ class AttributeNotFoundError(Exception):
 class MFTRecord(FixupBlock):
     def __init__(self, buf, offset, parent, inode=None):
         super(MFTRecord, self).__init__(buf, offset, parent)
+        self._declare_header_fields()
+        self.inode = inode or self.mft_record_number()
+        self.fixup(self.usa_count(), self.usa_offset())
 
+    def _declare_header_fields(self):
         # 0x0 File or BAAD
         self.declare_field("dword", "magic")
         # 0x04 Offset to fixup array
@@ -925,24 +1165,29 @@ class MFTRecord(FixupBlock):
         # 0x2c
         self.declare_field("dword", "mft_record_number")
 
-        self.inode = inode or self.mft_record_number()
-        self.fixup(self.usa_count(), self.usa_offset())
-
     def attributes(self):
         offset = self.attrs_offset()
-        right_border = self.offset() + self.bytes_in_use()
+        right_border = self.bytes_in_use()
 
         while (self.unpack_dword(offset) != 0 and
                self.unpack_dword(offset) != 0xFFFFFFFF and
                offset + self.unpack_dword(offset + 4) <= right_border):
-            a = Attribute(self._buf, offset, self)
+            a = Attribute(self._buf, self.absolute_offset(offset), self)
             offset += len(a)
             yield a
 
-    def attribute(self, attr_type):
+    def attribute(self, attr_type, name=None):
+        """
+        @type name: str
+        @param name: If provided, match only the attribute with this name,
+          such as "$I30" for the attributes of a directory index.
+        """
         for a in self.attributes():
-            if a.type() == attr_type:
-                return a
+            if a.type() != attr_type:
+                continue
+            if name is not None and a.name() != name:
+                continue
+            return a
         raise AttributeNotFoundError()
 
     def is_directory(self):
@@ -998,25 +1243,131 @@ class MFTRecord(FixupBlock):
         except AttributeError:
             return None
 
-    def data_attribute(self):
+    def data_attribute(self, name=""):
         """
-        Returns None if the default $DATA attribute does not exist
+        Returns None if the $DATA attribute does not exist
+
+        @type name: str
+        @param name: The name of the data stream, such as "$J",
+          by default the unnamed stream.
         """
         for attr in self.attributes():
-            if attr.type() == ATTR_TYPE.DATA and attr.name() == "":
+            if attr.type() == ATTR_TYPE.DATA and attr.name() == name:
                 return attr
 
     def slack_data(self):
         """
         Returns A binary string containing the MFT record slack.
         """
-        return self._buf[self.offset()+self.bytes_in_use():self.offset() + 1024].tostring()
+        return bytes(self._buf[self.offset()+self.bytes_in_use():self.offset() + 1024])
 
     def active_data(self):
         """
         Returns A binary string containing the MFT record slack.
         """
-        return self._buf[self.offset():self.offset() + self.bytes_in_use()].tostring()
+        return bytes(self._buf[self.offset():self.offset() + self.bytes_in_use()])
+
+
+class MFTRecordView(MFTRecord):
+    """
+    A reusable MFTRecord backed by one preallocated scratch buffer.
+
+    Use this when streaming over many records that are not kept around,
+      such as when generating a timeline. Rather than allocating a new
+      record, fixup buffer and set of field closures for each MFT slot,
+      `load` copies the next slot into the scratch buffer and applies the
+      fixups in place. The fields declared by the constructor read
+      straight from the scratch buffer, so they reflect the loaded slot.
+
+    The scratch buffer may hold a chunk of consecutive records, which
+      `load_chunk` fixes up all at once (see `ntfs.Fixup.apply_fixups`),
+      and `select` then moves the view between.
+
+    Anything derived from a view (attributes, filename information, etc.)
+      is only valid until the next call to `load` or `select`. Use `detach`
+      to get an independent MFTRecord for the current slot.
+    """
+    def __init__(self, record_size=MFT_RECORD_SIZE, chunk_records=1):
+        FixupBlock.__init__(self, bytearray(record_size * chunk_records), 0, None)
+        self._record_size = record_size
+        self._chunk_records = chunk_records
+        self._declare_header_fields()
+        self._source = None
+        self._source_offset = 0
+        self._chunk_offset = 0
+        self._chunk_count = 0
+        self.inode = None
+
+    def load(self, source, offset, inode=None):
+        """
+        Copy the record at `offset` in `source` into the scratch buffer
+          and apply its fixups.
+
+        @raises OverrunBufferException: if the record extends beyond `source`.
+        @raises InvalidRecordException: if the record has an incorrect magic header.
+        """
+        self.load_chunk(source, offset, 1)
+        self.select(0, inode=inode)
+
+    def load_chunk(self, source, offset, count):
+        """
+        Copy up to `count` consecutive records starting at `offset` in
+          `source` into the scratch buffer, and apply all their fixups.
+        Bad fixups are logged once for the whole chunk.
+
+        @raises OverrunBufferException: if not even one record fits in `source`.
+        @rtype: int
+        @return: The number of records loaded, which is less than `count`
+          at the end of `source`.
+        """
+        size = self._record_size
+        count = min(count, self._chunk_records, (len(source) - offset) // size)
+        if count <= 0:
+            raise BinaryParser.OverrunBufferException(offset + size, len(source))
+
+        # slice assignment of the same length reuses the bytearray's storage
+        end = count * size
+        self._buf[:end] = source[offset:offset + end]
+        bad = apply_fixups(self._buf, size, count=count)
+        if bad:
+            logging.warning("Bad fixups at %s",
+                            format_bad_fixups(bad, offset, size))
+        self._source = source
+        self._chunk_offset = offset
+        self._chunk_count = count
+        return count
+
+    def select(self, index, inode=None):
+        """
+        Point the view at the `index`th record of the loaded chunk.
+
+        @raises InvalidRecordException: if the record has an incorrect magic header.
+        """
+        if not 0 <= index < self._chunk_count:
+            raise IndexError(index)
+        self._offset = index * self._record_size
+        self._source_offset = self._chunk_offset + self._offset
+        if self.magic() != 0x454C4946:
+            raise InvalidRecordException("offset: %s" % hex(self._source_offset))
+        self.inode = inode if inode is not None else self.mft_record_number()
+
+    def detach(self):
+        """
+        Create an independent MFTRecord for the currently loaded slot,
+          which remains valid after the view moves on.
+
+        @rtype: MFTRecord
+        """
+        end = self._source_offset + self._record_size
+        return MFTRecord(self._source[self._source_offset:end], 0,
+                         None, inode=self.inode)
+
+    def slack_data(self):
+        return bytes(self._buf[self._offset + self.bytes_in_use():
+                               self._offset + self._record_size])
+
+    def active_data(self):
+        return bytes(self._buf[self._offset:self._offset + self.bytes_in_use()])
 
 
 class InvalidAttributeException(INDXException):
@@ -1050,63 +1401,57 @@ class InvalidRecordException(Exception):
         return "InvalidRecordException(%s)" % (self._msg)
 
 
-class Cache(object):
-    def __init__(self, size_limit):
-        super(Cache, self).__init__()
-        self._c = OrderedDict()
-        self._size_limit = size_limit
-
-    def insert(self, k, v):
-        """
-        add a key and value to the front
-        """
-        self._c[k] = v
-        if len(self._c) > self._size_limit:
-            self._c.popitem(last=False)
-
-    def exists(self, k):
-        return k in self._c
-
-    def touch(self, k):
-        """
-        bring a key to the front
-        """
-        v = self._c[k]
-        del self._c[k]
-        self._c[k] = v
-
-    def get(self, k):
-        return self._c[k]
-
-
-MFT_RECORD_SIZE = 1024
 FILE_SEP = "\\"
 UNKNOWN_ENTRY = "??"
 ORPHAN_ENTRY = "$ORPHAN"
 CYCLE_ENTRY = "<CYCLE>"
 
 
+DEFAULT_RECORD_CACHE_BYTES = 128 * MEGABYTE
+# flyweight enumeration copies and fixes up this many records at a time
+FLYWEIGHT_CHUNK_RECORDS = 256
+DEFAULT_PATH_CACHE_BYTES = 32 * MEGABYTE
+
+
 class MFTEnumerator(object):
-    def __init__(self, buf, record_cache=None, path_cache=None):
-        DEFAULT_CACHE_SIZE = 102400
+    def __init__(self, buf, record_cache=None, path_cache=None,
+                 budget=None, policy="lru", record_size=MFT_RECORD_SIZE):
+        """
+        @type budget: ntfs.Cache.MemoryBudget
+        @param budget: If provided, the default record and path caches
+          draw from this shared byte budget rather than their own limits,
+          and are synchronized if the budget is thread safe.
+        @type policy: str
+        @param policy: The eviction policy for the default caches,
+          see `ntfs.Cache.POLICIES`.
+        """
         if record_cache is None:
-            record_cache = Cache(size_limit=DEFAULT_CACHE_SIZE)
+            if budget is None:
+                record_cache = Cache(byte_limit=DEFAULT_RECORD_CACHE_BYTES,
+                                     policy=policy, name="records")
+            else:
+                record_cache = budget.cache(policy=policy, name="records")
         if path_cache is None:
-            path_cache = Cache(size_limit=DEFAULT_CACHE_SIZE)
+            if budget is None:
+                path_cache = Cache(byte_limit=DEFAULT_PATH_CACHE_BYTES,
+                                   policy=policy, name="paths")
+            else:
+                path_cache = budget.cache(policy=policy, name="paths")
 
         self._buf = buf
         self._record_cache = record_cache
         self._path_cache = path_cache
+        self._record_size = record_size
 
     def len(self):
-        return len(self._buf) / MFT_RECORD_SIZE
+        return len(self._buf) / self._record_size
 
     def get_record_buf(self, record_num):
         """
         @raises OverrunBufferException: if the record_num is beyond the end of the MFT
         """
-        start = record_num * MFT_RECORD_SIZE
-        end = start + MFT_RECORD_SIZE
+        start = record_num * self._record_size
+        end = start + self._record_size
         g_logger.debug("get_record_buf: start: %s len: %s bufsize: %s", hex(start), hex(end - start), hex(len(self._buf)))
         if end > len(self._buf):
             raise BinaryParser.OverrunBufferException(end, len(self._buf))
@@ -1119,9 +1464,9 @@ class MFTEnumerator(object):
         @raises OverrunBufferException: if the record_num is beyond the end of the MFT.
         @raises InvalidRecordException: if the record appears invalid (incorrect magic header).
         """
-        if self._record_cache.exists(record_num):
-            self._record_cache.touch(record_num)
-            return self._record_cache.get(record_num)
+        record = self._record_cache.lookup(record_num)
+        if record is not None:
+            return record
 
         record_buf = self.get_record_buf(record_num)
         if BinaryParser.read_dword(record_buf, 0x0) != 0x454C4946:
@@ -1131,7 +1476,22 @@ class MFTEnumerator(object):
         self._record_cache.insert(record_num, record)
         return record
 
-    def enumerate_records(self):
+    def enumerate_records(self, flyweight=False):
+        """
+        Yield each valid MFTRecord in the MFT.
+
+        @type flyweight: bool
+        @param flyweight: If True, yield the same MFTRecordView for each
+          slot rather than a new MFTRecord. This avoids nearly all
+          per-record allocations, but the view (and anything derived from
+          it) changes as enumeration proceeds. Use `MFTRecordView.detach`
+          to keep a record. Flyweight records bypass the record cache.
+        """
+        if flyweight:
+            for record in self._enumerate_record_views():
+                yield record
+            return
+
         index = 0
         while True:
             if index == 12:  # reserved records are 12-15
@@ -1146,6 +1506,27 @@ class MFTEnumerator(object):
             except BinaryParser.OverrunBufferException:
                 return
 
+    def _enumerate_record_views(self, chunk_records=FLYWEIGHT_CHUNK_RECORDS):
+        view = MFTRecordView(record_size=self._record_size,
+                             chunk_records=chunk_records)
+        count = self.len()
+        index = 0
+        while index < count:
+            try:
+                loaded = view.load_chunk(self._buf, index * self._record_size,
+                                         chunk_records)
+            except BinaryParser.OverrunBufferException:
+                return
+            for i in xrange(loaded):
+                if 12 <= index + i < 16:  # reserved records are 12-15
+                    continue
+                try:
+                    view.select(i, inode=index + i)
+                except InvalidRecordException:
+                    continue
+                yield view
+            index += loaded
+
     def enumerate_paths(self):
         for record in self.enumerate_records():
             path = self.get_path(record)
@@ -1181,9 +1562,9 @@ class MFTEnumerator(object):
         key = "%d-%d-%d-%d-%d" % (record.magic(), record.lsn(),
                                   record.link_count(), record.mft_record_number(),
                                   record.flags())
-        if self._path_cache.exists(key):
-            self._path_cache.touch(key)
-            return self._path_cache.get(key)
+        path = self._path_cache.lookup(key)
+        if path is not None:
+            return path
 
         record_num = record.mft_record_number()
         if record_num == 5:
@@ -1215,6 +1596,15 @@ class MFTEnumerator(object):
         self._path_cache.insert(key, path)
         return path
 
+    def get_cache_stats(self):
+        """
+        @rtype: dict(str, ntfs.Cache.CacheStats)
+        """
+        return {
+            "records": self._record_cache.stats,
+            "paths": self._path_cache.stats,
+        }
+
     def get_record_by_path(self, path):
         lower_path = path.lower()
         for record, record_path in self.enumerate_paths():
@@ -1222,6 +1612,141 @@ class MFTEnumerator(object):
                 return record
         raise KeyError("Path not found: %s" % path)
 
+    def get_directory_table(self, include_inactive=False):
+        """
+        Collect the parent and name of each directory in one flyweight
+          pass over the MFT.
+
+        @type include_inactive: bool
+        @param include_inactive: Also add the directories of freed records,
+          see `MFTDirectoryTable.load_mft`.
+        @rtype: MFTDirectoryTable
+        """
+        table = MFTDirectoryTable()
+        table.load_mft(self, include_inactive=include_inactive)
+        return table
+
+
+ROOT_RECORD_NUMBER = 5
+# the record number and sequence number of a reference, ignoring the
+#   upper half of 128 bit V3 references, which is zero on NTFS
+REFERENCE_MASK = 0xFFFFFFFFFFFFFFFF
+
+
+class MFTDirectoryTable(object):
+    """
+    A table of directories, record number ->
+      (sequence number, parent reference, name), from which the paths
+      of directories are resolved without fetching their records.
+
+    Unlike `MFTEnumerator.get_path`, which follows the parent reference
+      to any record with a matching sequence number, only directories in
+      the table are followed. A directory whose parent is missing from the
+      table, such as a file or a record that is not loaded, is placed
+      under ORPHAN_ENTRY.
+
+    Paths are memoised, and the memo is dropped whenever a memoised
+      directory is renamed or moved.
+    """
+    def __init__(self):
+        super(MFTDirectoryTable, self).__init__()
+        # record number -> (sequence number, parent reference, name)
+        self._directories = {}
+        # reference -> path
+        self._paths = {}
+
+    def load_mft(self, enumerator, include_inactive=False):
+        """
+        Add the directories of the MFT to the table.
+
+        @type enumerator: MFTEnumerator
+        @type include_inactive: bool
+        @param include_inactive: Also add the directories of freed records,
+          under the sequence number they had before they were freed.
+        """
+        for view in enumerator.enumerate_records(flyweight=True):
+            if not view.is_directory():
+                continue
+            active = view.is_active()
+            if not (active or include_inactive):
+                continue
+            try:
+                fn = view.filename_information()
+                if fn is None:
+                    continue
+                sequence_number = view.sequence_number()
+                if not active:
+                    # the sequence number is bumped when a record is freed
+                    sequence_number = (sequence_number - 1) & 0xFFFF
+                self._directories[view.inode] = \
+                    (sequence_number, fn.mft_parent_reference(), fn.filename())
+            except Exception as e:
+                g_logger.debug("Failed to parse directory record %d: %s", view.inode, e)
+        self._paths.clear()
+
+    def references(self):
+        """
+        Yield the reference of each directory in the table, in record order.
+
+        @rtype: generator of int
+        """
+        for record_number in sorted(self._directories):
+            yield (self._directories[record_number][0] << 48) | record_number
+
+    def update(self, file_reference, parent_reference, filename):
+        """
+        Set the parent and name of a directory.
+        """
+        reference = file_reference & REFERENCE_MASK
+        entry = (MSEQNO(reference), parent_reference & REFERENCE_MASK, filename)
+        record_number = MREF(reference)
+        if self._directories.get(record_number) == entry:
+            return
+        self._directories[record_number] = entry
+        if reference in self._paths:
+            # the paths of the directory and everything below it are stale
+            self._paths.clear()
+
+    def get_path(self, reference):
+        """
+        Get the current path of a directory, with the same conventions as
+          `MFTEnumerator.get_path`: the root is "", and directories missing
+          from the table are placed under ORPHAN_ENTRY.
+
+        @rtype: unicode
+        """
+        reference &= REFERENCE_MASK
+        path = self._paths.get(reference)
+        if path is not None:
+            return path
+
+        # walk up to the root, or the first memoised directory
+        components = []
+        seen = set()
+        while True:
+            record_number = MREF(reference)
+            if record_number == ROOT_RECORD_NUMBER:
+                path = ""
+                break
+            path = self._paths.get(reference)
+            if path is not None:
+                break
+            if record_number in seen:
+                path = CYCLE_ENTRY
+                break
+            seen.add(record_number)
+            entry = self._directories.get(record_number)
+            if entry is None or entry[0] != MSEQNO(reference):
+                path = ORPHAN_ENTRY
+                break
+            components.append((reference, entry[2]))
+            reference = entry[1]
+
+        for reference, name in reversed(components):
+            path = path + FILE_SEP + name
+            self._paths[reference] = path
+        return path
+
 
 class MFTTreeNode(object):
     def __init__(self, nodes, record_number, filename, parent_record_number):
@@ -19,11 +19,17 @@
 #
 #   Version v.1.2
 
+import struct
+import logging
+
 from .. import BinaryParser
 from ..BinaryParser import Block
 from ..BinaryParser import Nestable
 
 
+g_logger = logging.getLogger("ntfs.secure.SDS")
+
+
 class NULL_OBJECT(object):
     def __init__(self):
         super(NULL_OBJECT, self).__init__()
@@ -70,8 +76,11 @@ class SID_IDENTIFIER_AUTHORITY(Block, Nestable):
     def __len__(self):
         return SID_IDENTIFIER_AUTHORITY.structure_size(self._buf, self.absolute_offset(0x0), None)
 
+    def value(self):
+        return (self.high_part() << 32) + self.low_part()
+
     def __str__(self):
-        return "%s" % (self.high_part() << 32 + self.low_part())
+        return format_identifier_authority(self.value())
 
 
 class SID(Block, Nestable):
@@ -92,10 +101,120 @@ class SID(Block, Nestable):
         return self._off_sub_authorities + (self.sub_authority_count() * 4)
 
     def string(self):
-        ret = "S-%d-%s" % (self.revision(), self.identifier_authority())
-        for sub_auth in self.sub_authorities():
-            ret += "-%s" % (str(sub_auth))
-        return ret
+        return intern_sid(self._buf, self.offset()).string()
+
+
+def format_identifier_authority(authority):
+    """
+    Authorities that don't fit in a dword are written in hex, as by
+      ConvertSidToStringSid.
+    """
+    if authority >> 32:
+        return "0x%012X" % (authority)
+    return "%d" % (authority)
+
+
+class SIDValue(object):
+    """
+    An immutable, decoded SID, shared by all the places it appears.
+      Use `intern_sid` rather than constructing these directly.
+    """
+    __slots__ = ("_raw", "_revision", "_authority", "_sub_authorities", "_string")
+
+    def __init__(self, raw):
+        revision, count, high, low = struct.unpack_from(">BBHI", raw, 0)
+        object.__setattr__(self, "_raw", raw)
+        object.__setattr__(self, "_revision", revision)
+        object.__setattr__(self, "_authority", (high << 32) + low)
+        object.__setattr__(self, "_sub_authorities",
+                           struct.unpack_from("<%dI" % (count), raw, 8))
+        object.__setattr__(self, "_string", "S-%d-%s%s" % (
+            revision, format_identifier_authority(self._authority),
+            "".join("-%d" % (sub_auth) for sub_auth in self._sub_authorities)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SIDValue is immutable")
+
+    def raw(self):
+        return self._raw
+
+    def revision(self):
+        return self._revision
+
+    def sub_authority_count(self):
+        return len(self._sub_authorities)
+
+    def identifier_authority(self):
+        return self._authority
+
+    def sub_authorities(self):
+        return self._sub_authorities
+
+    def string(self):
+        return self._string
+
+    def __str__(self):
+        return self._string
+
+    def __repr__(self):
+        return "SIDValue(%s)" % (self._string)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __eq__(self, other):
+        if isinstance(other, SIDValue):
+            return self._raw == other._raw
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, SIDValue):
+            return self._raw != other._raw
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._raw)
+
+
+class SIDTable(object):
+    """
+    Intern table of SIDs, keyed by their raw bytes.
+      The SIDs of a volume are few and repeated across thousands of
+      ACEs, so each is decoded only once.
+    """
+    def __init__(self):
+        super(SIDTable, self).__init__()
+        self._sids = {}
+
+    def intern(self, buf, offset):
+        """
+        @rtype: SIDValue
+        """
+        size = SID.structure_size(buf, offset, None)
+        raw = bytes(buf[offset:offset + size])
+        sid = self._sids.get(raw)
+        if sid is None:
+            sid = SIDValue(raw)
+            self._sids[raw] = sid
+        return sid
+
+    def __len__(self):
+        return len(self._sids)
+
+    def clear(self):
+        self._sids.clear()
+
+
+g_sid_table = SIDTable()
+
+
+def intern_sid(buf, offset):
+    """
+    Get the shared SIDValue of the SID at the given offset.
+
+    @rtype: SIDValue
+    """
+    return g_sid_table.intern(buf, offset)
 
 
 class ACE_TYPES:
@@ -211,7 +330,8 @@ class StandardACE(ACE, Nestable):
         super(StandardACE, self).__init__(buf, offset, parent)
         self.declare_field("word", "size", 0x2)
         self.declare_field("dword", "access_mask")
-        self.declare_field(SID, "sid")
+        self._off_sid = self.current_field_offset()
+        self.add_explicit_field(self._off_sid, SID, "sid")
 
     @staticmethod
     def structure_size(buf, offset, parent):
@@ -220,6 +340,12 @@ class StandardACE(ACE, Nestable):
     def __len__(self):
         return self.size()
 
+    def sid(self):
+        """
+        @rtype: SIDValue
+        """
+        return intern_sid(self._buf, self.absolute_offset(self._off_sid))
+
 
 class ACCESS_ALLOWED_ACE(StandardACE):
     def __init__(self, buf, offset, parent):
@@ -265,6 +391,20 @@ class ObjectACE(ACE, Nestable):
     def __len__(self):
         return self.size()
 
+    def sid(self):
+        """
+        The GUIDs are only present if flagged, so the SID follows
+          the ones that are.
+
+        @rtype: SIDValue
+        """
+        offset = 0x0C
+        if self.object_flags() & OBJECT_ACE_FLAGS.ACE_OBJECT_TYPE_PRESENT:
+            offset += 0x10
+        if self.object_flags() & OBJECT_ACE_FLAGS.ACE_INHERITED_OBJECT_TYPE_PRESENT:
+            offset += 0x10
+        return intern_sid(self._buf, self.absolute_offset(offset))
+
 
 class ACCESS_ALLOWED_OBJECT_ACE(ObjectACE):
     def __init__(self, buf, offset, parent):
@@ -375,14 +515,20 @@ class SECURITY_DESCRIPTOR_RELATIVE(Block, Nestable):
         return ret
 
     def owner(self):
+        """
+        @rtype: SIDValue, or None
+        """
         if self.owner_offset() != 0:
-            return SID(self._buf, self.absolute_offset(self.owner_offset()), self)
+            return intern_sid(self._buf, self.absolute_offset(self.owner_offset()))
         else:
             return None
 
     def group(self):
+        """
+        @rtype: SIDValue, or None
+        """
         if self.group_offset() != 0:
-            return SID(self._buf, self.absolute_offset(self.group_offset()), self)
+            return intern_sid(self._buf, self.absolute_offset(self.group_offset()))
         else:
             return None
 
@@ -422,24 +568,58 @@ class SDS_ENTRY(Block, Nestable):
         return self.length()
 
 
+# $SDS is written in blocks of this size, each followed by a mirror copy
+SDS_BLOCK_SIZE = 0x40000
+SDS_ENTRY_ALIGNMENT = 0x10
+SDS_ENTRY_HEADER_SIZE = 0x14
+
+
 class SDS(Block):
     def __init__(self, buf, offset, parent):
         super(SDS, self).__init__(buf, offset)
         self.add_explicit_field(0, SDS, "sds_entries")
 
-    def sds_entries(self):
+    def _block_entries(self, data):
+        """
+        Yield the entries of one block of $SDS, already copied into `data`.
+        An entry with a zero length marks the end of the used space.
+        """
         ofs = 0
-        while len(self._buf) > self.offset() + ofs + 0x14:
-            s = SDS_ENTRY(self._buf, self.offset() + ofs, self)
-            if len(s) != 0:
-                yield s
-                ofs += len(s)
-                ofs = BinaryParser.align(ofs, 0x10)
-            else:
-                if ofs % 0x10000 == 0:
-                    return
-                else:
-                    ofs = BinaryParser.align(ofs, 0x10000)
+        while ofs + SDS_ENTRY_HEADER_SIZE <= len(data):
+            s = SDS_ENTRY(data, ofs, self)
+            length = len(s)
+            if length < SDS_ENTRY_HEADER_SIZE or ofs + length > len(data):
+                return
+            yield s
+            ofs = BinaryParser.align(ofs + length, SDS_ENTRY_ALIGNMENT)
+
+    def sds_entries(self, verify_mirrors=False):
+        """
+        A generator of the SDS_ENTRYs of the stream, each security ID once.
+
+        Only the primary copy of each block is read, unless
+          `verify_mirrors` is set, in which case each mirror is compared
+          with its primary, and the entries of mirrors that differ are
+          also yielded, if their security ID wasn't already seen.
+        """
+        seen = set()
+        size = len(self._buf) - self.offset()
+        for start in xrange(0, size, 2 * SDS_BLOCK_SIZE):
+            start += self.offset()
+            data = bytes(self._buf[start:start + SDS_BLOCK_SIZE])
+            blocks = [data]
+            if verify_mirrors:
+                mirror = bytes(self._buf[start + SDS_BLOCK_SIZE:start + 2 * SDS_BLOCK_SIZE])
+                if mirror and mirror != data[:len(mirror)]:
+                    g_logger.warning("$SDS block at %s differs from its mirror", hex(start))
+                    blocks.append(mirror)
+
+            for block in blocks:
+                for s in self._block_entries(block):
+                    if s.security_id() in seen:
+                        continue
+                    seen.add(s.security_id())
+                    yield s
 
 
 def main():
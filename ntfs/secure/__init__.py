@@ -0,0 +1,127 @@
+"""
+Look up security descriptors in $Secure.
+
+$Secure:$SDS holds the security descriptors shared by the files of a
+  volume, each identified by the security ID found in the files'
+  $STANDARD_INFORMATION. Rather than scanning $SDS, the $SII index,
+  keyed by security ID, is searched as a B+ tree to find the offset of
+  a descriptor. Since thousands of files share a few hundred
+  descriptors, decoded descriptors are kept in an LRU cache.
+"""
+import logging
+
+from ntfs.Cache import Cache
+from ntfs.mft.MFT import SII_INDEX_ENTRY
+from ntfs.mft.MFT import AttributeNotFoundError
+from ntfs.secure.SDS import SDS
+from ntfs.secure.SDS import SDS_ENTRY
+
+
+g_logger = logging.getLogger("ntfs.secure")
+
+SECURE_RECORD_NUMBER = 9
+SDS_STREAM = "$SDS"
+SII_INDEX = "$SII"
+SDH_INDEX = "$SDH"
+
+# the number of decoded descriptors to keep
+DEFAULT_DESCRIPTOR_CACHE_SIZE = 1024
+
+
+class SecurityDescriptorNotFoundError(Exception):
+    def __init__(self, msg):
+        self._msg = msg
+
+    def __str__(self):
+        return "Security descriptor not found: %s" % (self._msg)
+
+
+class SecureFile(object):
+    """
+    The $Secure file of a file system.
+    """
+    def __init__(self, fs, cache_size=DEFAULT_DESCRIPTOR_CACHE_SIZE):
+        """
+        @type fs: ntfs.filesystem.NTFSFilesystem
+        @raises SecurityDescriptorNotFoundError: if there's no $SDS stream,
+          as on NTFS versions before 3.0.
+        """
+        super(SecureFile, self).__init__()
+        self._fs = fs
+        self._record = fs.get_record(SECURE_RECORD_NUMBER)
+        attribute = self._record.data_attribute(SDS_STREAM)
+        if attribute is None:
+            raise SecurityDescriptorNotFoundError("no %s stream" % (SDS_STREAM))
+        self._sds = fs.get_attribute_data(attribute)
+        self._cache = Cache(size_limit=cache_size, policy="lru", name="security descriptors")
+
+    def get_sds(self):
+        """
+        @rtype: ntfs.secure.SDS.SDS
+        """
+        return SDS(self._sds, 0, None)
+
+    def find_sii_entry(self, security_id):
+        """
+        @rtype: SII_INDEX_ENTRY, or None
+        """
+        try:
+            return self._fs.find_index_entry(self._record, security_id,
+                                             SII_INDEX, SII_INDEX_ENTRY)
+        except AttributeNotFoundError:
+            g_logger.debug("no %s index", SII_INDEX)
+            return None
+
+    def _read_entry(self, offset, length):
+        # copy the entry, so the descriptor doesn't pin the volume
+        return SDS_ENTRY(bytes(self._sds[offset:offset + length]), 0, None)
+
+    def _scan(self, security_id):
+        """
+        Find the $SDS entry with a linear scan, for when $SII can't be used.
+
+        @rtype: SDS_ENTRY, or None
+        """
+        g_logger.debug("scanning %s for security id %d", SDS_STREAM, security_id)
+        for entry in self.get_sds().sds_entries():
+            if entry.security_id() == security_id:
+                return self._read_entry(entry.offset(), entry.length())
+        return None
+
+    def get_sds_entry(self, security_id):
+        """
+        @rtype: SDS_ENTRY
+        @raises SecurityDescriptorNotFoundError
+        """
+        entry = None
+        sii_entry = self.find_sii_entry(security_id)
+        if sii_entry is not None:
+            entry = self._read_entry(sii_entry.descriptor_offset(),
+                                     sii_entry.descriptor_length())
+            if entry.security_id() != security_id:
+                g_logger.warning("%s entry for security id %d points to id %d",
+                                 SII_INDEX, security_id, entry.security_id())
+                entry = None
+
+        if entry is None:
+            entry = self._scan(security_id)
+        if entry is None:
+            raise SecurityDescriptorNotFoundError(str(security_id))
+        return entry
+
+    def get_security_descriptor(self, security_id):
+        """
+        @rtype: ntfs.secure.SDS.SECURITY_DESCRIPTOR_RELATIVE
+        @raises SecurityDescriptorNotFoundError
+        """
+        descriptor = self._cache.lookup(security_id)
+        if descriptor is None:
+            descriptor = self.get_sds_entry(security_id).sid()
+            self._cache.insert(security_id, descriptor)
+        return descriptor
+
+    def get_cache_stats(self):
+        """
+        @rtype: ntfs.Cache.CacheStats
+        """
+        return self._cache.stats
@@ -0,0 +1,291 @@
+"""
+Report the owners and access rights of all the files of a volume.
+
+Thousands of files share each security descriptor, so rather than
+  looking up the descriptor of each file, the security IDs of all the
+  records are collected in one pass over the MFT and grouped by security
+  ID. Each distinct descriptor is then decoded once, and a query over
+  the owners or ACEs only tests the descriptors, expanding the groups of
+  the ones that match.
+"""
+import array
+import logging
+
+from ntfs.mft.MFT import StandardInformationFieldDoesNotExist
+from ntfs.secure import SecureFile
+from ntfs.secure import SecurityDescriptorNotFoundError
+from ntfs.secure.SDS import ACE_TYPES
+from ntfs.secure.SDS import ACE_FLAGS
+from ntfs.secure.SDS import ACCESS_MASK
+from ntfs.secure.SDS import NULL_ACL
+
+
+g_logger = logging.getLogger("ntfs.secure.report")
+
+# the rights that let a SID change the contents of a file
+WRITE_ACCESS = ACCESS_MASK.FILE_WRITE_DATA | ACCESS_MASK.FILE_APPEND_DATA
+
+# the file rights each generic right stands for
+FILE_GENERIC_READ = (ACCESS_MASK.STANDARD_RIGHTS_READ | ACCESS_MASK.FILE_READ_DATA |
+                     ACCESS_MASK.FILE_READ_ATTRIBUTES | ACCESS_MASK.FILE_READ_EA |
+                     ACCESS_MASK.SYNCHRONIZE)
+FILE_GENERIC_WRITE = (ACCESS_MASK.STANDARD_RIGHTS_WRITE | ACCESS_MASK.FILE_WRITE_DATA |
+                      ACCESS_MASK.FILE_WRITE_ATTRIBUTES | ACCESS_MASK.FILE_WRITE_EA |
+                      ACCESS_MASK.FILE_APPEND_DATA | ACCESS_MASK.SYNCHRONIZE)
+FILE_GENERIC_EXECUTE = (ACCESS_MASK.STANDARD_RIGHTS_EXECUTE | ACCESS_MASK.FILE_READ_ATTRIBUTES |
+                        ACCESS_MASK.FILE_EXECUTE | ACCESS_MASK.SYNCHRONIZE)
+FILE_ALL_ACCESS = ACCESS_MASK.STANDARD_RIGHTS_REQUIRED | ACCESS_MASK.SYNCHRONIZE | 0x1FF
+
+GENERIC_MAPPING = (
+    (ACCESS_MASK.GENERIC_READ, FILE_GENERIC_READ),
+    (ACCESS_MASK.GENERIC_WRITE, FILE_GENERIC_WRITE),
+    (ACCESS_MASK.GENERIC_EXECUTE, FILE_GENERIC_EXECUTE),
+    (ACCESS_MASK.GENERIC_ALL, FILE_ALL_ACCESS),
+)
+
+ALLOWED_ACE_TYPES = frozenset([ACE_TYPES.ACCESS_ALLOWED_ACE_TYPE,
+                               ACE_TYPES.ACCESS_ALLOWED_OBJECT_ACE_TYPE])
+DENIED_ACE_TYPES = frozenset([ACE_TYPES.ACCESS_DENIED_ACE_TYPE,
+                              ACE_TYPES.ACCESS_DENIED_OBJECT_ACE_TYPE])
+
+
+def map_generic_rights(mask):
+    """
+    Replace the generic rights of an access mask with the file rights
+      they stand for.
+    """
+    for generic, rights in GENERIC_MAPPING:
+        if mask & generic:
+            mask = (mask & ~generic) | rights
+    return mask
+
+
+class DescriptorSummary(object):
+    """
+    The owner, group and DACL of a security descriptor, decoded from the
+      descriptor so that it can be queried many times.
+    `dacl` is None when the descriptor has no DACL, or a NULL DACL, both of
+      which grant everyone full access. Otherwise it is a tuple of
+      (ace_type, ace_flags, access_mask, sid) tuples, in order.
+    """
+    __slots__ = ("security_id", "owner", "group", "dacl")
+
+    def __init__(self, security_id, owner, group, dacl):
+        self.security_id = security_id
+        self.owner = owner
+        self.group = group
+        self.dacl = dacl
+
+    @classmethod
+    def from_descriptor(cls, security_id, descriptor):
+        """
+        @type descriptor: ntfs.secure.SDS.SECURITY_DESCRIPTOR_RELATIVE
+        @rtype: DescriptorSummary
+        """
+        owner = descriptor.owner()
+        group = descriptor.group()
+        acl = descriptor.dacl()
+        dacl = None
+        if acl is not None and not isinstance(acl, NULL_ACL):
+            dacl = tuple((ace.ace_type(), ace.ace_flags(),
+                          map_generic_rights(ace.access_mask()), ace.sid().string())
+                         for ace in acl.ACEs())
+        return cls(security_id,
+                   owner.string() if owner is not None else None,
+                   group.string() if group is not None else None,
+                   dacl)
+
+    def granted_access(self, sids):
+        """
+        Compute the rights the DACL grants to a set of SIDs, such as
+          a user and the groups of which it's a member.
+          ACEs are evaluated in order: rights denied before they're
+          allowed are not granted.
+
+        @type sids: set of str
+        @rtype: int
+        """
+        if self.dacl is None:
+            return FILE_ALL_ACCESS
+        granted = 0
+        denied = 0
+        for ace_type, ace_flags, mask, sid in self.dacl:
+            if ace_flags & ACE_FLAGS.INHERIT_ONLY_ACE:
+                continue
+            if sid not in sids:
+                continue
+            if ace_type in ALLOWED_ACE_TYPES:
+                granted |= mask & ~denied
+            elif ace_type in DENIED_ACE_TYPES:
+                denied |= mask & ~granted
+        return granted
+
+
+class SecurityReport(object):
+    """
+    The security IDs of all the records of a volume, grouped by ID,
+      joined with the decoded descriptors.
+    """
+    def __init__(self):
+        super(SecurityReport, self).__init__()
+        self._record_numbers = array.array("L")
+        self._security_ids = array.array("L")
+        # map from security ID to array of record numbers
+        self._groups = {}
+        # map from security ID to DescriptorSummary
+        self._descriptors = {}
+
+    def load_mft(self, enumerator):
+        """
+        Collect the security ID of each active record of the MFT.
+
+        @type enumerator: ntfs.mft.MFT.MFTEnumerator
+        """
+        for view in enumerator.enumerate_records(flyweight=True):
+            if not view.is_active():
+                continue
+            try:
+                si = view.standard_information()
+                if si is None:
+                    # extension records hold no $STANDARD_INFORMATION
+                    continue
+                security_id = si.security_id()
+            except StandardInformationFieldDoesNotExist:
+                continue
+            except Exception as e:
+                g_logger.debug("Failed to parse record %d: %s", view.inode, e)
+                continue
+            self._record_numbers.append(view.inode)
+            self._security_ids.append(security_id)
+        self._group()
+
+    def _group(self):
+        groups = {}
+        for record_number, security_id in zip(self._record_numbers, self._security_ids):
+            group = groups.get(security_id)
+            if group is None:
+                group = array.array("L")
+                groups[security_id] = group
+            group.append(record_number)
+        self._groups = groups
+
+    def load_descriptors(self, secure):
+        """
+        Decode the descriptor of each distinct security ID.
+          IDs whose descriptor can't be found are left out of queries.
+
+        @type secure: ntfs.secure.SecureFile
+        """
+        for security_id in sorted(self._groups):
+            if security_id in self._descriptors:
+                continue
+            if security_id == 0:
+                # records not yet given a descriptor, or from before NTFS 3.0
+                continue
+            try:
+                descriptor = secure.get_sds_entry(security_id).sid()
+                self._descriptors[security_id] = \
+                    DescriptorSummary.from_descriptor(security_id, descriptor)
+            except SecurityDescriptorNotFoundError:
+                g_logger.warning("No descriptor for security id %d, used by %d records",
+                                 security_id, len(self._groups[security_id]))
+            except Exception as e:
+                g_logger.warning("Failed to decode descriptor for security id %d: %s",
+                                 security_id, e)
+
+    def get_record_count(self):
+        return len(self._record_numbers)
+
+    def get_security_ids(self):
+        """
+        @rtype: list of int
+        """
+        return sorted(self._groups)
+
+    def get_group(self, security_id):
+        """
+        @rtype: array.array of int
+        @return: The numbers of the records using the security ID.
+        """
+        return self._groups.get(security_id, array.array("L"))
+
+    def get_descriptor(self, security_id):
+        """
+        @rtype: DescriptorSummary, or None
+        """
+        return self._descriptors.get(security_id)
+
+    def group_counts(self):
+        """
+        @rtype: list of (DescriptorSummary or None, int)
+        @return: Each distinct descriptor with the number of records
+          using it, most used first.
+        """
+        counts = [(self._descriptors.get(security_id), len(group))
+                  for security_id, group in self._groups.iteritems()]
+        counts.sort(key=lambda c: c[1], reverse=True)
+        return counts
+
+    def matching_security_ids(self, predicate):
+        """
+        @type predicate: callable(DescriptorSummary) -> bool
+        @rtype: list of int
+        """
+        return sorted(security_id for security_id, summary in self._descriptors.iteritems()
+                      if predicate(summary))
+
+    def records_matching(self, predicate):
+        """
+        Yield (record number, DescriptorSummary) for each record whose
+          descriptor satisfies the predicate, in record number order.
+
+        @type predicate: callable(DescriptorSummary) -> bool
+        """
+        matches = {}
+        for security_id in self.matching_security_ids(predicate):
+            summary = self._descriptors[security_id]
+            for record_number in self._groups.get(security_id, ()):
+                matches[record_number] = summary
+        for record_number in sorted(matches):
+            yield record_number, matches[record_number]
+
+    def records_owned_by(self, sid):
+        """
+        @type sid: str
+        @param sid: A SID string, such as "S-1-5-32-544".
+        """
+        return self.records_matching(lambda summary: summary.owner == sid)
+
+    def records_with_access(self, sids, access=WRITE_ACCESS):
+        """
+        Yield the records to which the SIDs are granted any of the rights
+          in `access`, by default the rights to change their contents.
+
+        @type sids: str, or iterable of str
+        @param sids: A SID string, or the SID strings of a user and its groups.
+        @type access: int
+        @param access: The ACCESS_MASK rights of interest.
+        """
+        if isinstance(sids, basestring):
+            sids = [sids]
+        sids = frozenset(sids)
+        access = map_generic_rights(access)
+        return self.records_matching(
+            lambda summary: summary.granted_access(sids) & access != 0)
+
+
+def open_security_report(fs, secure=None):
+    """
+    Build the security report of a file system.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @type secure: ntfs.secure.SecureFile
+    @rtype: SecurityReport
+    @raises SecurityDescriptorNotFoundError: if there's no $SDS stream.
+    """
+    if secure is None:
+        secure = SecureFile(fs)
+    report = SecurityReport()
+    report.load_mft(fs.get_mft_enumerator())
+    report.load_descriptors(secure)
+    return report
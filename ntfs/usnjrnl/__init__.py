@@ -0,0 +1,724 @@
+"""
+Parse the change journal, $Extend\\$UsnJrnl:$J.
+
+$J is a sparse stream: as the journal grows, Windows deallocates its
+  beginning, so only the tail is backed by clusters. The `UsnJrnl`
+  reader walks just the allocated extents of the stream, reads them in
+  large chunks, and decodes USN_RECORD_V2 and USN_RECORD_V3 structures
+  from each chunk with precompiled `struct.Struct`s. Records never span
+  a page; the zero padding at the end of each page is skipped.
+
+USNs are byte offsets into $J, so collection can resume from a
+  `UsnCheckpoint` by jumping straight to the last record seen.
+
+Records only carry the references of the file and its parent. The
+  `UsnPathResolver` turns them into full paths, as they were at the
+  time of each event, by replaying the journal over a table of the
+  directories built from the MFT.
+"""
+import os
+import re
+import json
+import struct
+import logging
+import tempfile
+
+from ntfs.BinaryParser import Block
+from ntfs.BinaryParser import parse_filetime
+from ntfs.mft.MFT import MREF
+from ntfs.mft.MFT import MSEQNO
+from ntfs.mft.MFT import FILE_SEP
+from ntfs.mft.MFT import ORPHAN_ENTRY
+from ntfs.mft.MFT import REFERENCE_MASK
+from ntfs.mft.MFT import MFTDirectoryTable
+
+
+g_logger = logging.getLogger("ntfs.usnjrnl")
+
+USNJRNL_PATH = "$Extend\\$UsnJrnl"
+USNJRNL_STREAM = "$J"
+USNJRNL_MAX_STREAM = "$Max"
+
+# the amount of $J read at a time, a multiple of the page size
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+PAGE_SIZE = 0x1000
+
+USN_RECORD_HEADER_STRUCT = struct.Struct("<IHH")
+# after the header: file reference, parent reference, usn, timestamp,
+#   reason, source info, security id, file attributes,
+#   file name length, file name offset
+USN_RECORD_V2_STRUCT = struct.Struct("<QQQQIIIIHH")
+USN_RECORD_V3_STRUCT = struct.Struct("<QQQQQQIIIIHH")
+USN_RECORD_V2_SIZE = USN_RECORD_HEADER_STRUCT.size + USN_RECORD_V2_STRUCT.size
+USN_RECORD_V3_SIZE = USN_RECORD_HEADER_STRUCT.size + USN_RECORD_V3_STRUCT.size
+
+# anything larger than this is garbage: a header plus 255 UTF-16 chars
+MAX_RECORD_SIZE = USN_RECORD_V3_SIZE + 2 * 255 + 8
+
+NONZERO = re.compile("[^\x00]")
+
+# in the file_attributes of a record
+FILE_ATTRIBUTE_DIRECTORY = 0x10
+
+
+class USN_REASONS:
+    DATA_OVERWRITE = 0x1
+    DATA_EXTEND = 0x2
+    DATA_TRUNCATION = 0x4
+    NAMED_DATA_OVERWRITE = 0x10
+    NAMED_DATA_EXTEND = 0x20
+    NAMED_DATA_TRUNCATION = 0x40
+    FILE_CREATE = 0x100
+    FILE_DELETE = 0x200
+    EA_CHANGE = 0x400
+    SECURITY_CHANGE = 0x800
+    RENAME_OLD_NAME = 0x1000
+    RENAME_NEW_NAME = 0x2000
+    INDEXABLE_CHANGE = 0x4000
+    BASIC_INFO_CHANGE = 0x8000
+    HARD_LINK_CHANGE = 0x10000
+    COMPRESSION_CHANGE = 0x20000
+    ENCRYPTION_CHANGE = 0x40000
+    OBJECT_ID_CHANGE = 0x80000
+    REPARSE_POINT_CHANGE = 0x100000
+    STREAM_CHANGE = 0x200000
+    TRANSACTED_CHANGE = 0x400000
+    INTEGRITY_CHANGE = 0x800000
+    CLOSE = 0x80000000
+
+
+USN_REASON_NAMES = dict((v, k) for k, v in USN_REASONS.__dict__.items()
+                        if not k.startswith("_"))
+
+
+def reason_names(reason):
+    """
+    @rtype: list of str
+    @return: The names of the USN_REASONS flags set in `reason`.
+    """
+    return [USN_REASON_NAMES[flag] for flag in sorted(USN_REASON_NAMES)
+            if reason & flag]
+
+
+# the fields of a record, in the order of the tuples produced by
+#   `UsnJrnl.record_tuples`, and the columns of `UsnJrnl.record_batches`
+USN_RECORD_FIELDS = (
+    "offset",
+    "major_version",
+    "minor_version",
+    "file_reference",
+    "parent_reference",
+    "usn",
+    "timestamp",
+    "reason",
+    "source_info",
+    "security_id",
+    "file_attributes",
+    "filename",
+)
+
+
+class USN_RECORD(object):
+    """
+    A decoded USN_RECORD_V2 or USN_RECORD_V3.
+
+    `timestamp` is the raw FILETIME; `file_reference` and
+      `parent_reference` are the full references, which are 128 bits
+      wide for V3 records.
+    """
+    __slots__ = USN_RECORD_FIELDS
+
+    def __init__(self, *values):
+        for name, value in zip(USN_RECORD_FIELDS, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "USN_RECORD(usn=%d, filename=%r, reason=%s)" % \
+            (self.usn, self.filename, hex(self.reason))
+
+    def mft_record_number(self):
+        return MREF(self.file_reference)
+
+    def mft_sequence_number(self):
+        return MSEQNO(self.file_reference)
+
+    def parent_record_number(self):
+        return MREF(self.parent_reference)
+
+    def parent_sequence_number(self):
+        return MSEQNO(self.parent_reference)
+
+    def timestamp_datetime(self):
+        """
+        @raise ValueError: if the timestamp is out of range.
+        """
+        return parse_filetime(self.timestamp)
+
+    def reasons(self):
+        return reason_names(self.reason)
+
+
+def decode_records(buf, base_offset=0, pos=0, end=None):
+    """
+    Decode the USN records in `buf[pos:end]`.
+
+    @type base_offset: int
+    @param base_offset: The offset of `buf` within $J, used to compute
+      record offsets and page boundaries.
+    @rtype: (list of tuple, int)
+    @return: The records, as tuples of `USN_RECORD_FIELDS`, and the
+      position of the first byte that wasn't consumed, such as when a
+      record is truncated by the end of the buffer.
+    """
+    if end is None:
+        end = len(buf)
+    header_unpack = USN_RECORD_HEADER_STRUCT.unpack_from
+    v2_unpack = USN_RECORD_V2_STRUCT.unpack_from
+    v3_unpack = USN_RECORD_V3_STRUCT.unpack_from
+    header_size = USN_RECORD_HEADER_STRUCT.size
+
+    records = []
+    while pos + header_size <= end:
+        length, major, minor = header_unpack(buf, pos)
+
+        if length == 0:
+            # page padding, or a zeroed region. skip to the next
+            #   8-byte aligned, non-zero data.
+            m = NONZERO.search(buf, pos, end)
+            if m is None:
+                return records, end
+            # the non-zero data may be in the rest of this slot, such as
+            #   the version of a record with a corrupt length.
+            pos = max(pos + 8, m.start() & ~7)
+            continue
+
+        if length % 8 != 0 or length > MAX_RECORD_SIZE or \
+           major not in (2, 3) or \
+           (major == 2 and length < USN_RECORD_V2_SIZE) or \
+           (major == 3 and length < USN_RECORD_V3_SIZE):
+            if major == 4 and length % 8 == 0 and length <= PAGE_SIZE:
+                # USN_RECORD_V4 range tracking records, not supported
+                pos += length
+                continue
+            g_logger.debug("Invalid USN record at %s", hex(base_offset + pos))
+            pos += 8
+            continue
+
+        if pos + length > end:
+            return records, pos
+
+        if major == 2:
+            (file_reference, parent_reference, usn, timestamp, reason, source_info,
+             security_id, file_attributes, name_length, name_offset) = \
+                v2_unpack(buf, pos + header_size)
+        else:
+            (file_low, file_high, parent_low, parent_high, usn, timestamp,
+             reason, source_info, security_id, file_attributes,
+             name_length, name_offset) = v3_unpack(buf, pos + header_size)
+            file_reference = file_low | (file_high << 64)
+            parent_reference = parent_low | (parent_high << 64)
+
+        if name_offset + name_length > length:
+            g_logger.debug("Invalid USN record name at %s", hex(base_offset + pos))
+            pos += 8
+            continue
+
+        name_start = pos + name_offset
+        filename = bytes(buf[name_start:name_start + name_length]).decode("utf-16le", "replace")
+        records.append((base_offset + pos, major, minor, file_reference, parent_reference,
+                        usn, timestamp, reason, source_info, security_id,
+                        file_attributes, filename))
+        pos += length
+
+    return records, pos
+
+
+class USN_JOURNAL_MAX(Block):
+    """
+    The $UsnJrnl:$Max stream, which describes the journal.
+    """
+    def __init__(self, buf, offset):
+        super(USN_JOURNAL_MAX, self).__init__(buf, offset)
+        self.declare_field("qword", "maximum_size", 0x0)
+        self.declare_field("qword", "allocation_delta")
+        # changes each time the journal is (re)created
+        self.declare_field("qword", "journal_id")
+        self.declare_field("qword", "lowest_valid_usn")
+
+
+class UsnCheckpoint(object):
+    """
+    The position of the last record collected from a journal, so that
+      collection can resume after it.
+    """
+    def __init__(self, usn, offset, journal_id=None):
+        """
+        @type usn: int
+        @type offset: int
+        @param offset: The offset of the record in $J. This is the same as
+          the USN, unless the stream was exported without its sparse head.
+        @type journal_id: int
+        @param journal_id: From $Max, if known.
+        """
+        super(UsnCheckpoint, self).__init__()
+        self.usn = usn
+        self.offset = offset
+        self.journal_id = journal_id
+
+    def __repr__(self):
+        return "UsnCheckpoint(usn=%r, offset=%r, journal_id=%r)" % \
+            (self.usn, self.offset, self.journal_id)
+
+    @classmethod
+    def load(cls, path):
+        """
+        @rtype: UsnCheckpoint, or None if the file doesn't exist.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            d = json.load(f)
+        return cls(d["usn"], d["offset"], d.get("journal_id"))
+
+    def save(self, path):
+        """
+        Write the checkpoint atomically, so that an interrupted run leaves
+          either the old or the new checkpoint, never a partial one.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=".usn-checkpoint-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                json.dump({"usn": self.usn,
+                           "offset": self.offset,
+                           "journal_id": self.journal_id}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows won't rename over an existing file
+                os.remove(path)
+                os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+class UsnJrnl(object):
+    """
+    A reader for the records of $UsnJrnl:$J.
+    """
+    def __init__(self, data, size=None, extents=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 journal_id=None):
+        """
+        @type data: NonResidentAttributeData or str
+        @param data: The contents of the $J stream.
+        @type size: int
+        @param size: The logical size of the stream, by default `len(data)`.
+        @type extents: iterable of (int, int)
+        @param extents: The (start, end) byte ranges of the stream that
+          are allocated, by default as provided by
+          `data.get_allocated_ranges`, or all of it.
+        @type chunk_size: int
+        @param chunk_size: The amount of data decoded at a time.
+        @type journal_id: int
+        @param journal_id: From $Max, if known, used to validate checkpoints.
+        """
+        super(UsnJrnl, self).__init__()
+        self._data = data
+        self._journal_id = journal_id
+        if size is None:
+            size = len(data)
+        self._size = size
+        if extents is None:
+            if hasattr(data, "get_allocated_ranges"):
+                extents = data.get_allocated_ranges()
+            else:
+                extents = [(0, size)]
+        self._extents = [(start, min(end, size)) for start, end in extents
+                         if start < size]
+        self._chunk_size = max(PAGE_SIZE, chunk_size - chunk_size % PAGE_SIZE)
+
+    def get_extents(self):
+        """
+        @rtype: list of (int, int)
+        @return: The allocated (start, end) byte ranges of the stream.
+        """
+        return self._extents
+
+    def record_tuples(self, start=0):
+        """
+        Yield each record as a tuple of `USN_RECORD_FIELDS`, in order.
+
+        @type start: int
+        @param start: The offset in $J from which to begin.
+        """
+        for extent_start, extent_end in self._extents:
+            if extent_end <= start:
+                continue
+            offset = max(extent_start, start)
+            while offset < extent_end:
+                chunk_end = min(offset + self._chunk_size, extent_end)
+                buf = self._data[offset:chunk_end]
+                records, consumed = decode_records(buf, base_offset=offset)
+                for record in records:
+                    yield record
+
+                if consumed == 0 and chunk_end < extent_end:
+                    # there's at least one page in a chunk,
+                    #   and records don't span pages.
+                    consumed = PAGE_SIZE
+                offset += consumed
+                if chunk_end == extent_end:
+                    break
+
+    def records(self, start=0):
+        """
+        Yield each record as a USN_RECORD, in order.
+
+        @rtype: generator of USN_RECORD
+        """
+        for values in self.record_tuples(start=start):
+            yield USN_RECORD(*values)
+
+    def get_journal_id(self):
+        return self._journal_id
+
+    def _record_at(self, offset):
+        """
+        Decode the single record that starts exactly at `offset`.
+
+        @rtype: tuple of USN_RECORD_FIELDS, or None
+        """
+        for extent_start, extent_end in self._extents:
+            if extent_start <= offset < extent_end:
+                break
+        else:
+            return None
+        # records don't span pages
+        end = min(offset + PAGE_SIZE - offset % PAGE_SIZE, extent_end)
+        records, _ = decode_records(self._data[offset:end], base_offset=offset)
+        if not records or records[0][0] != offset:
+            return None
+        return records[0]
+
+    def resume_offset(self, usn, offset=None, journal_id=None):
+        """
+        Find where the records following the record with the given USN
+          begin. Since USNs are offsets into $J, this doesn't search.
+
+        @type offset: int
+        @param offset: Where the record was found, if not at the offset `usn`.
+        @type journal_id: int
+        @param journal_id: The journal the USN came from, if known.
+        @rtype: int, or None
+        @return: The offset from which to read new records, or None if
+          the record can't be found, and `records_since` must filter by USN.
+        """
+        if journal_id is not None and self._journal_id is not None and \
+           journal_id != self._journal_id:
+            g_logger.warning("The journal has been recreated, reading all records")
+            return 0
+
+        candidates = [usn]
+        if offset is not None and offset != usn:
+            candidates.insert(0, offset)
+
+        for candidate in candidates:
+            record = self._record_at(candidate)
+            if record is not None and record[5] == usn:
+                return candidate + USN_RECORD_HEADER_STRUCT.unpack_from(
+                    self._data[candidate:candidate + USN_RECORD_HEADER_STRUCT.size])[0]
+
+        if self._extents and usn < self._extents[0][0]:
+            g_logger.warning("The journal has been trimmed past USN %d, "
+                             "some records have been lost", usn)
+            return 0
+        g_logger.warning("Record with USN %d not found, searching", usn)
+        return None
+
+    def records_since(self, checkpoint):
+        """
+        Yield the USN_RECORDs following the one described by `checkpoint`.
+
+        @type checkpoint: UsnCheckpoint
+        @rtype: generator of USN_RECORD
+        """
+        start = self.resume_offset(checkpoint.usn, offset=checkpoint.offset,
+                                   journal_id=checkpoint.journal_id)
+        if start is not None:
+            for record in self.records(start=start):
+                yield record
+            return
+
+        for record in self.records():
+            if record.usn > checkpoint.usn:
+                yield record
+
+    def checkpoint(self, record):
+        """
+        @type record: USN_RECORD
+        @rtype: UsnCheckpoint
+        """
+        return UsnCheckpoint(record.usn, record.offset, journal_id=self._journal_id)
+
+    def record_batches(self, batch_size=0x10000, start=0):
+        """
+        Yield the records in batches of columns: dicts mapping from each
+          of `USN_RECORD_FIELDS` to a list of values. This avoids creating
+          an object per record, and suits bulk processing, such as
+          `ntfs.BinaryParser.format_filetimes` over the timestamp column.
+
+        @rtype: generator of dict(str, list)
+        """
+        batch = []
+        for values in self.record_tuples(start=start):
+            batch.append(values)
+            if len(batch) >= batch_size:
+                yield dict(zip(USN_RECORD_FIELDS, map(list, zip(*batch))))
+                batch = []
+        if batch:
+            yield dict(zip(USN_RECORD_FIELDS, map(list, zip(*batch))))
+
+
+class UsnJrnlNotFoundError(Exception):
+    def __init__(self, msg):
+        self._msg = msg
+
+    def __str__(self):
+        return "$UsnJrnl not found: %s" % (self._msg)
+
+
+def open_usnjrnl(fs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Open the change journal of a file system.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @rtype: UsnJrnl
+    @raises UsnJrnlNotFoundError: if the journal isn't enabled.
+    """
+    try:
+        entry = fs.get_root_directory().get_path_entry(USNJRNL_PATH)
+    except Exception as e:
+        raise UsnJrnlNotFoundError(str(e) or USNJRNL_PATH)
+
+    # sorry, reaching
+    record = entry._record
+    attribute = record.data_attribute(USNJRNL_STREAM)
+    if attribute is None:
+        raise UsnJrnlNotFoundError("no %s stream" % (USNJRNL_STREAM))
+
+    if attribute.non_resident() == 0:
+        data = attribute.value()
+        size = len(data)
+    else:
+        data = fs.get_attribute_data(attribute)
+        size = attribute.data_size()
+
+    journal_id = None
+    max_attribute = record.data_attribute(USNJRNL_MAX_STREAM)
+    if max_attribute is not None:
+        try:
+            journal_id = USN_JOURNAL_MAX(fs.get_attribute_data(max_attribute), 0).journal_id()
+        except Exception as e:
+            g_logger.warning("Failed to parse %s: %s", USNJRNL_MAX_STREAM, e)
+
+    return UsnJrnl(data, size=size, chunk_size=chunk_size, journal_id=journal_id)
+
+
+class UsnPathResolver(MFTDirectoryTable):
+    """
+    Resolve the paths of the files referenced by USN records, as they
+      were when each record was written.
+
+    The resolver keeps the table of directories of the MFT. Only
+      directories are tracked, since a record carries the name of its own
+      file. As records are annotated in journal order, each record of a
+      directory (such as its RENAME_OLD_NAME and RENAME_NEW_NAME records)
+      updates the table, so later records see the directory under its new
+      name or parent.
+
+    The MFT describes the directories at the end of the journal. Use
+      `seed` first, with the same records, to rewind each directory to
+      its state at its first appearance in the journal, so that events
+      preceding a rename get the old name.
+    """
+    def load_mft(self, enumerator, include_inactive=True):
+        """
+        Add the directories of the MFT to the table, including freed
+          ones, since the journal may still refer to them.
+
+        @type enumerator: ntfs.mft.MFT.MFTEnumerator
+        """
+        super(UsnPathResolver, self).load_mft(enumerator,
+                                              include_inactive=include_inactive)
+
+    def seed(self, records):
+        """
+        Rewind the table to the start of the given records: each directory
+          takes the name and parent of its first record.
+          Pass the same records that will be annotated.
+
+        @type records: iterable of USN_RECORD
+        """
+        seen = set()
+        for record in records:
+            if not record.file_attributes & FILE_ATTRIBUTE_DIRECTORY:
+                continue
+            record_number = MREF(record.file_reference)
+            if record_number in seen:
+                continue
+            seen.add(record_number)
+            self._directories[record_number] = (MSEQNO(record.file_reference),
+                                                record.parent_reference & REFERENCE_MASK,
+                                                record.filename)
+        self._paths.clear()
+
+    def resolve(self, file_reference, parent_reference, filename, file_attributes=0):
+        """
+        Get the path of the file of a record, then apply the record
+          to the table.
+
+        @rtype: unicode
+        """
+        path = self.get_path(parent_reference) + FILE_SEP + filename
+        if file_attributes & FILE_ATTRIBUTE_DIRECTORY:
+            self.update(file_reference, parent_reference, filename)
+        return path
+
+    def annotate(self, records):
+        """
+        Yield (USN_RECORD, path) for each record, in journal order.
+
+        @type records: iterable of USN_RECORD
+        """
+        resolve = self.resolve
+        for record in records:
+            yield record, resolve(record.file_reference, record.parent_reference,
+                                  record.filename, record.file_attributes)
+
+    def annotate_batches(self, batches):
+        """
+        Add a "path" column to each batch of `UsnJrnl.record_batches`.
+        """
+        resolve = self.resolve
+        for batch in batches:
+            batch["path"] = map(resolve, batch["file_reference"], batch["parent_reference"],
+                                batch["filename"], batch["file_attributes"])
+            yield batch
+
+
+def open_path_resolver(fs, records=None):
+    """
+    Build a path resolver for the journal of a file system.
+
+    Rewinding reads all of `records` before anything is annotated, so
+      the journal is read twice. This can't be folded into the pass that
+      annotates the records: a directory's earlier name or parent is only
+      known from its RENAME_OLD_NAME record, and the events in it that
+      precede that record need the earlier path.
+
+    @type fs: ntfs.filesystem.NTFSFilesystem
+    @type records: iterable of USN_RECORD
+    @param records: The records that will be annotated, used to rewind
+      the resolver to their start. See `UsnPathResolver.seed`.
+    @rtype: UsnPathResolver
+    """
+    resolver = UsnPathResolver()
+    resolver.load_mft(fs.get_mft_enumerator())
+    if records is not None:
+        resolver.seed(records)
+    return resolver
+
+
+def _pack_test_record(usn, file_reference, parent_reference, filename,
+                      reason=USN_REASONS.FILE_CREATE, file_attributes=0):
+    """
+    Build a USN_RECORD_V2, padded to 8 bytes.
+    """
+    name = filename.encode("utf-16le")
+    length = (USN_RECORD_V2_SIZE + len(name) + 7) & ~7
+    return (USN_RECORD_HEADER_STRUCT.pack(length, 2, 0) +
+            USN_RECORD_V2_STRUCT.pack(file_reference, parent_reference, usn,
+                                      0x01d0000000000000, reason, 0, 0, file_attributes,
+                                      len(name), USN_RECORD_V2_SIZE) +
+            name).ljust(length, "\x00")
+
+
+def test():
+    first = _pack_test_record(0x1000, (1 << 48) | 40, (5 << 48) | 5, u"a.txt")
+    second = _pack_test_record(0x1000 + len(first), (2 << 48) | 41, (5 << 48) | 5, u"b\u00e9")
+    buf = (first + second).ljust(PAGE_SIZE, "\x00") + first
+
+    records, pos = decode_records(buf, base_offset=0x1000)
+    assert pos == len(buf)
+    assert [(r[0], r[-1]) for r in records] == \
+        [(0x1000, u"a.txt"), (0x1000 + len(first), u"b\u00e9"), (0x2000, u"a.txt")]
+    assert MREF(records[1][3]) == 41
+
+    # a record truncated by the end of the buffer is left for the next chunk
+    records, pos = decode_records(first + second[:-8])
+    assert len(records) == 1
+    assert pos == len(first)
+
+    # a zero length followed by non-zero bytes in the same slot
+    records, pos = decode_records("\x00" * 4 + "\x02\x00\x00\x00" + "\x00" * 56, 0, 0, 64)
+    assert records == []
+    assert pos == 64
+    records, pos = decode_records("\x00" * 4 + "\x02\x00\x00\x00" + first)
+    assert [r[-1] for r in records] == [u"a.txt"]
+
+    # a journal whose first page has been deallocated
+    page = "".join(_pack_test_record(PAGE_SIZE + 0x40 * i, (1 << 48) | (40 + i),
+                                     (5 << 48) | 5, u"f%d" % i)
+                   for i in xrange(3))
+    assert len(page) == 0x40 * 3
+    journal = UsnJrnl("\x00" * PAGE_SIZE + page.ljust(PAGE_SIZE, "\x00"),
+                      extents=[(PAGE_SIZE, 2 * PAGE_SIZE)], journal_id=7)
+    records = list(journal.records())
+    assert [r.filename for r in records] == [u"f0", u"f1", u"f2"]
+
+    fd, path = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    try:
+        journal.checkpoint(records[0]).save(path)
+        checkpoint = UsnCheckpoint.load(path)
+    finally:
+        os.remove(path)
+    assert UsnCheckpoint.load(path) is None
+    assert (checkpoint.usn, checkpoint.offset, checkpoint.journal_id) == \
+        (PAGE_SIZE, PAGE_SIZE, 7)
+    assert [r.filename for r in journal.records_since(checkpoint)] == [u"f1", u"f2"]
+    # a checkpoint of a trimmed journal, or of another journal, reads everything
+    assert len(list(journal.records_since(UsnCheckpoint(0x10, 0x10, 7)))) == 3
+    assert len(list(journal.records_since(UsnCheckpoint(PAGE_SIZE, PAGE_SIZE, 8)))) == 3
+
+    # directory 40 is renamed from "old" to "new" between two file events
+    root = (5 << 48) | 5
+    directory = (1 << 48) | 40
+    buf = "".join([
+        _pack_test_record(0x00, (1 << 48) | 41, directory, u"a.txt"),
+        _pack_test_record(0x40, directory, root, u"old",
+                          reason=USN_REASONS.RENAME_OLD_NAME,
+                          file_attributes=FILE_ATTRIBUTE_DIRECTORY),
+        _pack_test_record(0x80, directory, root, u"new",
+                          reason=USN_REASONS.RENAME_NEW_NAME,
+                          file_attributes=FILE_ATTRIBUTE_DIRECTORY),
+        _pack_test_record(0xC0, (1 << 48) | 42, directory, u"b.txt"),
+        _pack_test_record(0x100, (1 << 48) | 43, (1 << 48) | 99, u"c.txt"),
+    ])
+    records = [USN_RECORD(*values) for values in decode_records(buf)[0]]
+    resolver = UsnPathResolver()
+    # the MFT describes the directory after the rename
+    resolver.update(directory, root, u"new")
+    resolver.seed(records)
+    assert [resolved for _, resolved in resolver.annotate(records)] == [
+        u"\\old\\a.txt", u"\\old", u"\\new", u"\\new\\b.txt",
+        ORPHAN_ENTRY + u"\\c.txt"]
+    print("usnjrnl passed tests.")
+
+
+if __name__ == "__main__":
+    test()
@@ -3,6 +3,11 @@ from ntfs.BinaryParser import Mmap
 from ntfs.FileMap import FileMap
 
 
+# the amount of data copied at a time by `Volume.find`, when the
+#   underlying buffer can't search itself.
+FIND_WINDOW_SIZE = 16 * 1024 * 1024
+
+
 class Volume(Block):
     """
     A volume is a logically contiguous run of bytes over which a FS is found.
@@ -23,6 +28,40 @@ class Volume(Block):
     def __len__(self):
         return len(self._buf) - self._offset
 
+    def get_sector_size(self):
+        return self._sector_size
+
+    def find(self, sub, start=0, end=None):
+        """
+        Like `str.find`, the lowest offset of `sub` within the volume
+          between `start` and `end`, or -1 if it's not found.
+
+        When the underlying buffer supports it (such as a `mmap.mmap`), this
+          delegates to its native `find` and doesn't copy any data.
+        """
+        if end is None or end > len(self):
+            end = len(self)
+        if start >= end:
+            return -1
+
+        if hasattr(self._buf, "find"):
+            hit = self._buf.find(sub, start + self._offset, end + self._offset)
+            if hit == -1:
+                return -1
+            return hit - self._offset
+
+        # search a window at a time, with an overlap so that matches
+        #   spanning two windows are found.
+        pos = start
+        while pos < end:
+            window_end = min(pos + FIND_WINDOW_SIZE, end)
+            data = self[pos:min(window_end + len(sub) - 1, end)]
+            hit = data.find(sub)
+            if hit != -1:
+                return pos + hit
+            pos = window_end
+        return -1
+
 
 class FlatVolume(Volume):
     """
@@ -32,6 +71,26 @@ class FlatVolume(Volume):
         super(FlatVolume, self).__init__(buf, offset, sector_size=sector_size)
 
 
+def split_aligned_ranges(ranges, window_size, overlap=0):
+    """
+    Split the (start, end) byte ranges of a volume into windows that
+      don't cross multiples of `window_size`, so that reads of them are
+      aligned, except at the ends of the ranges.
+
+    @type overlap: int
+    @param overlap: Extend each window by this many bytes into the next
+      window of the same range, so that a match of up to `overlap + 1`
+      bytes that crosses a boundary is seen whole by the window in which
+      it starts. Shorter matches that start in the overlap are seen by
+      both windows.
+    """
+    for start, end in ranges:
+        while start < end:
+            stop = min(end, (start // window_size + 1) * window_size)
+            yield start, min(end, stop + overlap)
+            start = stop
+
+
 def main():
     import sys
 
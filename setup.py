@@ -16,9 +16,10 @@ setup(name="python-ntfs",
             "ntfs.mft",
             "ntfs.volume",
             "ntfs.filesystem",
-            #"nfts.secure",
-            #"ntfs.logfile",
-            #"ntfs.usnjrnl",
+            "ntfs.carve",
+            "ntfs.secure",
+            "ntfs.logfile",
+            "ntfs.usnjrnl",
             ],
         classifiers=["Programming Language :: Python",
             "Operating System :: OS Independent",